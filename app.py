@@ -6,22 +6,25 @@
 """
 
 import streamlit as st
+import pandas as pd
 import json
-import uuid
 from pathlib import Path
 from decimal import Decimal
 import datetime
-import tempfile
-import os
 
 # Добавляем путь к модулям
 import sys
 sys.path.insert(0, str(Path(__file__).parent))
 
 from modules.calculator import Calculator, Estimate, WorkItem
-from modules.export_excel import export_to_excel
-from modules.export_pdf import export_to_pdf
-from modules.export_word import export_to_word
+from modules.additional_costs import calculate_additional_costs as _calculate_additional_costs
+from modules.solver import InverseSolver
+from modules.templates import (
+    load_templates, compile_templates, compose_templates, template_detail_rows, template_version
+)
+from modules.justifications import get_justification_index
+from modules.draft import DraftItem, EstimateDraft, evaluate_draft, normalize_draft
+from modules.export import EXPORT_FORMATS, build_export, estimate_fingerprint, export_filename, run_export_job
 from config import (
     APP_TITLE, APP_ICON, APP_LAYOUT, 
     SOIL_CATEGORIES, COMPLEXITY_CATEGORIES, FIELD_WORK_CATEGORIES,
@@ -42,14 +45,33 @@ st.set_page_config(
 def get_calculator_v8():
     return Calculator()
 
-st.cache_resource.clear()
-st.cache_resource.clear()
 calc = get_calculator_v8()
 
 
+@st.cache_resource
+def get_templates_data():
+    """Каталог шаблонов смет (загружается один раз)"""
+    return load_templates()
+
+
+@st.cache_resource
+def get_template_models():
+    """Шаблоны, свёрнутые в линейные функции множителя (компилируются один раз)"""
+    return compile_templates(calc, get_templates_data().get("templates", []))
+
+
+@st.cache_data
+def get_template_details(template_id: str, version: str) -> list:
+    """Строки состава работ шаблона (кэш по id и версии шаблона)"""
+    for template in get_templates_data().get("templates", []):
+        if template["id"] == template_id:
+            return template_detail_rows(calc, template)
+    return []
+
+
 # Инициализация состояния
-if "estimate_items" not in st.session_state:
-    st.session_state.estimate_items = []
+if "draft" not in st.session_state:
+    st.session_state.draft = EstimateDraft()
 
 if "project_info" not in st.session_state:
     st.session_state.project_info = {
@@ -293,218 +315,331 @@ with st.sidebar:
     st.session_state.project_info["k_contract"] = k_contract
 
 
-def load_templates():
-    """Загрузка шаблонов смет"""
-    data_path = Path(__file__).parent / "data" / "templates.json"
-    with open(data_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+def calculate_additional_costs(field_cost: float, project_info: dict, lab_cost: float = 0) -> list:
+    """Расчет дополнительных затрат (п.20-48 НЗ №281/пр), см. modules/additional_costs.py"""
+    return _calculate_additional_costs(calc, field_cost, project_info, lab_cost=lab_cost)
 
 
+# Панели, которые зависят от позиций сметы, но не перерисовываются при правке таблицы
+ESTIMATE_PANELS = ("dz_panel", "export_panel")
 
-def calculate_additional_costs(field_cost: float, project_info: dict, lab_cost: float = 0) -> list:
-    """Расчет дополнительных затрат (п.20-48 НЗ №281/пр)
-    
-    Формула 3: ДЗП = ДЗНП + ДЗноч + ДЗрежим + ДЗпроезд + ДЗорг + ДЗрП + ДЗсП
-    
-    Args:
-        field_cost: стоимость полевых работ (СПпз)
-        project_info: информация о проекте (регион, расстояние, флаги)
-        lab_cost: стоимость лабораторных работ (СЛпз) для расчёта ДЗрайонЛ
+
+def estimate_revision() -> int:
+    """Ревизия черновика сметы"""
+    return st.session_state.draft.revision
+
+
+def commit_draft(draft: EstimateDraft):
+    """Сохранить новую ревизию черновика: зависимые панели становятся устаревшими"""
+    st.session_state.draft = draft
+
+
+def current_draft() -> EstimateDraft:
+    """Черновик, приведённый к параметрам проекта (программа, отчёт, формулы).
+
+    Нормализация выполняется один раз на ревизию и параметры — повторный
+    вызов в той же ревизии стоит сравнения кортежей.
     """
-    coefficients = load_coefficients()
-    
-    # === 1. ДЗ на неблагоприятный период (формула 4, п.21) ===
-    if project_info.get("is_unfavorable_period_active", False):
-        region = project_info.get("region", "г. Москва")
-        regions = get_region_list()
-        unfav_duration = regions.get(region, 6.0)
-        
-        unfav_coefs = coefficients.get("unfavorable_period", {}).get("coefficients_by_duration_months", {})
-        unfav_percent = 0
-        
-        for range_key, percents in unfav_coefs.items():
-            if calc._check_duration_range(unfav_duration, range_key):
-                cost_key = calc._get_cost_range_key(field_cost)
-                unfav_percent = percents.get(cost_key, 0)
-                break
-        
-        dz_unfav = field_cost * unfav_percent / 100
-    else:
-        dz_unfav = 0
-        unfav_percent = 0
+    info = st.session_state.project_info
+    key = (estimate_revision(), info.get("complexity", "II"), info.get("max_depth", "10"))
+    if st.session_state.get("draft_normalized") != key:
+        commit_draft(normalize_draft(calc, st.session_state.draft, key[1], key[2]))
+        st.session_state.draft_normalized = (estimate_revision(), key[1], key[2])
+    return st.session_state.draft
+
+
+def mark_panel_fresh(name: str):
+    st.session_state[f"rev_{name}"] = estimate_revision()
+
+
+def panel_is_stale(name: str) -> bool:
+    return st.session_state.get(f"rev_{name}", estimate_revision()) != estimate_revision()
+
+
+def panel_header(title: str, name: str):
+    """Заголовок панели-фрагмента с кнопкой пересчёта по текущей смете"""
+    title_col, refresh_col = st.columns([6, 1])
+    with title_col:
+        st.subheader(title)
+    with refresh_col:
+        st.button("🔄 Обновить", key=f"refresh_{name}", help="Пересчитать по текущей смете")
+
+
+def on_quantity_change(uid: str):
+    """Колбэк поля «Кол-во»: правка применяется до перерисовки таблицы"""
+    commit_draft(st.session_state.draft.update(uid, quantity=st.session_state[f"qty_{uid}"]))
+
+
+def on_move_item(uid: str, step: int):
+    """Колбэк ⬆/⬇: поменять позицию с соседней позицией той же категории"""
+    draft = st.session_state.draft
+    idx = draft.index(uid)
+    if idx is not None:
+        items = list(draft.items)
+        if calc.move_item(items, idx, step) is not None:
+            commit_draft(draft.with_items(items))
+
+
+def on_delete_item(uid: str):
+    commit_draft(st.session_state.draft.remove([uid]))
+
+
+# Смета длиннее этого числа позиций по умолчанию открывается в табличном режиме
+GRID_MODE_MIN_ITEMS = 50
+
+# Колонки сетки, которые пользователь может править
+GRID_EDITABLE = ("№", "Кол-во", "Удалить")
+
+
+def on_grid_edit(key: str, uids: list):
+    """Колбэк табличного режима: все правки сетки применяются к позициям одним пакетом.
+
+    Новый № переставляет позицию внутри её раздела: позиции раздела
+    сортируются по номерам и занимают те же места в списке сметы.
+    """
+    edited_rows = st.session_state[key].get("edited_rows", {})
+    if not edited_rows:
+        return
+    draft = st.session_state.draft
+    items = list(draft.items)
+    positions = {item.uid: idx for idx, item in enumerate(items)}
+    numbers, deleted = {}, set()
+    for row, changes in edited_rows.items():
+        uid = uids[int(row)]
+        if uid not in positions:
+            continue
+        if changes.get("Удалить"):
+            deleted.add(uid)
+            continue
+        if changes.get("Кол-во") is not None:
+            idx = positions[uid]
+            items[idx] = items[idx].evolve(quantity=float(changes["Кол-во"]))
+        if changes.get("№") is not None:
+            numbers[uid] = changes["№"]
+
+    if numbers:
+        position = {uid: num for num, uid in enumerate(uids, 1)}
+        # При равных номерах перенесённая позиция встаёт перед стоявшей там
+        def sort_key(item):
+            return (numbers.get(item.uid, position.get(item.uid, 0)), item.uid not in numbers)
+        for indices in calc.category_order(items).groups().values():
+            for idx, item in zip(indices, sorted((items[i] for i in indices), key=sort_key)):
+                items[idx] = item
+
+    commit_draft(draft.with_items(item for item in items if item.uid not in deleted))
+
+
+def render_estimate_grid(sections: list) -> list:
+    """Табличный режим: вся смета в одном st.data_editor.
+
+    sections: [(номер раздела, строки позиций)]; возвращает итоги разделов.
+    Ключ сетки меняется с каждой правкой сметы, поэтому применённые правки
+    не накладываются повторно на обновлённые данные.
+    """
+    rows, uids, totals = [], [], []
+    for section_code, items_list in sections:
+        for item in items_list:
+            uids.append(item["uid"])
+            rows.append({
+                "№": len(rows) + 1,
+                "Раздел": section_code,
+                "Наименование работ и затрат": item["name"],
+                "Ед.": item["unit"],
+                "Кол-во": float(item["quantity"]),
+                "Обоснование": f"НЗ №281/пр, {item['table_ref']}",
+                "Расчёт": item["formula_display"],
+                "Стоимость": f"{item['total_cost']:,.0f}",
+                "Удалить": False,
+            })
+        totals.append(sum(item["total_cost"] for item in items_list))
+
+    key = f"estimate_grid_{estimate_revision()}"
+    frame = pd.DataFrame(rows)
+    st.data_editor(
+        frame,
+        key=key,
+        hide_index=True,
+        use_container_width=True,
+        height=min(36 * (len(rows) + 1) + 3, 640),
+        num_rows="fixed",
+        disabled=[column for column in frame.columns if column not in GRID_EDITABLE],
+        column_config={
+            "№": st.column_config.NumberColumn(min_value=1, step=1, help="Новый номер переставляет позицию внутри раздела"),
+            "Кол-во": st.column_config.NumberColumn(min_value=0.0, step=1.0, format="%.1f"),
+            "Наименование работ и затрат": st.column_config.TextColumn(width="large"),
+            "Удалить": st.column_config.CheckboxColumn("🗑️"),
+        },
+        on_change=on_grid_edit,
+        args=(key, uids),
+    )
+    for section_code, total in zip(("I (СПпз)", "II (СЛпз)", "III (СКпз)"), totals):
+        if total:
+            st.markdown(f"**Итого по разделу {section_code}:** {total:,.0f}")
+    st.divider()
+    return totals
+
+
+def render_template_details(template: dict, model):
+    """Подробности шаблона: методика, состав работ, предрасчёт и применение"""
+    # Нормативные документы
+    st.markdown("**📚 Нормативные документы:**")
+    for doc in template.get("normative_docs", []):
+        st.markdown(f"- {doc}")
+    
+    # Методика расчёта
+    if template.get("methodology"):
+        st.divider()
+        st.markdown("**📋 Методика (требования):**")
+        for method in template["methodology"]:
+            st.markdown(f"- **{method['item']}**: {method['requirement']}")
+            st.caption(f"   _Источник: {method['source']}_")
     
-    # === 2. ДЗ на неизбежные перерывы (формула 6, п.26-27) ===
-    # ДЗрежим = СПрежим × ПДЗрежим
-    # ПДЗрежим = 25% для объектов п.27
-    if project_info.get("is_regime_object", False):
-        regime_data = coefficients.get("intermittent_work", {})
-        regime_percent = regime_data.get("pdz_regime_percent", 25)
-        dz_regime = field_cost * regime_percent / 100
-    else:
-        dz_regime = 0
-        regime_percent = 0
+    st.divider()
     
-    # === 3. ДЗ на проезд (формулы 7-8, п.28-36) ===
-    distance = project_info.get("distance_km", 50)
-    transport_type = project_info.get("transport_type", "auto")  # auto / non_auto
-    has_static_sounding = project_info.get("has_static_sounding", False)
-    use_interpolation = project_info.get("use_interpolation", True)
+    # Множитель для per_support / per_km шаблонов
+    multiplier = 1
+    if model.multiplier_kind == "per_support":
+        mult_label = template.get("multiplier_label", "Количество опор")
+        st.markdown(f"**🔢 {mult_label}:**")
+        multiplier = st.number_input(
+            mult_label, 
+            value=3, min_value=1, max_value=1000, step=1,
+            key=f"mult_{template['id']}",
+            help=f"Объемы бурения и лаборатории умножаются на {mult_label.lower()}. Программа и отчёт — 1 раз."
+        )
+        st.divider()
+    elif model.multiplier_kind == "per_km":
+        st.markdown("**🔢 Протяженность трассы (км):**")
+        multiplier = st.number_input(
+            "Количество км", 
+            value=1, min_value=1, max_value=1000, step=1,
+            key=f"mult_{template['id']}",
+            help="Объемы бурения умножаются на количество км. Программа и отчёт — 1 раз."
+        )
+        st.divider()
     
-    # Выбор таблицы коэффициентов по типу транспорта и зондирования
-    if transport_type == "auto":
-        if not has_static_sounding:
-            travel_table_key = "travel_costs_IZ"  # Таблица 4 (авто, без зондирования)
-            travel_table_name = "Таблица 4"
-            travel_paragraph = "п.29"
-        else:
-            travel_table_key = "travel_costs_NZ"  # Таблица 5 (авто, с зондированием)
-            travel_table_name = "Таблица 5"
-            travel_paragraph = "п.30"
-    else:
-        if not has_static_sounding:
-            travel_table_key = "travel_costs_table6"  # Таблица 6 (не авто, без зондирования)
-            travel_table_name = "Таблица 6"
-            travel_paragraph = "п.33"
+    # Состав работ с ссылками на НЗ
+    st.markdown("**📝 Состав работ:**")
+    missing_justifications = get_justification_index().missing.get(template["id"])
+    if missing_justifications:
+        st.caption(f"⚠️ Нет обоснования объёма для {len(missing_justifications)} поз.: {', '.join(missing_justifications)}")
+    # Предварительный расчёт (замкнутая форма: fixed + per_unit × множитель)
+    preview = model.preview(calc, multiplier, st.session_state.project_info.get("max_depth", "10"))
+    detail_rows = get_template_details(template["id"], template_version(template))
+    for item_idx, row in enumerate(detail_rows):
+        scalable = row["scalable"]
+        qty = row["quantity"] * multiplier if scalable else row["quantity"]
+        # Отчёт и программа в смете считаются по Таблицам 65 и 66, а не по расценке позиции шаблона
+        if row["group"] in ("report", "program"):
+            item_cost = preview[row["group"]]
         else:
-            travel_table_key = "travel_costs_table7"  # Таблица 7 (не авто, с зондированием)
-            travel_table_name = "Таблица 7"
-            travel_paragraph = "п.34"
-    
-    travel_coefs = coefficients.get(travel_table_key, {}).get("coefficients_by_distance_km", {})
-    
-    # Определяем ключ стоимостного диапазона
-    # Для travel_costs_NZ и table7 — другие диапазоны стоимости
-    if travel_table_key in ("travel_costs_NZ", "travel_costs_table7"):
-        cost_key = calc._get_travel_cost_range_key(field_cost)
-    else:
-        cost_key = calc._get_cost_range_key(field_cost)
-    
-    # Расчёт процента — с интерполяцией или без
-    if use_interpolation and travel_coefs:
-        travel_percent = calc.interpolate_coefficient(distance, travel_coefs, cost_key)
-    else:
-        travel_percent = 0
-        for dist_key, percents in travel_coefs.items():
-            if calc._check_distance_range(distance, dist_key):
-                travel_percent = percents.get(cost_key, 0) or 0
-                break
-    
-    dz_travel = field_cost * travel_percent / 100
-    
-    # === 4. ДЗ на организацию полевых работ (п.37-39, Таблица 20) ===
-    # ДЗорг = СПпз × ПДЗорг / 100
-    # Не применяется если работы по месту постоянной работы (п.38)
-    is_local = project_info.get("is_local_work", False)
-    
-    if not is_local:
-        org_coefs = coefficients.get("organization_costs", {}).get("coefficients_by_distance_km", {})
-        org_percent = 0
-        org_cost_key = calc._get_cost_range_key(field_cost)
+            item_cost = model.item_cost(item_idx, multiplier)
         
-        for dist_key, percents in org_coefs.items():
-            if calc._check_distance_range(distance, dist_key):
-                org_percent = percents.get(org_cost_key, 0) or 0
-                break
-                
-        dz_org = field_cost * org_percent / 100
-    else:
-        dz_org = 0
-        org_percent = 0
-    
-    # === 5. ДЗ на районные выплаты — полевые (формула 10, п.40) ===
-    # ДЗрП = (СПпз + ДЗНП + ДЗрежим + ДЗноч + ДЗорг) × (ДЗП × ПДЗр + ДпрочП - 1)
-    # где: ДЗП = доля ФОТ = 0.41 (labor_share_field)
-    #       ДпрочП = доля прочих = 0.59 (other_share_field)
-    #       ПДЗр = районный коэффициент
-    region = project_info.get("region", "г. Москва")
-    pdz_r = calc.get_regional_coefficient(region)
-    
-    reg_data = coefficients.get("regional_allowances", {})
-    dzp_share = reg_data.get("labor_share_field", 0.41)
-    dproch_field = reg_data.get("other_share_field", 0.59)
-    
-    dz_rp = 0
-    rp_multiplier = 0
-    
-    if pdz_r > 1.0:
-        # База для районных = СПпз + ДЗНП + ДЗрежим + ДЗноч + ДЗорг
-        base_for_regional = field_cost + dz_unfav + dz_regime + dz_org
-        # Множитель: (ДЗП × ПДЗр + ДпрочП - 1)
-        rp_multiplier = dzp_share * pdz_r + dproch_field - 1
-        dz_rp = base_for_regional * rp_multiplier
-    
-    # === 6. ДЗ на районные выплаты — лабораторные (формула 14, п.47) ===
-    # ДЗрайонЛ = СЛпз × (ДЗПЛ × ПДЗрайон + ДпрочЛ - 1)
-    # ВАЖНО: если лаборатория в СПб — районный коэффициент к лаб. НЕ начисляется (К=1.0 в СПб)
-    dz_lab_regional = 0
-    lab_rp_multiplier = 0
-    lab_in_spb = project_info.get("lab_in_spb", True)
-    
-    if pdz_r > 1.0 and lab_cost > 0 and not lab_in_spb:
-        dzpl_share = reg_data.get("labor_share_lab", 0.65)
-        dproch_lab = reg_data.get("other_share_lab", 0.35)
-        lab_rp_multiplier = dzpl_share * pdz_r + dproch_lab - 1
-        dz_lab_regional = lab_cost * lab_rp_multiplier
-    
-    # === Формируем список дополнительных затрат ===
-    additional_costs = []
+        col_a, col_b = st.columns([3, 1])
+        with col_a:
+            st.markdown(f"**{row['work_name']}**")
+            if row["description"]:
+                st.caption(f"_{row['description']}_")
+            if row["table_ref"]:
+                st.caption(f"📖 _НЗ №281/пр, {row['table_ref']}_")
+        with col_b:
+            qty_label = f"{qty} {row['unit']}"
+            if scalable and multiplier > 1:
+                qty_label += f" (×{multiplier})"
+            st.write(qty_label)
+            st.write(f"**{item_cost:,.0f} ₽**")
+    
+    # Программа ИГИ входит в смету по Таблице 66, даже если в шаблоне её нет
+    if preview["program_work_id"] and not any(row["group"] == "program" for row in detail_rows):
+        program_info = calc.get_work_type(preview["program_work_id"])
+        col_a, col_b = st.columns([3, 1])
+        with col_a:
+            st.markdown(f"**{program_info.get('name', 'Программа ИГИ')}**")
+            st.caption("_Добавляется в смету автоматически по площади рекогносцировки и глубине_")
+            if program_info.get("table_ref"):
+                st.caption(f"📖 _НЗ №281/пр, {program_info['table_ref']}_")
+        with col_b:
+            st.write(f"1 {program_info.get('unit', 'ед.')}")
+            st.write(f"**{preview['program']:,.0f} ₽**")
+    
+    # Дополнительные затраты
+    if template.get("additional_costs"):
+        st.divider()
+        st.markdown("**➕ Дополнительные затраты:**")
+        for add_cost in template["additional_costs"]:
+            if add_cost.get("percent"):
+                st.markdown(f"- **{add_cost['description']}**: {add_cost['percent']}%")
+            else:
+                st.markdown(f"- **{add_cost['description']}**")
+            if add_cost.get("source"):
+                st.caption(f"   _Источник: {add_cost['source']}_")
+            if add_cost.get("note"):
+                st.caption(f"   _{add_cost['note']}_")
     
-    if dz_unfav > 0:
-        additional_costs.append({
-            "name": f"ДЗ на неблагоприятный период ({unfav_percent}%)",
-            "value": dz_unfav,
-            "percent": unfav_percent,
-            "basis": f"НЗ №281/пр, п.21, формула 4",
-            "formula": f"СПпз({field_cost:,.0f}) × {unfav_percent/100:.4f}"
-        })
+    st.divider()
     
-    if dz_regime > 0:
-        additional_costs.append({
-            "name": f"ДЗ на неизбежные перерывы ({regime_percent}%)",
-            "value": dz_regime,
-            "percent": regime_percent,
-            "basis": f"НЗ №281/пр, п.26-27, формула 6",
-            "formula": f"СПпз({field_cost:,.0f}) × {regime_percent/100:.2f}"
-        })
+    # Примечания
+    if template.get("notes"):
+        st.markdown("**📌 Примечания:**")
+        for note in template["notes"]:
+            st.markdown(f"- {note}")
     
-    if dz_travel > 0:
-        interp_note = " (интерп.)" if use_interpolation else ""
-        additional_costs.append({
-            "name": f"ДЗ на проезд ({travel_percent:.1f}%){interp_note}",
-            "value": dz_travel,
-            "percent": travel_percent,
-            "basis": f"НЗ №281/пр, {travel_paragraph}, {travel_table_name} (расст. {distance} км, СПпз до {cost_key.replace('up_to_','').replace('k',' тыс.')})",
-            "formula": f"СПпз({field_cost:,.0f}) × {travel_percent/100:.4f}"
-        })
+    st.divider()
     
-    if dz_org > 0:
-        additional_costs.append({
-            "name": f"ДЗ на организацию полевых работ ({org_percent}%)",
-            "value": dz_org,
-            "percent": org_percent,
-            "basis": f"НЗ №281/пр, п.37, ф.(9), Таблица 8 (расст. {distance} км, СПпз до {org_cost_key.replace('up_to_','').replace('k',' тыс.')})",
-            "formula": f"СПпз({field_cost:,.0f}) × {org_percent/100:.4f}"
-        })
+    total_cost = preview["base_total"]
+    regime_surcharge = preview["regime_surcharge"]
     
-    if dz_rp > 0:
-        additional_costs.append({
-            "name": f"ДЗ на районные выплаты (полевые, Крайон={pdz_r})",
-            "value": dz_rp,
-            "percent": round(rp_multiplier * 100, 2),
-            "basis": f"НЗ №281/пр, п.40, формула 10",
-            "formula": f"({field_cost:,.0f} + {dz_unfav:,.0f} + {dz_regime:,.0f} + {dz_org:,.0f}) × {rp_multiplier:.4f}"
-        })
+    col1, col2 = st.columns(2)
+    with col1:
+        label = "💰 Базовая стоимость"
+        if multiplier > 1:
+            label += f" (×{multiplier})"
+        st.metric(label, f"{total_cost:,.0f} ₽")
+    with col2:
+        if regime_surcharge > 0:
+            st.metric("⚡ С учётом ДЗрежим", f"{total_cost + regime_surcharge:,.0f} ₽")
+    
+    st.caption("_Отчёт и программа — по Таблицам 65 и 66. Без учёта ДЗ на неблагоприятный период, проезд, привязку_")
+    
+    # Применение шаблона: замена сметы или объединение с текущей
+    # (одинаковые позиции складываются, источники сохраняются для обоснований)
+    btn_col1, btn_col2 = st.columns(2)
+    with btn_col1:
+        replace = st.button(f"✅ Применить шаблон", key=f"apply_{template['id']}", type="primary")
+    with btn_col2:
+        merge = st.button(
+            "➕ Добавить к смете", key=f"merge_{template['id']}",
+            disabled=not st.session_state.draft.items,
+            help="Объединить с текущей сметой: одинаковые позиции суммируются, отчёт и программа — 1 раз"
+        )
     
-    if dz_lab_regional > 0:
-        additional_costs.append({
-            "name": f"ДЗ на районные выплаты (лаб., Крайон={pdz_r})",
-            "value": dz_lab_regional,
-            "percent": round(lab_rp_multiplier * 100, 2),
-            "basis": f"НЗ №281/пр, п.47, формула 14",
-            "formula": f"{lab_cost:,.0f} × {lab_rp_multiplier:.4f}"
-        })
+    if replace or merge:
+        draft = st.session_state.draft
+        base_items = draft.to_items_data() if merge else []
+        composed = compose_templates(calc, [(template, multiplier)], base_items)
+        commit_draft(draft.with_items(DraftItem.from_item_data(item_data) for item_data in composed))
+        # Объёмы объединённых позиций изменились — сбрасываем состояние полей ввода
+        for item in st.session_state.draft:
+            st.session_state.pop(f"qty_{item.uid}", None)
+        
+        # Устанавливаем параметры по умолчанию
+        default_params = template.get("default_params", {})
+        if "complexity" in default_params and not merge:
+            st.session_state.project_info["complexity"] = default_params["complexity"]
         
-    return additional_costs
+        if merge and st.session_state.project_info.get("template_id"):
+            st.session_state.project_info["template_id"] += f" + {template['id']}"
+            st.session_state.project_info["template_name"] += f" + {template['name']}"
+            msg = f"✅ Шаблон «{template['name']}» добавлен к смете!"
+        else:
+            st.session_state.project_info["template_id"] = template["id"]
+            st.session_state.project_info["template_name"] = template["name"]
+            msg = f"✅ Шаблон «{template['name']}» применён!"
+        if multiplier > 1:
+            msg += f" (×{multiplier})"
+        msg += " Перейдите на вкладку «Текущая смета»."
+        st.success(msg)
+        st.rerun()
 
 
 # Основная область - добавление работ
@@ -520,8 +655,9 @@ with tab0:
     st.subheader("📋 Готовые шаблоны смет")
     st.markdown("Выберите типовой шаблон для быстрого создания сметы")
     
-    templates_data = load_templates()
+    templates_data = get_templates_data()
     templates = templates_data.get("templates", [])
+    template_models = get_template_models()
     
     # Группировка по категориям
     categories = templates_data.get("template_categories", {})
@@ -532,165 +668,28 @@ with tab0:
             st.markdown(f"### {cat_name}")
             
             for template in cat_templates:
-                with st.expander(f"**{template['name']}** — {template['description']}"):
-                    # Нормативные документы
-                    st.markdown("**📚 Нормативные документы:**")
-                    for doc in template.get("normative_docs", []):
-                        st.markdown(f"- {doc}")
-                    
-                    # Методика расчёта
-                    if template.get("methodology"):
-                        st.divider()
-                        st.markdown("**📋 Методика (требования):**")
-                        for method in template["methodology"]:
-                            st.markdown(f"- **{method['item']}**: {method['requirement']}")
-                            st.caption(f"   _Источник: {method['source']}_")
-                    
-                    st.divider()
-                    
-                    # Множитель для per_support / per_km шаблонов
-                    has_per_support = any(item.get("per_support") for item in template.get("items", []))
-                    has_per_km = any(item.get("per_km") for item in template.get("items", []))
-                    
-                    multiplier = 1
-                    if has_per_support:
-                        mult_label = template.get("multiplier_label", "Количество опор")
-                        st.markdown(f"**🔢 {mult_label}:**")
-                        multiplier = st.number_input(
-                            mult_label, 
-                            value=3, min_value=1, max_value=50, step=1,
-                            key=f"mult_{template['id']}",
-                            help=f"Объемы бурения и лаборатории умножаются на {mult_label.lower()}. Программа и отчёт — 1 раз."
-                        )
-                        st.divider()
-                    elif has_per_km:
-                        st.markdown("**🔢 Протяженность трассы (км):**")
-                        multiplier = st.number_input(
-                            "Количество км", 
-                            value=1, min_value=1, max_value=100, step=1,
-                            key=f"mult_{template['id']}",
-                            help="Объемы бурения умножаются на количество км. Программа и отчёт — 1 раз."
-                        )
-                        st.divider()
-                    
-                    # Состав работ с ссылками на НЗ
-                    st.markdown("**📝 Состав работ:**")
-                    for item in template.get("items", []):
-                        work_info = calc.get_work_type(item["work_id"])
-                        base_cost = calc.get_base_cost(item["work_id"])
-                        
-                        is_scalable = item.get("per_support") or item.get("per_km")
-                        qty = item["quantity"] * multiplier if is_scalable else item["quantity"]
-                        # Рекогносцировка — двухкомпонентная (п.49, ф.16)
-                        if calc.is_reconnaissance(item["work_id"]):
-                            pz1p, pz2p = calc.get_reconnaissance_components(item["work_id"])
-                            item_cost = float(pz1p) + float(pz2p) * qty
-                        else:
-                            item_cost = float(base_cost) * qty
-                        
-                        # Название работы
-                        work_name = work_info.get('name', item['work_id'])
-                        table_ref = work_info.get('table_ref', item.get('nz_ref', ''))
-                        
-                        col_a, col_b = st.columns([3, 1])
-                        with col_a:
-                            st.markdown(f"**{work_name}**")
-                            if item.get("description"):
-                                st.caption(f"_{item['description']}_")
-                            if table_ref:
-                                st.caption(f"📖 _НЗ №281/пр, {table_ref}_")
-                        with col_b:
-                            qty_label = f"{qty} {work_info.get('unit', 'ед.')}"
-                            if is_scalable and multiplier > 1:
-                                qty_label += f" (×{multiplier})"
-                            st.write(qty_label)
-                            st.write(f"**{item_cost:,.0f} ₽**")
-                    
-                    # Дополнительные затраты
-                    if template.get("additional_costs"):
-                        st.divider()
-                        st.markdown("**➕ Дополнительные затраты:**")
-                        for add_cost in template["additional_costs"]:
-                            if add_cost.get("percent"):
-                                st.markdown(f"- **{add_cost['description']}**: {add_cost['percent']}%")
-                            else:
-                                st.markdown(f"- **{add_cost['description']}**")
-                            if add_cost.get("source"):
-                                st.caption(f"   _Источник: {add_cost['source']}_")
-                            if add_cost.get("note"):
-                                st.caption(f"   _{add_cost['note']}_")
-                    
-                    st.divider()
-                    
-                    # Примечания
-                    if template.get("notes"):
-                        st.markdown("**📌 Примечания:**")
-                        for note in template["notes"]:
-                            st.markdown(f"- {note}")
-                    
-                    st.divider()
-                    
-                    # Предварительный расчёт
-                    total_cost = 0
-                    for item in template.get("items", []):
-                        base_cost = calc.get_base_cost(item["work_id"])
-                        is_scalable = item.get("per_support") or item.get("per_km")
-                        qty = item["quantity"] * multiplier if is_scalable else item["quantity"]
-                        # Рекогносцировка — двухкомпонентная (п.49, ф.16)
-                        if calc.is_reconnaissance(item["work_id"]):
-                            pz1p, pz2p = calc.get_reconnaissance_components(item["work_id"])
-                            total_cost += float(pz1p) + float(pz2p) * qty
-                        else:
-                            total_cost += float(base_cost) * qty
-                    
-                    # Учитываем ДЗрежим если есть
-                    regime_surcharge = 0
-                    for add_cost in template.get("additional_costs", []):
-                        if add_cost.get("type") == "regime_surcharge":
-                            regime_surcharge = total_cost * add_cost.get("percent", 0) / 100
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        label = "💰 Базовая стоимость"
-                        if multiplier > 1:
-                            label += f" (×{multiplier})"
-                        st.metric(label, f"{total_cost:,.0f} ₽")
-                    with col2:
-                        if regime_surcharge > 0:
-                            st.metric("⚡ С учётом ДЗрежим", f"{total_cost + regime_surcharge:,.0f} ₽")
-                    
-                    st.caption("_Без учёта ДЗ на неблагоприятный период, проезд, привязку_")
-                    
-                    # Кнопка применения шаблона
-                    if st.button(f"✅ Применить шаблон", key=f"apply_{template['id']}", type="primary"):
-                        # Очищаем текущую смету
-                        st.session_state.estimate_items = []
-                        
-                        # Добавляем все позиции из шаблона
-                        for item in template.get("items", []):
-                            is_scalable = item.get("per_support") or item.get("per_km")
-                            qty = item["quantity"] * multiplier if is_scalable else item["quantity"]
-                            item_data = {
-                                "work_id": item["work_id"],
-                                "quantity": qty,
-                                "additional_coefficients": {},
-                                "uid": str(uuid.uuid4())[:8]
-                            }
-                            st.session_state.estimate_items.append(item_data)
-                        
-                        # Устанавливаем параметры по умолчанию
-                        default_params = template.get("default_params", {})
-                        if "complexity" in default_params:
-                            st.session_state.project_info["complexity"] = default_params["complexity"]
-                        
-                        msg = f"✅ Шаблон «{template['name']}» применён!"
-                        if multiplier > 1:
-                            msg += f" (×{multiplier})"
-                        msg += " Перейдите на вкладку «Текущая смета»."
-                        st.session_state.project_info["template_id"] = template["id"]
-                        st.session_state.project_info["template_name"] = template["name"]
-                        st.success(msg)
+                model = template_models[template["id"]]
+                is_open = st.session_state.get("gallery_template") == template["id"]
+                
+                # Лёгкая строка каталога: название, описание и оценка стоимости
+                h_col1, h_col2, h_col3 = st.columns([6, 2, 1])
+                with h_col1:
+                    st.markdown(f"**{template['name']}** — {template['description']}")
+                with h_col2:
+                    default_mult = 3 if model.multiplier_kind == "per_support" else 1
+                    max_depth = st.session_state.project_info.get("max_depth", "10")
+                    st.caption(f"≈ {model.preview(calc, default_mult, max_depth)['base_total']:,.0f} ₽")
+                with h_col3:
+                    if st.button("▲" if is_open else "▼", key=f"open_{template['id']}",
+                                 help="Свернуть" if is_open else "Подробнее"):
+                        st.session_state.gallery_template = None if is_open else template["id"]
                         st.rerun()
+                
+                # Подробности считаются и рисуются только для раскрытого шаблона
+                if is_open:
+                    with st.container(border=True):
+                        render_template_details(template, model)
+
 
 with tab1:
     st.subheader("Добавление позиций в смету")
@@ -800,13 +799,16 @@ with tab1:
                 # Кнопка добавления
                 if st.button("➕ Добавить в смету", type="primary", use_container_width=True):
                     if quantity > 0:
-                        item_data = {
-                            "work_id": selected_work_id,
-                            "quantity": quantity,
-                            "additional_coefficients": additional_coefs,
-                            "uid": str(uuid.uuid4())[:8]
-                        }
-                        st.session_state.estimate_items.append(item_data)
+                        items = list(st.session_state.draft.items)
+                        items.append(DraftItem.new(selected_work_id, quantity, additional_coefs))
+                        
+                        def add_quantity(marker: str) -> bool:
+                            """Увеличить объём первой позиции, чей work_id содержит marker"""
+                            for k, existing in enumerate(items):
+                                if marker in existing.work_id:
+                                    items[k] = existing.evolve(quantity=existing.quantity + quantity)
+                                    return True
+                            return False
                         
                         auto_added = []
                         # Авто-добавление камералки при бурении
@@ -815,52 +817,28 @@ with tab1:
                             cat_suffix = "cat1" if complexity == "I" else ("cat3" if complexity == "III" else "cat2")
                             cameral_id = f"cameral_borehole_{cat_suffix}"
                             
-                            # Проверяем, добавлена ли уже камералка для скважин
-                            has_cameral_borehole = any("cameral_borehole" in i["work_id"] for i in st.session_state.estimate_items)
-                            if not has_cameral_borehole:
-                                st.session_state.estimate_items.append({
-                                    "work_id": cameral_id,
-                                    "quantity": quantity,
-                                    "additional_coefficients": {},
-                                    "uid": str(uuid.uuid4())[:8]
-                                })
-                                auto_added.append("Камеральная обработка скважин")
+                            # Если камералка для скважин уже есть, увеличиваем её объём
+                            if add_quantity("cameral_borehole"):
+                                auto_added.append("обновлен объем камералки скважин")
                             else:
-                                # Если уже есть камералка, увеличиваем ее объем
-                                for i in st.session_state.estimate_items:
-                                    if "cameral_borehole" in i["work_id"]:
-                                        i["quantity"] += quantity
-                                        auto_added.append("обновлен объем камералки скважин")
-                                        break
+                                items.append(DraftItem.new(cameral_id, quantity))
+                                auto_added.append("Камеральная обработка скважин")
                                         
                             # Приемка образцов
-                            has_lab = any("lab_" in i["work_id"] for i in st.session_state.estimate_items)
+                            has_lab = any("lab_" in i.work_id for i in items)
                             if not has_lab:
-                                st.session_state.estimate_items.append({
-                                    "work_id": "lab_sample_prep",
-                                    "quantity": round(quantity / 2.0) or 1,
-                                    "additional_coefficients": {},
-                                    "uid": str(uuid.uuid4())[:8]
-                                })
+                                items.append(DraftItem.new("lab_sample_prep", round(quantity / 2.0) or 1))
                                 auto_added.append("Приёмка образцов (базово)")
 
                         # Авто-добавление камералки при зондировании
                         if "static_sounding" in selected_work_id or "cpt" in selected_work_id:
-                            has_cameral_cpt = any("cameral_cpt" in i["work_id"] for i in st.session_state.estimate_items)
-                            if not has_cameral_cpt:
-                                st.session_state.estimate_items.append({
-                                    "work_id": "cameral_cpt",
-                                    "quantity": quantity,
-                                    "additional_coefficients": {},
-                                    "uid": str(uuid.uuid4())[:8]
-                                })
-                                auto_added.append("Камеральная обработка зондирования")
+                            if add_quantity("cameral_cpt"):
+                                auto_added.append("обновлен объем камералки зондирования")
                             else:
-                                for i in st.session_state.estimate_items:
-                                    if "cameral_cpt" in i["work_id"]:
-                                        i["quantity"] += quantity
-                                        auto_added.append("обновлен объем камералки зондирования")
-                                        break
+                                items.append(DraftItem.new("cameral_cpt", quantity))
+                                auto_added.append("Камеральная обработка зондирования")
+                        
+                        commit_draft(st.session_state.draft.with_items(items))
 
                         # Авто-добавление камералки для иных полевых испытаний (если у них нет отдельного id, пропускаем, или можно добавить логику позже)
                         
@@ -876,16 +854,25 @@ with tab1:
             st.warning("Нет доступных видов работ в этой категории")
 
 
-with tab2:
+@st.fragment
+def render_estimate_table(stale_notices: dict):
+    """Текущая смета: правка количества, порядка и удаление позиций
+    перерисовывают только этот фрагмент (строки, итоги разделов и ДЗ).
+
+    stale_notices: {панель: st.empty()} — куда вывести предупреждение,
+    если панель из ESTIMATE_PANELS показывает смету до правки
+    """
     st.subheader("Текущая смета")
     
-    if not st.session_state.estimate_items:
+    draft = current_draft()
+    if not draft.items:
         st.info("Смета пуста. Добавьте позиции на вкладке «Добавление работ» или выберите шаблон.")
     else:
         # Создаём смету для отображения
+        items_data = draft.to_items_data()
         estimate = calc.create_estimate(
             project_name=st.session_state.project_info["name"] or "Без названия",
-            items_data=st.session_state.estimate_items,
+            items_data=items_data,
             soil_category=st.session_state.project_info.get("soil_category", "II"),
             climate_zone=st.session_state.project_info.get("climate_zone", "IV"),
             apply_price_index=True,
@@ -895,8 +882,8 @@ with tab2:
         estimate.object_name = st.session_state.project_info["object"]
         estimate.customer = st.session_state.project_info["customer"]
         estimate.contractor = st.session_state.project_info["contractor"]
-        estimate.price_index = Decimal(str(current_index))
-        estimate.contract_coefficient = Decimal(str(k_contract))
+        estimate.price_index = Decimal(str(st.session_state.project_info["price_index"]))
+        estimate.contract_coefficient = Decimal(str(st.session_state.project_info["k_contract"]))
         estimate.template_name = st.session_state.project_info.get("template_name", "")
         
         # Заголовок таблицы
@@ -905,211 +892,49 @@ with tab2:
         st.markdown(f"*Приказ Минстроя России №281/пр от 12.05.2025. Уровень цен: 01.01.2024*")
         st.divider()
         
-        # Шапка таблицы
-        header_cols = st.columns([0.4, 2.5, 0.6, 0.9, 1.5, 1.2, 1.0, 0.3, 0.3, 0.3])
-        with header_cols[0]:
-            st.markdown("**№**")
-        with header_cols[1]:
-            st.markdown("**Наименование работ и затрат**")
-        with header_cols[2]:
-            st.markdown("**Ед.**")
-        with header_cols[3]:
-            st.markdown("**Кол-во**")
-        with header_cols[4]:
-            st.markdown("**Обоснование**")
-        with header_cols[5]:
-            st.markdown("**Расчёт**")
-        with header_cols[6]:
-            st.markdown("**Стоимость**")
-        with header_cols[7]:
-            st.markdown("")
-        with header_cols[8]:
-            st.markdown("")
-        with header_cols[9]:
-            st.markdown("")
-        
-        st.divider()
-        
-        # Обеспечиваем uid для всех позиций (совместимость со старыми данными)
-        for item in st.session_state.estimate_items:
-            if "uid" not in item:
-                item["uid"] = str(uuid.uuid4())[:8]
-        
-        # Группировка по категориям
-        field_items = []
-        lab_items = []
-        office_items = []
-        
-        # === Авто-подбор Программы ИГИ (Таблица 66) ===
-        # Определяем площадку из рекогносцировки и глубину из параметров проекта
-        recon_area_ha = 0
-        for item_data in st.session_state.estimate_items:
-            if 'recon' in item_data.get("work_id", ""):
-                recon_area_ha = item_data.get("quantity", 1)
-                break
-        
-        max_depth_key = st.session_state.project_info.get("max_depth", "10")
-        
-        # Определяем area_key для Таблицы 66
-        if recon_area_ha <= 1:
-            area_suffix = "lt1ha"
-        elif recon_area_ha <= 10:
-            area_suffix = "10ha"
-        elif recon_area_ha <= 100:
-            area_suffix = "100ha"
-        else:
-            area_suffix = "gt100ha"
-        
-        # Маппинг depth_key → suffix в ID
-        depth_suffix_map = {"5": "5m", "10": "10m", "15": "15m", "25": "25m", "50": "50m", "75": "75m", "over": "over"}
-        depth_suffix = depth_suffix_map.get(max_depth_key, "10m")
-        
-        auto_program_id = f"program_cat2_{area_suffix}_{depth_suffix}"
+        # Большие сметы по умолчанию открываются одной сеткой вместо виджетов в каждой строке
+        if "estimate_grid_mode" not in st.session_state:
+            st.session_state.estimate_grid_mode = len(draft) > GRID_MODE_MIN_ITEMS
+        grid_mode = st.toggle(
+            "Табличный режим", key="estimate_grid_mode",
+            help="Редактирование количества, порядка (№) и удаление позиций в одной таблице"
+        )
         
-        # Убираем старую программу (если была) и вставляем новую
-        st.session_state.estimate_items = [
-            i for i in st.session_state.estimate_items 
-            if 'program' not in i.get("work_id", "")
-        ]
+        # Шапка таблицы
+        if not grid_mode:
+            header_cols = st.columns([0.4, 2.5, 0.6, 0.9, 1.5, 1.2, 1.0, 0.3, 0.3, 0.3])
+            with header_cols[0]:
+                st.markdown("**№**")
+            with header_cols[1]:
+                st.markdown("**Наименование работ и затрат**")
+            with header_cols[2]:
+                st.markdown("**Ед.**")
+            with header_cols[3]:
+                st.markdown("**Кол-во**")
+            with header_cols[4]:
+                st.markdown("**Обоснование**")
+            with header_cols[5]:
+                st.markdown("**Расчёт**")
+            with header_cols[6]:
+                st.markdown("**Стоимость**")
+            with header_cols[7]:
+                st.markdown("")
+            with header_cols[8]:
+                st.markdown("")
+            with header_cols[9]:
+                st.markdown("")
         
-        # Вставляем программу ПЕРЕД отчётом (логичный порядок: программа → камеральные → отчёт)
-        program_info = calc.get_work_type(auto_program_id)
-        if program_info:
-            program_item = {
-                "work_id": auto_program_id,
-                "quantity": 1,
-                "additional_coefficients": {},
-                "uid": "prog_auto"
-            }
-            
-            # Ищем позицию отчёта
-            report_idx = -1
-            for idx, item in enumerate(st.session_state.estimate_items):
-                wt = calc.get_work_type(item.get("work_id", ""))
-                if wt and wt.get("group") == "report":
-                    report_idx = idx
-                    break
-            
-            if report_idx >= 0:
-                st.session_state.estimate_items.insert(report_idx, program_item)
-            else:
-                st.session_state.estimate_items.append(program_item)
+            st.divider()
         
-        # 1. Сначала считаем сумму камеральных работ (без отчёта и программы)
-        cameral_base_sum = 0
-        report_item_index = -1
-        
-        for i, item_data in enumerate(st.session_state.estimate_items):
-            work_info = calc.get_work_type(item_data["work_id"])
-            grp = work_info.get("group", "")
-            cat = work_info.get("category", "")
-            
-            # Считаем базу (согласно Примечанию 2 к Табл. 65 стоимость программы не учитывается)
-            if cat == "office" and grp not in ("report", "program"):
-                 base_c = float(calc.get_base_cost(item_data["work_id"]))
-                 cameral_base_sum += base_c * item_data["quantity"]
-            
-            if grp == "report":
-                report_item_index = i
-
-        # 2. Если есть отчёт, пересчитываем его стоимость
-        if report_item_index >= 0:
-            complexity = st.session_state.project_info.get("complexity", "II")
-            # Считаем стоимость отчёта с учётом интерполяции (по Таблице 65)
-            calculated_report_cost, range_desc, upper_key = calc.calculate_report_cost(cameral_base_sum, complexity)
-        else:
-            calculated_report_cost = 0
-            range_desc = ""
-            upper_key = ""
-            complexity = "II"
-
-        for i, item_data in enumerate(st.session_state.estimate_items):
-            work_info = calc.get_work_type(item_data["work_id"])
-            base_cost = calc.get_base_cost(item_data["work_id"])
-            report_ref = None  # Will be set if report cost is recalculated
-            quantity = item_data["quantity"]
-            
-            # Если это отчёт - подменяем стоимость и название
-            if work_info.get("group") == "report" and calculated_report_cost > 0:
-                base_cost = calculated_report_cost
-                
-                # Ищем базовую расценку, соответствующую верхней границе интерполяции
-                # чтобы взять оттуда актуальное "имя" и "код"
-                correct_report_wt = None
-                
-                # Для Таблицы 65 I кат: "report_cat1_{key}", II кат: "report_cat2_{key}" и т.д.
-                cat_num = "1" if complexity == "I" else ("3" if complexity == "III" else "2")
-                target_report_id = f"report_cat{cat_num}_{upper_key}"
-                
-                for wt in calc.work_types.get("work_types", []):
-                    if wt.get("id") == target_report_id:
-                        correct_report_wt = wt
-                        break
-                        
-                # Если не нашли по точному ID (например "up_to_20k" id может называться "20k"), то ищем первое подходящее
-                if not correct_report_wt:
-                     for wt in calc.work_types.get("work_types", []):
-                        if wt.get("group") == "report" and wt.get("base_cost") == int(calculated_report_cost):
-                            correct_report_wt = wt
-                            break
-                
-                if correct_report_wt:
-                    # Подменяем work_id на правильный
-                    st.session_state.estimate_items[i]["work_id"] = correct_report_wt["id"]
-                    display_name = correct_report_wt["name"]
-                    report_ref = correct_report_wt.get("table_ref", "")
-                else:
-                    display_name = f"Составление технического отчета по результатам выполнения работ по ИГИ (ИГУ {complexity} кат., {range_desc.replace(' (интерполяция)','')})"
-                    report_ref = work_info.get("table_ref", "")
-                
-                # Сохраняем рассчитанную стоимость в сессию
-                st.session_state.estimate_items[i]["override_base_cost"] = float(calculated_report_cost)
-                
-                quantity = 1 # Отчет всегда 1
-                total_cost = calculated_report_cost
-                calc_formula = f"{calculated_report_cost:,.0f} (Таблица 65, {complexity} кат., {range_desc})"
-            else:
-                # Если это не отчет, убираем override (на случай если он был раньше)
-                if "override_base_cost" in st.session_state.estimate_items[i] and work_info.get("group") != "report":
-                    del st.session_state.estimate_items[i]["override_base_cost"]
-                
-                # Рекогносцировка — двухкомпонентная формула (п.49, ф.16)
-                if calc.is_reconnaissance(item_data["work_id"]):
-                    pz1p, pz2p = calc.get_reconnaissance_components(item_data["work_id"])
-                    total_cost = float(pz1p) + float(pz2p) * quantity
-                    display_name = work_info.get("name", item_data["work_id"])
-                    calc_formula = f"ПЗ1п({float(pz1p):,.0f}) + ПЗ2п({float(pz2p):,.0f}) × {quantity:.1f}"
-                else:
-                    total_cost = float(base_cost) * quantity
-                    display_name = work_info.get("name", item_data["work_id"])
-                    calc_formula = f"{float(base_cost):,.0f} × {quantity:.1f}"
-
-            # Сохраняем формулу в сессию для экспорта
-            st.session_state.estimate_items[i]["formula"] = calc_formula
-            
-            item_row = {
-                "index": i,
-                "uid": item_data.get("uid", str(i)),
-                "work_id": item_data["work_id"],
-                "name": display_name,
-                "unit": work_info.get("unit", "ед."),
-                "quantity": quantity,
-                "base_cost": float(base_cost),
-                "total_cost": total_cost,
-                "table_ref": report_ref if report_ref else work_info.get("table_ref", ""),
-                "code": work_info.get("code", ""),
-                "category": work_info.get("category", "field"),
-                "formula_display": calc_formula
-            }
-            
-            if item_row["category"] == "field":
-                field_items.append(item_row)
-            elif item_row["category"] == "laboratory":
-                lab_items.append(item_row)
-            else:
-                office_items.append(item_row)
+        # Строки таблицы по черновику (программа, отчёт и формулы уже выставлены в current_draft)
+        _, rows = evaluate_draft(calc, draft, st.session_state.project_info.get("complexity", "II"))
+        field_items = [row for row in rows if row["category"] == "field"]
+        lab_items = [row for row in rows if row["category"] == "laboratory"]
+        office_items = [row for row in rows if row["category"] not in ("field", "laboratory")]
         
         row_counter = [1]
+        # Соседи той же категории для кнопок ⬆/⬇ — один проход по смете вместо поиска в каждой строке
+        category_order = calc.category_order(draft.items)
         
         # --- Вспомогательная функция для рендера раздела ---
         def render_section(section_name, section_code, items_list):
@@ -1133,11 +958,9 @@ with tab2:
                     new_qty = st.number_input(
                         "qty", value=float(item["quantity"]),
                         min_value=0.0, step=1.0, format="%.1f",
-                        key=f"qty_{uid}", label_visibility="collapsed"
+                        key=f"qty_{uid}", label_visibility="collapsed",
+                        on_change=on_quantity_change, args=(uid,)
                     )
-                    if new_qty != float(item["quantity"]):
-                        st.session_state.estimate_items[idx]["quantity"] = new_qty
-                        st.rerun()
                 with cols[4]:
                     st.caption(f"НЗ №281/пр, {item['table_ref']}")
                 with cols[5]:
@@ -1152,37 +975,13 @@ with tab2:
                         actual_cost = item["base_cost"] * new_qty
                     st.write(f"**{actual_cost:,.0f}**")
                 with cols[7]:
-                    # Найти предыдущий элемент той же категории
-                    prev_idx = None
-                    for j in range(idx - 1, -1, -1):
-                        wid = st.session_state.estimate_items[j]["work_id"]
-                        wi = calc.get_work_type(wid)
-                        if wi.get("category", "field") == item["category"]:
-                            prev_idx = j
-                            break
-                    if prev_idx is not None:
-                        if st.button("⬆", key=f"up_{uid}"):
-                            items = st.session_state.estimate_items
-                            items[idx], items[prev_idx] = items[prev_idx], items[idx]
-                            st.rerun()
+                    if category_order.neighbor(idx, -1) is not None:
+                        st.button("⬆", key=f"up_{uid}", on_click=on_move_item, args=(uid, -1))
                 with cols[8]:
-                    # Найти следующий элемент той же категории
-                    next_idx = None
-                    for j in range(idx + 1, len(st.session_state.estimate_items)):
-                        wid = st.session_state.estimate_items[j]["work_id"]
-                        wi = calc.get_work_type(wid)
-                        if wi.get("category", "field") == item["category"]:
-                            next_idx = j
-                            break
-                    if next_idx is not None:
-                        if st.button("⬇", key=f"dn_{uid}"):
-                            items = st.session_state.estimate_items
-                            items[idx], items[next_idx] = items[next_idx], items[idx]
-                            st.rerun()
+                    if category_order.neighbor(idx, 1) is not None:
+                        st.button("⬇", key=f"dn_{uid}", on_click=on_move_item, args=(uid, 1))
                 with cols[9]:
-                    if st.button("🗑️", key=f"del_{uid}"):
-                        st.session_state.estimate_items.pop(idx)
-                        st.rerun()
+                    st.button("🗑️", key=f"del_{uid}", on_click=on_delete_item, args=(uid,))
                 
                 row_counter[0] += 1
                 # Пересчитываем с учётом изменённого кол-ва
@@ -1202,9 +1001,14 @@ with tab2:
             return section_total
         
         # Рендеринг разделов
-        field_total = render_section("Раздел I. Полевые работы", "разделу I (СПпз)", field_items)
-        lab_total = render_section("Раздел II. Лабораторные работы", "разделу II (СЛпз)", lab_items)
-        office_total = render_section("Раздел III. Камеральные работы", "разделу III (СКпз)", office_items)
+        if grid_mode:
+            field_total, lab_total, office_total = render_estimate_grid(
+                [("I", field_items), ("II", lab_items), ("III", office_items)]
+            )
+        else:
+            field_total = render_section("Раздел I. Полевые работы", "разделу I (СПпз)", field_items)
+            lab_total = render_section("Раздел II. Лабораторные работы", "разделу II (СЛпз)", lab_items)
+            office_total = render_section("Раздел III. Камеральные работы", "разделу III (СКпз)", office_items)
         
         # Общие итоги (field_total, lab_total, office_total уже посчитаны в render_section)
         base_total = field_total + lab_total + office_total
@@ -1227,7 +1031,7 @@ with tab2:
         # Расчёт и отображение дополнительных затрат
         temp_estimate = calc.create_estimate(
              project_name="Temp",
-             items_data=st.session_state.estimate_items,
+             items_data=items_data,
              soil_category=st.session_state.project_info.get("soil_category", "II"),
              climate_zone=st.session_state.project_info.get("climate_zone", "IV"),
              is_local_work=st.session_state.project_info.get("is_local_work", False)
@@ -1269,25 +1073,42 @@ with tab2:
         
         # Кнопка очистки
         if st.button("🗑️ Очистить смету", type="secondary"):
-            st.session_state.estimate_items = []
+            commit_draft(draft.with_items(()))
             st.rerun()
+    
+    # Кнопки скачивания держат документы прежней ревизии: пока они на экране,
+    # правка перерисовывает всё приложение, чтобы устаревший файл нельзя было скачать
+    if panel_is_stale("export_panel") and st.session_state.get("export_downloads_shown"):
+        st.rerun()
+    
+    for name, notice in stale_notices.items():
+        if panel_is_stale(name):
+            notice.warning("Смета изменена на вкладке «Текущая смета». Нажмите «🔄 Обновить», чтобы пересчитать.")
 
 
-with tab3:
-    st.subheader("💰 Расчёт дополнительных затрат")
-    
-    if not st.session_state.estimate_items:
+@st.fragment
+def render_dz_panel(notice):
+    """Дополнительные затраты и подбор параметра; пересчитывается своими виджетами"""
+    mark_panel_fresh("dz_panel")
+    notice.empty()
+    panel_header("💰 Расчёт дополнительных затрат", "dz_panel")
+    
+    draft = current_draft()
+    if not draft.items:
         st.info("Сначала добавьте позиции в смету.")
     else:
         # Создаём смету
         estimate = calc.create_estimate(
             project_name=st.session_state.project_info["name"] or "Без названия",
-            items_data=st.session_state.estimate_items,
+            items_data=draft.to_items_data(),
             soil_category=st.session_state.project_info.get("soil_category", "II"),
             climate_zone=st.session_state.project_info.get("climate_zone", "IV"),
             apply_price_index=True,
             is_local_work=st.session_state.project_info.get("is_local_work", False)
         )
+        # Индекс и Кдог из боковой панели — как в экспорте и в итоге подбора параметра
+        estimate.price_index = Decimal(str(st.session_state.project_info["price_index"]))
+        estimate.contract_coefficient = Decimal(str(st.session_state.project_info["k_contract"]))
         
         field_cost = float(estimate.subtotal_field)
         lab_cost = float(estimate.subtotal_laboratory)
@@ -1354,17 +1175,64 @@ with tab3:
             else:
                 st.metric("💰 ИТОГО", f"{final_total:,.0f} ₽")
 
+        # Обратный расчёт: подбор параметра под целевую стоимость
+        with st.expander("🎯 Подбор параметра под целевую стоимость"):
+            solver_params = {
+                "k_contract": "Коэффициент договорной цены",
+                "price_index": "Индекс пересчёта",
+                "distance_km": "Расстояние до объекта (км)",
+            }
+            s_col1, s_col2 = st.columns(2)
+            with s_col1:
+                solve_param = st.selectbox(
+                    "Подбираемый параметр",
+                    options=list(solver_params.keys()),
+                    format_func=lambda x: solver_params[x],
+                    key="solver_param"
+                )
+            with s_col2:
+                solve_target = st.number_input(
+                    "Целевая итоговая стоимость, ₽",
+                    value=float(round(final_total)),
+                    min_value=0.0,
+                    step=10000.0,
+                    format="%.0f",
+                    key="solver_target"
+                )
+            if st.button("🔍 Подобрать", key="solver_run"):
+                solver = InverseSolver(calc, estimate, st.session_state.project_info)
+                res = solver.solve(solve_param, solve_target)
+                if not res.reachable:
+                    st.error(
+                        f"Цель недостижима: минимальный итог = {res.total:,.0f} ₽ "
+                        f"({solver_params[solve_param]}: {res.value:,.3f})"
+                    )
+                elif res.exact:
+                    st.success(f"{solver_params[solve_param]}: **{res.value:,.3f}** → итог {res.total:,.0f} ₽")
+                else:
+                    st.warning(
+                        f"Точного попадания нет. Ближайшее значение, не превышающее цель: "
+                        f"**{res.value:,.3f}** → итог {res.total:,.0f} ₽"
+                    )
+                st.caption(f"Вычислений итога: {res.evaluations}")
 
-with tab4:
-    st.subheader("📥 Экспорт сметы")
-    
-    if not st.session_state.estimate_items:
+
+@st.fragment
+def render_export_panel(notice):
+    """Экспорт: сборка документов перерисовывает только эту панель"""
+    mark_panel_fresh("export_panel")
+    st.session_state.export_downloads_shown = False
+    notice.empty()
+    panel_header("📥 Экспорт сметы", "export_panel")
+    
+    draft = current_draft()
+    if not draft.items:
         st.warning("Сначала добавьте позиции в смету.")
     else:
         # Создаём смету для экспорта
         estimate = calc.create_estimate(
             project_name=st.session_state.project_info["name"] or "Без названия",
-            items_data=st.session_state.estimate_items,
+            items_data=draft.to_items_data(),
             soil_category=st.session_state.project_info.get("soil_category", "II"),
             climate_zone=st.session_state.project_info.get("climate_zone", "IV"),
             apply_price_index=True,
@@ -1381,92 +1249,95 @@ with tab4:
         estimate.object_name = st.session_state.project_info["object"]
         estimate.customer = st.session_state.project_info["customer"]
         estimate.contractor = st.session_state.project_info["contractor"]
-        estimate.price_index = Decimal(str(current_index))
-        estimate.contract_coefficient = Decimal(str(k_contract))
+        estimate.price_index = Decimal(str(st.session_state.project_info["price_index"]))
+        estimate.contract_coefficient = Decimal(str(st.session_state.project_info["k_contract"]))
         estimate.base_city = "г. Санкт-Петербург"
         estimate.work_region = st.session_state.project_info.get("region", "")
         estimate.distance_km = st.session_state.project_info.get("distance_km", 0)
         estimate.template_id = st.session_state.project_info.get("template_id", "")
         estimate.template_name = st.session_state.project_info.get("template_name", "")
         
-        # ДЗ уже добавлены выше; повторный вызов не нужен
-        
-        col1, col2, col3 = st.columns(3)
+        # Документы собираются только по запросу и кэшируются по формату:
+        # пока отпечаток сметы не изменился, повторное скачивание ничего не стоит.
+        # Позиции в отпечатке представлены ревизией черновика — O(1) вместо сериализации сметы
+        fingerprint = estimate_fingerprint(
+            draft.revision, st.session_state.project_info,
+            price_index=st.session_state.project_info["price_index"],
+            k_contract=st.session_state.project_info["k_contract"]
+        )
+        export_cache = st.session_state.setdefault("export_cache", {})
         
-        with col1:
-            st.markdown("### 📗 Excel")
-            try:
-                # В Windows нельзя открывать файл, если он уже открыт в NamedTemporaryFile
-                # Поэтому создаем, получаем имя и сразу закрываем
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-                    tmp_name = tmp.name
-                
-                # Теперь файл закрыт, можно работать по пути
-                try:
-                    export_to_excel(estimate, tmp_name)
-                    with open(tmp_name, "rb") as f:
-                        excel_data = f.read()
-                finally:
-                    if os.path.exists(tmp_name):
-                        os.unlink(tmp_name)
-                
+        # Полный комплект: все форматы собираются одним заданием параллельно
+        package_col, timings_col = st.columns([1, 2])
+        with package_col:
+            cached_zip = export_cache.get("zip")
+            if cached_zip is None or cached_zip[0] != fingerprint:
+                if st.button("📦 Подготовить комплект (ZIP)", key="prepare_zip", use_container_width=True):
+                    bundle = run_export_job(estimate)
+                    for fmt, (_, data) in bundle.files.items():
+                        export_cache[fmt] = (fingerprint, data)
+                    for fmt, error in bundle.errors.items():
+                        st.error(f"Ошибка экспорта .{fmt}: {error}")
+                    if bundle.files:
+                        export_cache["zip"] = cached_zip = (fingerprint, bundle.to_zip(), bundle)
+            if cached_zip is not None and cached_zip[0] == fingerprint:
+                st.session_state.export_downloads_shown = True
                 st.download_button(
-                    label="💾 Скачать .xlsx",
-                    data=excel_data,
-                    file_name=f"Смета_{estimate.project_name}_{estimate.date_created}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    label="💾 Скачать комплект (ZIP)",
+                    data=cached_zip[1],
+                    file_name=export_filename(estimate, "zip"),
+                    mime="application/zip",
+                    key="download_zip",
                     use_container_width=True
                 )
-            except Exception as e:
-                st.error(f"Ошибка экспорта: {e}")
-        
-        with col2:
-            st.markdown("### 📕 PDF")
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                    tmp_name = tmp.name
-                
-                try:
-                    export_to_pdf(estimate, tmp_name)
-                    with open(tmp_name, "rb") as f:
-                        pdf_data = f.read()
-                finally:
-                    if os.path.exists(tmp_name):
-                        os.unlink(tmp_name)
-                
-                st.download_button(
-                    label="💾 Скачать .pdf",
-                    data=pdf_data,
-                    file_name=f"Смета_{estimate.project_name}_{estimate.date_created}.pdf",
-                    mime="application/pdf",
-                    use_container_width=True
+        if cached_zip is not None and cached_zip[0] == fingerprint:
+            bundle = cached_zip[2]
+            with timings_col:
+                st.caption(
+                    "Время сборки: "
+                    + ", ".join(f".{fmt} — {seconds:.2f} с" for fmt, seconds in bundle.timings.items())
+                    + f"; всего {bundle.wall_time:.2f} с"
                 )
-            except Exception as e:
-                st.error(f"Ошибка экспорта: {e}")
         
-        with col3:
-            st.markdown("### 📘 Word")
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-                    tmp_name = tmp.name
-                
-                try:
-                    export_to_word(estimate, tmp_name)
-                    with open(tmp_name, "rb") as f:
-                        word_data = f.read()
-                finally:
-                    if os.path.exists(tmp_name):
-                        os.unlink(tmp_name)
+        for col, (fmt, (title, _, mime)) in zip(st.columns(len(EXPORT_FORMATS)), EXPORT_FORMATS.items()):
+            with col:
+                st.markdown(f"### {title}")
+                cached = export_cache.get(fmt)
+                if cached is None or cached[0] != fingerprint:
+                    if not st.button(f"⚙️ Подготовить .{fmt}", key=f"prepare_{fmt}", use_container_width=True):
+                        continue
+                    try:
+                        export_cache[fmt] = cached = (fingerprint, build_export(estimate, fmt))
+                    except Exception as e:
+                        st.error(f"Ошибка экспорта: {e}")
+                        continue
                 
+                st.session_state.export_downloads_shown = True
                 st.download_button(
-                    label="💾 Скачать .docx",
-                    data=word_data,
-                    file_name=f"Смета_{estimate.project_name}_{estimate.date_created}.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                    label=f"💾 Скачать .{fmt}",
+                    data=cached[1],
+                    file_name=export_filename(estimate, fmt),
+                    mime=mime,
+                    key=f"download_{fmt}",
                     use_container_width=True
                 )
-            except Exception as e:
-                st.error(f"Ошибка экспорта: {e}")
+
+
+# Полный прогон скрипта показывает все панели по текущей смете
+current_draft()
+for panel in ESTIMATE_PANELS:
+    mark_panel_fresh(panel)
+
+with tab3:
+    dz_notice = st.empty()
+with tab4:
+    export_notice = st.empty()
+with tab2:
+    render_estimate_table({"dz_panel": dz_notice, "export_panel": export_notice})
+with tab3:
+    render_dz_panel(dz_notice)
+with tab4:
+    render_export_panel(export_notice)
 
 
 # Футер
@@ -0,0 +1,210 @@
+"""
+Бенчмарк экспорта: время и пиковая память export_to_excel / export_to_pdf / export_to_word
+на синтетических сметах растущего размера
+
+Сметы собираются из настоящего справочника работ (data/work_types.json) с
+фиксированным зерном генератора, поэтому прогоны сравнимы между собой.
+Результаты сравниваются с базовой линией benchmarks/baseline.json; при
+превышении порогов скрипт завершается с кодом 1.
+
+    python benchmarks/bench_export.py                    # сравнить с базовой линией
+    python benchmarks/bench_export.py --update-baseline  # записать новую базовую линию
+    python benchmarks/bench_export.py --sizes 10 100 --formats docx
+"""
+
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.additional_costs import calculate_additional_costs
+from modules.calculator import Calculator
+from modules.export_excel import export_to_excel
+from modules.export_pdf import export_to_pdf
+from modules.export_word import export_to_word
+
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+
+SIZES = (10, 100, 1000, 10000)
+
+EXPORTERS = {
+    "xlsx": export_to_excel,
+    "pdf": export_to_pdf,
+    "docx": export_to_word,
+}
+
+# Пороги регрессии: во сколько раз можно превысить базовую линию.
+# Разница меньше min_seconds / min_mb считается шумом
+DEFAULT_THRESHOLDS = {
+    "time_ratio": 1.5,
+    "memory_ratio": 1.3,
+    "min_seconds": 0.05,
+    "min_mb": 1.0,
+}
+
+SEED = 281
+
+# Регион с районным коэффициентом 1.4 и лаборатория вне СПб — в смете есть районные ДЗ (поле и лаборатория)
+PROJECT_INFO = {"region": "Республика Алтай", "distance_km": 700, "lab_in_spb": False}
+
+
+def usable_work_ids(calc: Calculator) -> list:
+    """Работы справочника, для которых калькулятор считает ненулевую стоимость"""
+    work_ids = []
+    for work in calc.work_types.get("work_types", []):
+        item = calc.create_work_item(work["id"], 1)
+        item.calculate()
+        if item.total_cost > 0:
+            work_ids.append(work["id"])
+    return work_ids
+
+
+def synthetic_estimate(calc: Calculator, work_ids: list, size: int):
+    """Смета из size позиций справочника (детерминированно по SEED и size)"""
+    rng = random.Random(SEED + size)
+    items_data = [
+        {"work_id": rng.choice(work_ids), "quantity": rng.choice((1, 2, 5, 10, 25, 50, 120))}
+        for _ in range(size)
+    ]
+    estimate = calc.create_estimate(f"Бенчмарк {size}", items_data)
+    estimate.project_code = f"BENCH-{size}"
+    estimate.object_name = "Синтетический объект"
+    estimate.customer = "—"
+    estimate.contractor = "—"
+    estimate.date_created = "2025-01-01"
+    estimate.template_name = "синтетическая смета"
+    estimate.additional_costs = calculate_additional_costs(
+        calc, float(estimate.subtotal_field), PROJECT_INFO, lab_cost=float(estimate.subtotal_laboratory)
+    )
+    estimate.price_index = Decimal("1.12")
+    estimate.contract_coefficient = Decimal("0.95")
+    return estimate
+
+
+def measure(exporter, estimate, repeat: int, memory: bool) -> dict:
+    """Лучшее время из repeat прогонов и пиковая память отдельного прогона"""
+    best = float("inf")
+    for _ in range(repeat):
+        # Как timeit: сборщик мусора не срабатывает посреди замера
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            exporter(estimate, io.BytesIO())
+            best = min(best, time.perf_counter() - started)
+        finally:
+            gc.enable()
+    result = {"seconds": round(best, 4)}
+    if memory:
+        tracemalloc.start()
+        exporter(estimate, io.BytesIO())
+        result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        tracemalloc.stop()
+    return result
+
+
+def run(sizes, formats, repeat: int, memory: bool) -> dict:
+    calc = Calculator()
+    work_ids = usable_work_ids(calc)
+    results = {fmt: {} for fmt in formats}
+    for size in sizes:
+        estimate = synthetic_estimate(calc, work_ids, size)
+        for fmt in formats:
+            # Прогрев: шрифты PDF, справочники и импорт ленивых модулей не входят в замер
+            if size == sizes[0]:
+                EXPORTERS[fmt](estimate, io.BytesIO())
+            result = measure(EXPORTERS[fmt], estimate, repeat if size < 10000 else 1, memory)
+            results[fmt][str(size)] = result
+            peak = f", {result['peak_mb']:.1f} МБ" if "peak_mb" in result else ""
+            print(f"{fmt:>5} {size:>6} строк: {result['seconds']:.3f} с{peak}", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, thresholds: dict) -> list:
+    """Список регрессий относительно базовой линии"""
+    regressions = []
+    for fmt, by_size in results.items():
+        for size, current in by_size.items():
+            reference = baseline.get("results", {}).get(fmt, {}).get(size)
+            if not reference:
+                continue
+            checks = (
+                ("seconds", "time_ratio", "min_seconds", "с"),
+                ("peak_mb", "memory_ratio", "min_mb", "МБ"),
+            )
+            for key, ratio_key, min_key, unit in checks:
+                if key not in current or key not in reference:
+                    continue
+                limit = reference[key] * thresholds[ratio_key]
+                if current[key] > limit and current[key] - reference[key] > thresholds[min_key]:
+                    regressions.append(
+                        f"{fmt} {size} строк: {current[key]:.3f} {unit} > "
+                        f"{reference[key]:.3f} {unit} × {thresholds[ratio_key]}"
+                    )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк экспорта смет")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--formats", nargs="+", choices=list(EXPORTERS), default=list(EXPORTERS))
+    parser.add_argument("--repeat", type=int, default=3, help="прогонов на замер времени (берётся лучший)")
+    parser.add_argument("--no-memory", action="store_true", help="не замерять память (tracemalloc замедляет прогон)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="записать результаты как базовую линию")
+    parser.add_argument("--time-ratio", type=float, help="порог по времени (по умолчанию из базовой линии)")
+    parser.add_argument("--memory-ratio", type=float, help="порог по памяти (по умолчанию из базовой линии)")
+    args = parser.parse_args(argv)
+
+    results = run(sorted(args.sizes), args.formats, args.repeat, not args.no_memory)
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get("thresholds", {})}
+    if args.time_ratio:
+        thresholds["time_ratio"] = args.time_ratio
+    if args.memory_ratio:
+        thresholds["memory_ratio"] = args.memory_ratio
+
+    if args.update_baseline:
+        merged = baseline.get("results", {})
+        for fmt, by_size in results.items():
+            merged.setdefault(fmt, {}).update(by_size)
+        args.baseline.write_text(json.dumps({
+            "machine": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+            },
+            "thresholds": thresholds,
+            "results": merged,
+        }, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"Базовая линия записана: {args.baseline}")
+        return 0
+
+    if not baseline:
+        print("Базовой линии нет — запустите с --update-baseline")
+        return 0
+
+    regressions = compare(results, baseline, thresholds)
+    if regressions:
+        print("\nРегрессии:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\nРегрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Бюджет холодного импорта: время импорта калькулятора, экспорта и приложения
+в свежем интерпретаторе (python -X importtime)
+
+Каждый модуль импортируется в отдельном процессе несколько раз, берётся
+лучшее время. Кроме времени проверяется, что при старте не загружаются
+библиотеки форматов экспорта (openpyxl, reportlab, python-docx, XlsxWriter) —
+они импортируются при первой выгрузке (modules.export.get_exporter).
+При превышении бюджета или ранней загрузке библиотек скрипт завершается
+с кодом 1 и печатает самые долгие импорты.
+
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --scale 2        # медленная машина: бюджеты × 2
+    python benchmarks/import_budget.py --modules modules.calculator --repeat 5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Бюджеты холодного импорта, с (import app выполняет скрипт Streamlit без сервера)
+IMPORT_BUDGETS = {
+    "modules.calculator": 0.1,
+    "modules.export": 0.15,
+    "app": 1.5,
+}
+
+# Библиотеки, которые не должны загружаться при импорте модулей из IMPORT_BUDGETS
+LAZY_PACKAGES = ("openpyxl", "reportlab", "docx", "xlsxwriter")
+
+# Сколько самых долгих импортов печатать при превышении бюджета
+TOP_IMPORTS = 10
+
+
+def import_profile(module: str) -> list:
+    """Импорт module в свежем интерпретаторе: [(имя, собственное время, накопленное время, вложенность)], с"""
+    env = {**os.environ, "STREAMLIT_LOGGER_LEVEL": "error"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module}: {result.stderr.strip().splitlines()[-1]}")
+
+    profile = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        profile.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return profile
+
+
+def measure(module: str, repeat: int) -> tuple:
+    """Лучшее время импорта module из repeat прогонов и профиль этого прогона"""
+    best, best_profile = float("inf"), []
+    for _ in range(repeat):
+        profile = import_profile(module)
+        seconds = next(cumulative for name, _, cumulative, depth in profile if name == module and depth == 0)
+        if seconds < best:
+            best, best_profile = seconds, profile
+    return best, best_profile
+
+
+def eager_packages(profile: list) -> list:
+    """Библиотеки из LAZY_PACKAGES, загруженные при импорте"""
+    loaded = {name.split(".")[0] for name, _, _, _ in profile}
+    return [package for package in LAZY_PACKAGES if package in loaded]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бюджет холодного импорта модулей приложения")
+    parser.add_argument("--modules", nargs="+", choices=list(IMPORT_BUDGETS), default=list(IMPORT_BUDGETS))
+    parser.add_argument("--repeat", type=int, default=3, help="прогонов на модуль (берётся лучший)")
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель бюджетов для медленных машин")
+    args = parser.parse_args(argv)
+
+    failures = []
+    for module in args.modules:
+        seconds, profile = measure(module, args.repeat)
+        budget = IMPORT_BUDGETS[module] * args.scale
+        eager = eager_packages(profile)
+        status = "ok" if seconds <= budget and not eager else "ПРЕВЫШЕН"
+        print(f"{module:<20} {seconds:6.3f} с (бюджет {budget:.3f} с) {status}", flush=True)
+
+        if eager:
+            failures.append(f"{module}: при импорте загружаются {', '.join(eager)}")
+        if seconds > budget:
+            failures.append(f"{module}: {seconds:.3f} с > {budget:.3f} с")
+            # Самые долгие импорты без учёта вложенных — где искать причину
+            for name, self_seconds, _, _ in sorted(profile, key=lambda row: row[1], reverse=True)[:TOP_IMPORTS]:
+                print(f"    {self_seconds:6.3f} с  {name}")
+
+    if failures:
+        print("\nБюджет импорта нарушен:")
+        for line in failures:
+            print(f"  {line}")
+        return 1
+    print("\nБюджет импорта соблюдён")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
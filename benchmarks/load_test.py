@@ -0,0 +1,287 @@
+"""
+Нагрузочный прогон приложения: N одновременных сессий Streamlit (AppTest)
+
+Каждая сессия повторяет сценарий пользователя: открыть приложение, раскрыть
+и применить шаблон, поправить количества, переставить позицию и собрать
+документ. Замеряются задержки каждого взаимодействия (перезапуск скрипта),
+процессорное время и память; итог — перцентили задержек по видам
+взаимодействий и отчёт JSON. Внешние сервисы и браузер не нужны.
+
+AppTest держит в процессе один глобальный runtime, поэтому каждая сессия
+работает в своём процессе. Сессии конкурируют за процессоры так же, как
+на сервере, но кэши st.cache_resource у каждой сессии свои — время первого
+открытия выше, чем у сессии на прогретом сервере.
+
+    python benchmarks/load_test.py --sessions 8
+    python benchmarks/load_test.py --sessions 4 --rounds 3 --report load_report.json
+    python benchmarks/load_test.py --sessions 16 --p95-limit 2.0   # код 1 при превышении
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+
+EXPORT_FORMATS = ("xlsx", "pdf", "docx")
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Как часто главный процесс замеряет суммарную память сессий, с
+RSS_SAMPLE_SECONDS = 0.25
+
+
+def rss_mb(pid: int = None) -> Optional[float]:
+    """Резидентная память процесса, МБ (psutil или /proc); None, если узнать нельзя"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss / 2**20
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def percentile(values: list, q: float) -> float:
+    """Перцентиль с линейной интерполяцией между соседними значениями"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def _keys(at, prefix) -> list:
+    return [button.key for button in at.button if button.key and button.key.startswith(prefix)]
+
+
+def run_session(session_id: int, config: dict) -> dict:
+    """Сценарий одной сессии; возвращает замеры взаимодействий и ошибки"""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(config["seed"] + session_id)
+    timings, errors = [], []
+    at = AppTest.from_file(str(APP_PATH), default_timeout=config["timeout"])
+
+    def step(name: str, widget=None):
+        started = time.perf_counter()
+        try:
+            (widget or at).run()
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+            return
+        timings.append((name, time.perf_counter() - started))
+        if at.exception:
+            errors.append(f"{name}: {at.exception[0].message}")
+        if config["think"]:
+            time.sleep(config["think"] * rng.uniform(0.5, 1.5))
+
+    step("load")
+    for _ in range(config["rounds"]):
+        template_key = rng.choice(_keys(at, "open_"))
+        # Повторный клик по раскрытому шаблону сворачивает его
+        is_open = ("gallery_template" in at.session_state
+                   and at.session_state["gallery_template"] == template_key[len("open_"):])
+        if not is_open:
+            step("open_template", at.button(key=template_key).click())
+        apply_keys = _keys(at, "apply_")
+        if not apply_keys:
+            errors.append("apply_template: нет кнопки применения шаблона")
+            continue
+        step("apply_template", at.button(key=apply_keys[0]).click())
+
+        for _ in range(config["edits"]):
+            quantities = [n for n in at.number_input if n.key and n.key.startswith("qty_")]
+            if quantities:
+                step("edit_quantity", rng.choice(quantities).set_value(float(rng.randint(1, 60))))
+
+        move_keys = _keys(at, ("up_", "dn_"))
+        if move_keys:
+            step("move_item", at.button(key=rng.choice(move_keys)).click())
+
+        fmt = rng.choice(config["formats"])
+        prepare_keys = _keys(at, f"prepare_{fmt}")
+        if prepare_keys:
+            step(f"export_{fmt}", at.button(key=prepare_keys[0]).click())
+
+    return {
+        "session": session_id,
+        "timings": timings,
+        "errors": errors,
+        "cpu_seconds": time.process_time(),
+        "rss_mb": rss_mb(),
+    }
+
+
+def _session_main(session_id: int, config: dict, barrier, results):
+    # Импорт streamlit и AppTest — до старта, чтобы сессии начинали одновременно
+    from streamlit.testing.v1 import AppTest  # noqa: F401
+    # Без сервера streamlit предупреждает об отсутствии ScriptRunContext — в отчёте это шум
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit."):
+            logging.getLogger(name).setLevel(logging.ERROR)
+    barrier.wait()
+    time.sleep(config["ramp"] * session_id)
+    try:
+        results.put(run_session(session_id, config))
+    except Exception as e:
+        results.put({"session": session_id, "timings": [], "errors": [f"session: {e}"],
+                     "cpu_seconds": time.process_time(), "rss_mb": rss_mb()})
+
+
+def run_load(config: dict) -> dict:
+    """Запустить config["sessions"] сессий одновременно и собрать отчёт"""
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(config["sessions"] + 1)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=_session_main, args=(session_id, config, barrier, results), daemon=True)
+        for session_id in range(config["sessions"])
+    ]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    started = time.perf_counter()
+
+    # Пиковая суммарная память сессий — по замерам главного процесса
+    peak = {"rss_mb": 0.0}
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            sizes = [rss_mb(process.pid) for process in processes if process.is_alive()]
+            peak["rss_mb"] = max(peak["rss_mb"], sum(size or 0 for size in sizes))
+            done.wait(RSS_SAMPLE_SECONDS)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    sessions = [results.get() for _ in processes]
+    wall = time.perf_counter() - started
+    done.set()
+    sampler.join()
+    for process in processes:
+        process.join()
+
+    return build_report(config, sessions, wall, peak["rss_mb"])
+
+
+def build_report(config: dict, sessions: list, wall: float, peak_rss_mb: float) -> dict:
+    by_interaction = {}
+    for session in sessions:
+        for name, seconds in session["timings"]:
+            by_interaction.setdefault(name, []).append(seconds)
+
+    interactions = {}
+    for name, values in sorted(by_interaction.items()):
+        stats = {"count": len(values), "mean": sum(values) / len(values), "max": max(values)}
+        stats.update({f"p{q}": percentile(values, q) for q in PERCENTILES})
+        interactions[name] = {key: round(value, 4) for key, value in stats.items()}
+
+    cpu_seconds = sum(session["cpu_seconds"] for session in sessions)
+    cpus = os.cpu_count() or 1
+    session_rss = [session["rss_mb"] for session in sessions if session["rss_mb"] is not None]
+    return {
+        "config": config,
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": cpus},
+        "wall_seconds": round(wall, 2),
+        "interactions": interactions,
+        "throughput_per_second": round(sum(len(s["timings"]) for s in sessions) / wall, 2) if wall else 0,
+        "cpu": {
+            "seconds": round(cpu_seconds, 2),
+            "utilisation": round(cpu_seconds / (wall * cpus), 3) if wall else 0,
+        },
+        "rss_mb": {
+            "peak_total": round(peak_rss_mb, 1),
+            "per_session_max": round(max(session_rss), 1) if session_rss else None,
+            "per_session_mean": round(sum(session_rss) / len(session_rss), 1) if session_rss else None,
+        },
+        "sessions": [
+            {key: session[key] for key in ("session", "cpu_seconds", "rss_mb", "errors")}
+            for session in sorted(sessions, key=lambda s: s["session"])
+        ],
+        "errors": sum(len(session["errors"]) for session in sessions),
+    }
+
+
+def print_report(report: dict):
+    config = report["config"]
+    print(f"Сессий: {config['sessions']}, раундов: {config['rounds']}, "
+          f"время: {report['wall_seconds']:.1f} с, взаимодействий в секунду: {report['throughput_per_second']}")
+    header = f"{'взаимодействие':<16}{'n':>6}" + "".join(f"{f'p{q}, с':>10}" for q in PERCENTILES) + f"{'max, с':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, stats in report["interactions"].items():
+        print(f"{name:<16}{stats['count']:>6}"
+              + "".join(f"{stats[f'p{q}']:>10.3f}" for q in PERCENTILES)
+              + f"{stats['max']:>10.3f}")
+    cpu, rss = report["cpu"], report["rss_mb"]
+    print(f"\nCPU: {cpu['seconds']:.1f} с, загрузка {cpu['utilisation']:.0%} от {report['machine']['cpus']} процессоров")
+    if rss["per_session_max"] is not None:
+        print(f"Память: пик всех сессий {rss['peak_total']:.0f} МБ, "
+              f"на сессию {rss['per_session_mean']:.0f} МБ (макс. {rss['per_session_max']:.0f} МБ)")
+    for session in report["sessions"]:
+        for error in session["errors"]:
+            print(f"  сессия {session['session']}: {error}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон приложения (AppTest)")
+    parser.add_argument("--sessions", type=int, default=4, help="одновременных сессий")
+    parser.add_argument("--rounds", type=int, default=2, help="повторов сценария в сессии")
+    parser.add_argument("--edits", type=int, default=3, help="правок количества за раунд")
+    parser.add_argument("--formats", nargs="+", choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS))
+    parser.add_argument("--think", type=float, default=0.2, help="пауза пользователя между действиями, с")
+    parser.add_argument("--ramp", type=float, default=0.0, help="задержка старта каждой следующей сессии, с")
+    parser.add_argument("--seed", type=int, default=281)
+    parser.add_argument("--timeout", type=float, default=120, help="предельное время одного перезапуска, с")
+    parser.add_argument("--export-cache-dir", type=Path,
+                        help="включить дисковый кэш документов в этой папке (по умолчанию кэш выключен)")
+    parser.add_argument("--report", type=Path, help="записать отчёт JSON")
+    parser.add_argument("--p95-limit", type=float, help="код 1, если p95 любого взаимодействия выше, с")
+    args = parser.parse_args(argv)
+
+    # Сессии — дочерние процессы, config читает переменную при их старте
+    os.environ["SMETA_EXPORT_CACHE_DIR"] = str(args.export_cache_dir or "")
+
+    config = {key: getattr(args, key) for key in
+              ("sessions", "rounds", "edits", "formats", "think", "ramp", "seed", "timeout")}
+    config["export_cache"] = str(args.export_cache_dir or "")
+    report = run_load(config)
+    print_report(report)
+
+    if args.report:
+        args.report.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"\nОтчёт: {args.report}")
+
+    failed = report["errors"] > 0
+    if args.p95_limit is not None:
+        slow = [name for name, stats in report["interactions"].items() if stats["p95"] > args.p95_limit]
+        if slow:
+            print(f"\np95 выше {args.p95_limit} с: {', '.join(slow)}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
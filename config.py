@@ -1,6 +1,8 @@
 # Конфигурация приложения
 # Приказ Минстроя РФ №281/пр от 12.05.2025
 
+import os
+
 # Уровень цен (дата)
 PRICE_LEVEL_DATE = "2024-01-01"
 
@@ -11,6 +13,19 @@ PRICE_INDEX = 1.0  # На 01.01.2024 базовый уровень
 # Настройки БД
 DATABASE_PATH = "database/smeta.db"
 
+# Шрифт с кириллицей для PDF (путь к TTF и, при наличии, к жирному начертанию).
+# Переменные окружения SMETA_PDF_FONT / SMETA_PDF_FONT_BOLD имеют приоритет;
+# если путь не задан, шрифт ищется в системных папках текущей ОС
+PDF_FONT_PATH = os.environ.get("SMETA_PDF_FONT", "")
+PDF_FONT_BOLD_PATH = os.environ.get("SMETA_PDF_FONT_BOLD", "")
+
+# Дисковый кэш готовых документов экспорта (общий для сессий и процессов сервера).
+# По умолчанию выключен: экспорт не пишет на диск (в контейнерах /tmp — маленький tmpfs).
+# SMETA_EXPORT_CACHE_DIR задаёт папку приложения и включает кэш,
+# SMETA_EXPORT_CACHE_MB — предельный размер, сверх которого удаляются давно не читанные документы
+EXPORT_CACHE_DIR = os.environ.get("SMETA_EXPORT_CACHE_DIR", "")
+EXPORT_CACHE_MAX_MB = int(os.environ.get("SMETA_EXPORT_CACHE_MB", "256"))
+
 # Настройки приложения
 APP_TITLE = "Расчёт сметной стоимости ИГИ"
 APP_ICON = "📊"
@@ -0,0 +1,216 @@
+"""
+Расчёт дополнительных затрат (ДЗ) по НЗ №281/пр, п.20-48
+"""
+
+
+def calculate_additional_costs(calc, field_cost: float, project_info: dict, lab_cost: float = 0) -> list:
+    """Расчет дополнительных затрат (п.20-48 НЗ №281/пр)
+    
+    Формула 3: ДЗП = ДЗНП + ДЗноч + ДЗрежим + ДЗпроезд + ДЗорг + ДЗрП + ДЗсП
+    
+    Args:
+        calc: экземпляр Calculator (справочники и коэффициенты)
+        field_cost: стоимость полевых работ (СПпз)
+        project_info: информация о проекте (регион, расстояние, флаги)
+        lab_cost: стоимость лабораторных работ (СЛпз) для расчёта ДЗрайонЛ
+    """
+    coefficients = calc.coefficients
+    
+    # === 1. ДЗ на неблагоприятный период (формула 4, п.21) ===
+    if project_info.get("is_unfavorable_period_active", False):
+        region = project_info.get("region", "г. Москва")
+        regions = coefficients.get("unfavorable_periods_by_region", {}).get("regions", {})
+        unfav_duration = regions.get(region, 6.0)
+        
+        unfav_coefs = coefficients.get("unfavorable_period", {}).get("coefficients_by_duration_months", {})
+        unfav_percent = 0
+        
+        for range_key, percents in unfav_coefs.items():
+            if calc._check_duration_range(unfav_duration, range_key):
+                cost_key = calc._get_cost_range_key(field_cost)
+                unfav_percent = percents.get(cost_key, 0)
+                break
+        
+        dz_unfav = field_cost * unfav_percent / 100
+    else:
+        dz_unfav = 0
+        unfav_percent = 0
+    
+    # === 2. ДЗ на неизбежные перерывы (формула 6, п.26-27) ===
+    # ДЗрежим = СПрежим × ПДЗрежим
+    # ПДЗрежим = 25% для объектов п.27
+    if project_info.get("is_regime_object", False):
+        regime_data = coefficients.get("intermittent_work", {})
+        regime_percent = regime_data.get("pdz_regime_percent", 25)
+        dz_regime = field_cost * regime_percent / 100
+    else:
+        dz_regime = 0
+        regime_percent = 0
+    
+    # === 3. ДЗ на проезд (формулы 7-8, п.28-36) ===
+    distance = project_info.get("distance_km", 50)
+    transport_type = project_info.get("transport_type", "auto")  # auto / non_auto
+    has_static_sounding = project_info.get("has_static_sounding", False)
+    use_interpolation = project_info.get("use_interpolation", True)
+    
+    # Выбор таблицы коэффициентов по типу транспорта и зондирования
+    if transport_type == "auto":
+        if not has_static_sounding:
+            travel_table_key = "travel_costs_IZ"  # Таблица 4 (авто, без зондирования)
+            travel_table_name = "Таблица 4"
+            travel_paragraph = "п.29"
+        else:
+            travel_table_key = "travel_costs_NZ"  # Таблица 5 (авто, с зондированием)
+            travel_table_name = "Таблица 5"
+            travel_paragraph = "п.30"
+    else:
+        if not has_static_sounding:
+            travel_table_key = "travel_costs_table6"  # Таблица 6 (не авто, без зондирования)
+            travel_table_name = "Таблица 6"
+            travel_paragraph = "п.33"
+        else:
+            travel_table_key = "travel_costs_table7"  # Таблица 7 (не авто, с зондированием)
+            travel_table_name = "Таблица 7"
+            travel_paragraph = "п.34"
+    
+    travel_coefs = coefficients.get(travel_table_key, {}).get("coefficients_by_distance_km", {})
+    
+    # Определяем ключ стоимостного диапазона
+    # Для travel_costs_NZ и table7 — другие диапазоны стоимости
+    if travel_table_key in ("travel_costs_NZ", "travel_costs_table7"):
+        cost_key = calc._get_travel_cost_range_key(field_cost)
+    else:
+        cost_key = calc._get_cost_range_key(field_cost)
+    
+    # Расчёт процента — с интерполяцией или без
+    if use_interpolation and travel_coefs:
+        travel_percent = calc.interpolate_coefficient(distance, travel_coefs, cost_key)
+    else:
+        travel_percent = 0
+        for dist_key, percents in travel_coefs.items():
+            if calc._check_distance_range(distance, dist_key):
+                travel_percent = percents.get(cost_key, 0) or 0
+                break
+    
+    dz_travel = field_cost * travel_percent / 100
+    
+    # === 4. ДЗ на организацию полевых работ (п.37-39, Таблица 20) ===
+    # ДЗорг = СПпз × ПДЗорг / 100
+    # Не применяется если работы по месту постоянной работы (п.38)
+    is_local = project_info.get("is_local_work", False)
+    
+    if not is_local:
+        org_coefs = coefficients.get("organization_costs", {}).get("coefficients_by_distance_km", {})
+        org_percent = 0
+        org_cost_key = calc._get_cost_range_key(field_cost)
+        
+        for dist_key, percents in org_coefs.items():
+            if calc._check_distance_range(distance, dist_key):
+                org_percent = percents.get(org_cost_key, 0) or 0
+                break
+                
+        dz_org = field_cost * org_percent / 100
+    else:
+        dz_org = 0
+        org_percent = 0
+    
+    # === 5. ДЗ на районные выплаты — полевые (формула 10, п.40) ===
+    # ДЗрП = (СПпз + ДЗНП + ДЗрежим + ДЗноч + ДЗорг) × (ДЗП × ПДЗр + ДпрочП - 1)
+    # где: ДЗП = доля ФОТ = 0.41 (labor_share_field)
+    #       ДпрочП = доля прочих = 0.59 (other_share_field)
+    #       ПДЗр = районный коэффициент
+    region = project_info.get("region", "г. Москва")
+    pdz_r = calc.get_regional_coefficient(region)
+    
+    reg_data = coefficients.get("regional_allowances", {})
+    dzp_share = reg_data.get("labor_share_field", 0.41)
+    dproch_field = reg_data.get("other_share_field", 0.59)
+    
+    dz_rp = 0
+    rp_multiplier = 0
+    
+    if pdz_r > 1.0:
+        # База для районных = СПпз + ДЗНП + ДЗрежим + ДЗноч + ДЗорг
+        base_for_regional = field_cost + dz_unfav + dz_regime + dz_org
+        # Множитель: (ДЗП × ПДЗр + ДпрочП - 1)
+        rp_multiplier = dzp_share * pdz_r + dproch_field - 1
+        dz_rp = base_for_regional * rp_multiplier
+    
+    # === 6. ДЗ на районные выплаты — лабораторные (формула 14, п.47) ===
+    # ДЗрайонЛ = СЛпз × (ДЗПЛ × ПДЗрайон + ДпрочЛ - 1)
+    # ВАЖНО: если лаборатория в СПб — районный коэффициент к лаб. НЕ начисляется (К=1.0 в СПб)
+    dz_lab_regional = 0
+    lab_rp_multiplier = 0
+    lab_in_spb = project_info.get("lab_in_spb", True)
+    
+    if pdz_r > 1.0 and lab_cost > 0 and not lab_in_spb:
+        dzpl_share = reg_data.get("labor_share_lab", 0.65)
+        dproch_lab = reg_data.get("other_share_lab", 0.35)
+        lab_rp_multiplier = dzpl_share * pdz_r + dproch_lab - 1
+        dz_lab_regional = lab_cost * lab_rp_multiplier
+    
+    # === Формируем список дополнительных затрат ===
+    additional_costs = []
+    
+    if dz_unfav > 0:
+        additional_costs.append({
+            "type": "unfavorable",
+            "name": f"ДЗ на неблагоприятный период ({unfav_percent}%)",
+            "value": dz_unfav,
+            "percent": unfav_percent,
+            "basis": f"НЗ №281/пр, п.21, формула 4",
+            "formula": f"СПпз({field_cost:,.0f}) × {unfav_percent/100:.4f}"
+        })
+    
+    if dz_regime > 0:
+        additional_costs.append({
+            "type": "regime",
+            "name": f"ДЗ на неизбежные перерывы ({regime_percent}%)",
+            "value": dz_regime,
+            "percent": regime_percent,
+            "basis": f"НЗ №281/пр, п.26-27, формула 6",
+            "formula": f"СПпз({field_cost:,.0f}) × {regime_percent/100:.2f}"
+        })
+    
+    if dz_travel > 0:
+        interp_note = " (интерп.)" if use_interpolation else ""
+        additional_costs.append({
+            "type": "travel",
+            "name": f"ДЗ на проезд ({travel_percent:.1f}%){interp_note}",
+            "value": dz_travel,
+            "percent": travel_percent,
+            "basis": f"НЗ №281/пр, {travel_paragraph}, {travel_table_name} (расст. {distance} км, СПпз до {cost_key.replace('up_to_','').replace('k',' тыс.')})",
+            "formula": f"СПпз({field_cost:,.0f}) × {travel_percent/100:.4f}"
+        })
+    
+    if dz_org > 0:
+        additional_costs.append({
+            "type": "organization",
+            "name": f"ДЗ на организацию полевых работ ({org_percent}%)",
+            "value": dz_org,
+            "percent": org_percent,
+            "basis": f"НЗ №281/пр, п.37, ф.(9), Таблица 8 (расст. {distance} км, СПпз до {org_cost_key.replace('up_to_','').replace('k',' тыс.')})",
+            "formula": f"СПпз({field_cost:,.0f}) × {org_percent/100:.4f}"
+        })
+    
+    if dz_rp > 0:
+        additional_costs.append({
+            "type": "regional_field",
+            "name": f"ДЗ на районные выплаты (полевые, Крайон={pdz_r})",
+            "value": dz_rp,
+            "percent": round(rp_multiplier * 100, 2),
+            "basis": f"НЗ №281/пр, п.40, формула 10",
+            "formula": f"({field_cost:,.0f} + {dz_unfav:,.0f} + {dz_regime:,.0f} + {dz_org:,.0f}) × {rp_multiplier:.4f}"
+        })
+    
+    if dz_lab_regional > 0:
+        additional_costs.append({
+            "type": "regional_lab",
+            "name": f"ДЗ на районные выплаты (лаб., Крайон={pdz_r})",
+            "value": dz_lab_regional,
+            "percent": round(lab_rp_multiplier * 100, 2),
+            "basis": f"НЗ №281/пр, п.47, формула 14",
+            "formula": f"{lab_cost:,.0f} × {lab_rp_multiplier:.4f}"
+        })
+        
+    return additional_costs
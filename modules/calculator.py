@@ -4,9 +4,11 @@
 """
 
 import json
+from bisect import bisect_left
 from pathlib import Path
 from decimal import Decimal, ROUND_HALF_UP
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Optional, Dict, Any
 import datetime
 
@@ -18,6 +20,15 @@ def load_json(filename: str) -> dict:
         return json.load(f)
 
 
+@lru_cache(maxsize=1)
+def work_categories() -> dict:
+    """Категории работ {work_id: category} — справочник читается один раз на процесс"""
+    return {
+        work["id"]: work.get("category", "")
+        for work in load_json("work_types.json").get("work_types", [])
+    }
+
+
 def get_nested_value(data: dict, key_path: str, default=None):
     """Получить значение по вложенному пути (a.b.c)"""
     keys = key_path.split(".")
@@ -47,6 +58,7 @@ class WorkItem:
     table_ref: str = ""
     formula: str = ""
     pz1p_fixed: Decimal = Decimal("0")  # Фиксированная часть для рекогносцировки (ПЗ1п)
+    sources: list = field(default_factory=list)  # [{"template_id", "quantity"}] — из каких шаблонов собрана позиция
     
     def calculate(self):
         """Рассчитать стоимость позиции"""
@@ -135,11 +147,7 @@ class Estimate:
     
     def _get_work_category(self, work_id: str) -> str:
         """Получить категорию работы по ID"""
-        work_types = load_json("work_types.json")
-        for work in work_types.get("work_types", []):
-            if work["id"] == work_id:
-                return work.get("category", "")
-        return ""
+        return work_categories().get(work_id, "")
     
     def add_item(self, item: WorkItem):
         """Добавить позицию в смету"""
@@ -178,13 +186,82 @@ class Estimate:
         }
 
 
+class CategoryOrder:
+    """Индекс соседей по категориям для списка позиций сметы.
+
+    Для каждой категории хранится упорядоченный список её позиций в общем
+    списке, для каждой позиции — место в списке своей категории. Поиск
+    соседа той же категории — O(1); перестановка с ним не меняет индекс
+    (оба места остаются за той же категорией). Добавление в конец — O(1),
+    удаление сдвигает только позиции после удалённой.
+    """
+
+    def __init__(self, categories=()):
+        self._categories = []   # позиция -> категория
+        self._ranks = []        # позиция -> место в списке категории
+        self._positions = {}    # категория -> [позиции по возрастанию]
+        for category in categories:
+            self.append(category)
+
+    def __len__(self) -> int:
+        return len(self._categories)
+
+    def category(self, index: int) -> str:
+        return self._categories[index]
+
+    def groups(self) -> dict:
+        """Позиции по категориям: {категория: [позиции]}"""
+        return {category: list(positions) for category, positions in self._positions.items() if positions}
+
+    def neighbor(self, index: int, step: int) -> Optional[int]:
+        """Позиция соседа той же категории (step = -1 — предыдущий, +1 — следующий) или None"""
+        positions = self._positions[self._categories[index]]
+        rank = self._ranks[index] + step
+        return positions[rank] if 0 <= rank < len(positions) else None
+
+    def append(self, category: str):
+        positions = self._positions.setdefault(category, [])
+        self._ranks.append(len(positions))
+        positions.append(len(self._categories))
+        self._categories.append(category)
+
+    def pop(self, index: int) -> str:
+        """Удалить позицию index; позиции после неё сдвигаются на одну"""
+        category = self._categories.pop(index)
+        rank = self._ranks.pop(index)
+        positions = self._positions[category]
+        del positions[rank]
+        for other in self._positions.values():
+            for k in range(bisect_left(other, index), len(other)):
+                other[k] -= 1
+        for position in positions[rank:]:
+            self._ranks[position] -= 1
+        return category
+
+
 class Calculator:
     """Калькулятор сметной стоимости ИГИ"""
     
+    # Таблица 66: границы площади (га) и глубины (м), суффиксы ID и ключи normative_costs
+    PROGRAM_AREA_BOUNDS = (1, 10, 100)
+    PROGRAM_AREA_SUFFIXES = ("lt1ha", "10ha", "100ha", "gt100ha")
+    PROGRAM_AREA_KEYS = ("area_up_to_1ha", "area_1_to_10ha", "area_10_to_100ha", "area_over_100ha")
+    PROGRAM_DEPTH_BOUNDS = (5, 10, 15, 25, 50, 75)
+    PROGRAM_DEPTH_SUFFIXES = ("5m", "10m", "15m", "25m", "50m", "75m", "over")
+    PROGRAM_DEPTH_KEYS = (
+        "depth_up_to_5m", "depth_5_to_10m", "depth_10_to_15m", "depth_15_to_25m",
+        "depth_25_to_50m", "depth_50_to_75m", "depth_over_75m",
+    )
+
     def __init__(self):
         self.work_types = load_json("work_types.json")
         self.normative_costs = load_json("normative_costs.json")
         self.coefficients = load_json("coefficients.json")
+        
+        # Индексы, собираемые один раз при загрузке справочников
+        self._work_types_by_id = {w["id"]: w for w in self.work_types.get("work_types", [])}
+        self._report_scales = self._compile_report_table()
+        self._program_costs, self._program_works = self._compile_program_table()
     
     def get_work_types_by_category(self, category: str = None) -> list:
         """Получить виды работ (опционально по категории)"""
@@ -195,10 +272,28 @@ class Calculator:
     
     def get_work_type(self, work_id: str) -> dict:
         """Получить вид работы по ID"""
-        for work in self.work_types.get("work_types", []):
-            if work["id"] == work_id:
-                return work
-        return {}
+        return self._work_types_by_id.get(work_id, {})
+    
+    def category_order(self, items: list) -> CategoryOrder:
+        """Индекс соседей по категориям для позиций сметы (словари с work_id или WorkItem)"""
+        return CategoryOrder(
+            self.get_work_type(item["work_id"] if isinstance(item, dict) else item.work_id).get("category", "field")
+            for item in items
+        )
+    
+    def move_item(self, items: list, index: int, step: int, order: CategoryOrder = None) -> Optional[int]:
+        """Поменять позицию с соседней позицией той же категории (step = -1 — вверх, +1 — вниз).
+        
+        order: готовый индекс для items — перестановка его не портит, поэтому
+        один индекс годится для серии перестановок.
+        Возвращает новый индекс позиции или None, если соседа нет.
+        """
+        if order is None:
+            order = self.category_order(items)
+        neighbor = order.neighbor(index, step)
+        if neighbor is not None:
+            items[index], items[neighbor] = items[neighbor], items[index]
+        return neighbor
     
     def get_base_cost(self, work_id: str) -> Decimal:
         """Получить базовую стоимость по ID работы.
@@ -600,7 +695,7 @@ class Calculator:
     ) -> Estimate:
         """Создать смету
         
-        items_data: список словарей вида {"work_id": "...", "quantity": 10, "override_base_cost": 123.45, "formula": "..."}
+        items_data: список словарей вида {"work_id": "...", "quantity": 10, "override_base_cost": 123.45, "formula": "...", "sources": [...]}
         is_local_work: Работы по месту постоянной работы (п.12 НЗ, применяется К1)
         """
         estimate = Estimate(project_name=project_name)
@@ -626,10 +721,89 @@ class Calculator:
                     formula=formula,
                     is_local_work=is_local_work
                 )
+                work_item.sources = list(item_data.get("sources", []))
                 estimate.add_item(work_item)
         
         return estimate
         
+    def _compile_report_table(self) -> dict:
+        """Разобрать Таблицу 65 в отсортированные шкалы по категориям сложности.
+        
+        Ключи вида "up_to_20k", "50k", "over_3500k" разбираются один раз;
+        "over_..." ставится в конец шкалы с границей inf.
+        
+        Returns:
+            {complexity: (границы, стоимости, описания, ключи)}
+        """
+        table_65 = self.normative_costs.get("technical_report", {})
+        scales = {}
+        for comp_key, data in table_65.items():
+            if not comp_key.startswith("complexity_") or not isinstance(data, dict) or not data:
+                continue
+            
+            ranges = []
+            for key, value in data.items():
+                if key.startswith("up_to_"):
+                    k_val = int(key.replace("up_to_", "").replace("k", "")) * 1000
+                    display = f"до {k_val//1000} тыс. руб."
+                elif key.startswith("over_"):
+                    k_val = int(key.replace("over_", "").replace("k", "")) * 1000
+                    display = f"свыше {k_val//1000} тыс. руб."
+                    ranges.append((float('inf'), float(value), display, key))
+                    continue
+                else:
+                    k_val = int(key.replace("k", "")) * 1000
+                    display = f"до {k_val//1000} тыс. руб."
+                ranges.append((float(k_val), float(value), display, key))
+            
+            ranges.sort(key=lambda x: x[0])
+            scales[comp_key.replace("complexity_", "")] = tuple(list(col) for col in zip(*ranges))
+        return scales
+    
+    def _compile_program_table(self) -> tuple:
+        """Разобрать Таблицу 66 в матрицы площадь × глубина.
+        
+        Returns:
+            (стоимости [area][depth] для II категории, виды работ [area][depth])
+        """
+        table_66 = self.normative_costs.get("program", {})
+        costs = []
+        works = []
+        for area_key, area_suffix in zip(self.PROGRAM_AREA_KEYS, self.PROGRAM_AREA_SUFFIXES):
+            area_data = table_66.get(area_key, {})
+            costs.append([float(area_data.get(depth_key, 0)) for depth_key in self.PROGRAM_DEPTH_KEYS])
+            works.append([
+                self._work_types_by_id.get(f"program_cat2_{area_suffix}_{depth_suffix}", {})
+                for depth_suffix in self.PROGRAM_DEPTH_SUFFIXES
+            ])
+        return costs, works
+    
+    def _program_indices(self, area_ha: float, depth) -> tuple:
+        """Индексы ячейки Таблицы 66 по площади (га) и глубине (м или ключ "10"/"over")"""
+        area_idx = bisect_left(self.PROGRAM_AREA_BOUNDS, float(area_ha))
+        if depth == "over":
+            depth_idx = len(self.PROGRAM_DEPTH_BOUNDS)
+        else:
+            depth_idx = bisect_left(self.PROGRAM_DEPTH_BOUNDS, float(depth))
+        return area_idx, depth_idx
+    
+    def get_program_work(self, area_ha: float, depth) -> dict:
+        """Вид работы «Программа ИГИ» (Таблица 66) по площади участка и макс. глубине.
+        
+        Args:
+            area_ha: площадь участка, га
+            depth: максимальная глубина исследования, м (или ключ "5".."75"/"over")
+        """
+        area_idx, depth_idx = self._program_indices(area_ha, depth)
+        return self._program_works[area_idx][depth_idx]
+    
+    def get_program_cost(self, area_ha: float, depth, complexity: str = "II") -> Decimal:
+        """Стоимость программы ИГИ по Таблице 66 с коэффициентом категории сложности"""
+        area_idx, depth_idx = self._program_indices(area_ha, depth)
+        coefs = self.normative_costs.get("program", {}).get("complexity_coefficients", {})
+        cost = self._program_costs[area_idx][depth_idx] * coefs.get(complexity, 1.0)
+        return Decimal(str(round(cost, 2)))
+        
     def calculate_report_cost(self, cameral_sum: float, complexity: str) -> tuple[float, str, str]:
         """Рассчитать стоимость технического отчёта по Таблице 65.
         
@@ -640,51 +814,48 @@ class Calculator:
         Returns:
             (стоимость, описание_диапазона, upper_key)
         """
-        table_65 = self.normative_costs.get("technical_report", {})
-        comp_key = f"complexity_{complexity}"
-        data = table_65.get(comp_key, {})
-        
-        if not data:
+        scale = self._report_scales.get(complexity)
+        if not scale:
             return 0.0, "не найдено", ""
-            
-        # Правила разбора ключей (напр. "up_to_20k", "50k", "over_3500k")
-        ranges = []
-        for key, value in data.items():
-            if key.startswith("up_to_"):
-                k_val = int(key.replace("up_to_", "").replace("k", "")) * 1000
-                display = f"до {k_val//1000} тыс. руб."
-            elif key.startswith("over_"):
-                # Сохраняем реальное числовое значение для экстраполяции (берем его как максимум)
-                k_val = int(key.replace("over_", "").replace("k", "")) * 1000
-                display = f"свыше {k_val//1000} тыс. руб."
-                # Для сортировки ставим бесконечность, но для интерполяции это не используется
-                ranges.append((float('inf'), float(value), display, key))
-                continue
-            else:
-                k_val = int(key.replace("k", "")) * 1000
-                display = f"до {k_val//1000} тыс. руб."
-            ranges.append((float(k_val), float(value), display, key))
-            
-        ranges.sort(key=lambda x: x[0])
+        xs, ys, displays, keys = scale
         
         # Если сумма "до 20к" (или меньше первого лимита) - берем плоское значение для первого интервала.
-        if cameral_sum <= ranges[0][0]:
-             return float(ranges[0][1]), ranges[0][2], ranges[0][3]
-            
+        if cameral_sum <= xs[0]:
+            return ys[0], displays[0], keys[0]
+        
         # Последний элемент - это inf ("over_..."), предпоследний - максимальный лимит.
-        if len(ranges) >= 2 and cameral_sum >= ranges[-2][0]:
-            return float(ranges[-1][1]), ranges[-1][2], ranges[-1][3]
-            
-        for i in range(len(ranges) - 1):
-            x1, y1, _, _ = ranges[i]
-            x2, y2, _, up_key = ranges[i+1]
-            if x1 < cameral_sum <= x2:
-                # Согласно документам: Ц = Ц1 + (Ц2 - Ц1) * (X - X1) / (X2 - X1)
-                cost = y1 + (y2 - y1) * (cameral_sum - x1) / (x2 - x1)
-                display_range = f"от {int(x1)//1000} до {int(x2)//1000} тыс. руб. (интерполяция)"
-                return round(float(cost), 2), display_range, up_key
-                
-        return 0.0, "", ""
+        if len(xs) >= 2 and cameral_sum >= xs[-2]:
+            return ys[-1], displays[-1], keys[-1]
+        
+        # xs[i-1] < cameral_sum <= xs[i]
+        i = bisect_left(xs, cameral_sum)
+        x1, y1 = xs[i - 1], ys[i - 1]
+        x2, y2 = xs[i], ys[i]
+        # Согласно документам: Ц = Ц1 + (Ц2 - Ц1) * (X - X1) / (X2 - X1)
+        cost = y1 + (y2 - y1) * (cameral_sum - x1) / (x2 - x1)
+        display_range = f"от {int(x1)//1000} до {int(x2)//1000} тыс. руб. (интерполяция)"
+        return round(float(cost), 2), display_range, keys[i]
+    
+    def calculate_report_costs(self, cameral_sums, complexity: str):
+        """Векторный вариант calculate_report_cost для массива сумм камеральных работ.
+        
+        Returns:
+            numpy-массив стоимостей отчёта (без описаний диапазонов)
+        """
+        import numpy as np
+        
+        sums = np.asarray(cameral_sums, dtype=float)
+        scale = self._report_scales.get(complexity)
+        if not scale:
+            return np.zeros_like(sums)
+        xs, ys, _, _ = scale
+        
+        finite = len(xs) - 1 if xs[-1] == float('inf') else len(xs)
+        costs = np.round(np.interp(sums, xs[:finite], ys[:finite]), 2)
+        costs[sums <= xs[0]] = ys[0]
+        if len(xs) >= 2:
+            costs[sums >= xs[-2]] = ys[-1]
+        return costs
 
 
 # Пример использования
@@ -0,0 +1,255 @@
+"""
+Черновик сметы в состоянии сессии: типизированные позиции и номер ревизии
+
+Черновик неизменяемый: каждая правка возвращает новый EstimateDraft с
+ревизией на единицу больше, а неизменённые позиции переходят в него теми же
+объектами. Поэтому «изменилась ли смета» — сравнение двух чисел, а кэши
+(экспорт, сетка редактора, зависимые панели) ключуются ревизией.
+
+Производные поля — программа ИГИ по Таблице 66, стоимость и вид отчёта по
+Таблице 65, формулы расчёта — выставляет normalize_draft(); отрисовка
+только читает черновик.
+"""
+
+import sys
+import uuid
+from dataclasses import dataclass, replace
+from typing import Iterable, Optional
+
+
+# uid автоматически подобранной программы ИГИ
+PROGRAM_UID = "prog_auto"
+
+
+def new_uid() -> str:
+    return str(uuid.uuid4())[:8]
+
+
+@dataclass(frozen=True, slots=True)
+class DraftItem:
+    """Позиция черновика сметы"""
+    uid: str
+    work_id: str
+    quantity: float
+    coefficients: tuple = ()                    # ((имя, значение), ...) — доп. коэффициенты
+    override_base_cost: Optional[float] = None  # расценка отчёта по Таблице 65
+    formula: str = ""                           # формула расчёта для экспорта
+    sources: tuple = ()                         # ((template_id, количество), ...)
+
+    @classmethod
+    def new(cls, work_id: str, quantity: float, coefficients: dict = None, **fields) -> "DraftItem":
+        return cls(
+            uid=fields.pop("uid", None) or new_uid(),
+            work_id=sys.intern(work_id),
+            quantity=quantity,
+            coefficients=tuple(sorted((coefficients or {}).items())),
+            **fields,
+        )
+
+    @classmethod
+    def from_item_data(cls, data: dict) -> "DraftItem":
+        """Позиция из словаря формата Calculator.create_estimate / compose_templates"""
+        return cls.new(
+            data["work_id"],
+            data.get("quantity", 0),
+            data.get("additional_coefficients"),
+            uid=data.get("uid"),
+            override_base_cost=data.get("override_base_cost"),
+            formula=data.get("formula", ""),
+            sources=tuple((s.get("template_id"), s.get("quantity")) for s in data.get("sources", [])),
+        )
+
+    def to_item_data(self) -> dict:
+        """Словарь для Calculator.create_estimate / compose_templates"""
+        data = {
+            "work_id": self.work_id,
+            "quantity": self.quantity,
+            "additional_coefficients": dict(self.coefficients),
+            "uid": self.uid,
+            "formula": self.formula,
+            "sources": [{"template_id": template_id, "quantity": quantity} for template_id, quantity in self.sources],
+        }
+        if self.override_base_cost is not None:
+            data["override_base_cost"] = self.override_base_cost
+        return data
+
+    def evolve(self, **changes) -> "DraftItem":
+        """Позиция с изменёнными полями; без фактических изменений — та же позиция"""
+        if all(getattr(self, name) == value for name, value in changes.items()):
+            return self
+        return replace(self, **changes)
+
+
+@dataclass(frozen=True)
+class EstimateDraft:
+    """Черновик сметы: позиции в порядке сметы и номер ревизии"""
+    items: tuple = ()
+    revision: int = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def index(self, uid: str) -> Optional[int]:
+        for idx, item in enumerate(self.items):
+            if item.uid == uid:
+                return idx
+        return None
+
+    def with_items(self, items: Iterable) -> "EstimateDraft":
+        """Следующая ревизия с новым списком позиций"""
+        return EstimateDraft(tuple(items), self.revision + 1)
+
+    def append(self, *items: DraftItem) -> "EstimateDraft":
+        return self.with_items(self.items + items)
+
+    def update(self, uid: str, **changes) -> "EstimateDraft":
+        """Изменить поля позиции uid; без фактических изменений — тот же черновик"""
+        idx = self.index(uid)
+        if idx is None:
+            return self
+        item = self.items[idx].evolve(**changes)
+        if item is self.items[idx]:
+            return self
+        return self.with_items(self.items[:idx] + (item,) + self.items[idx + 1:])
+
+    def remove(self, uids) -> "EstimateDraft":
+        uids = set(uids)
+        items = tuple(item for item in self.items if item.uid not in uids)
+        return self if len(items) == len(self.items) else self.with_items(items)
+
+    def swap(self, i: int, j: int) -> "EstimateDraft":
+        items = list(self.items)
+        items[i], items[j] = items[j], items[i]
+        return self.with_items(items)
+
+    def to_items_data(self) -> list:
+        """Позиции в формате items_data для Calculator.create_estimate"""
+        return [item.to_item_data() for item in self.items]
+
+
+def _with_program(calc, items: tuple, max_depth) -> list:
+    """Программа ИГИ по Таблице 66 (площадь рекогносцировки × глубина) — перед отчётом"""
+    recon_area_ha = next((item.quantity for item in items if "recon" in item.work_id), 0)
+    program_info = calc.get_program_work(recon_area_ha, max_depth)
+
+    programs = [item for item in items if "program" in item.work_id]
+    result = [item for item in items if "program" not in item.work_id]
+    if program_info:
+        current = programs[0] if programs else None
+        program = DraftItem(
+            uid=PROGRAM_UID,
+            work_id=program_info["id"],
+            quantity=1,
+            formula=current.formula if current else "",
+            sources=tuple(source for item in programs for source in item.sources),
+        )
+        if program == current:
+            program = current
+        report_idx = next(
+            (idx for idx, item in enumerate(result) if calc.get_work_type(item.work_id).get("group") == "report"),
+            len(result),
+        )
+        result.insert(report_idx, program)
+    return result
+
+
+def _report_pricing(calc, items, complexity: str) -> tuple:
+    """Стоимость отчёта по Таблице 65 от суммы камеральных работ: (стоимость, диапазон, вид работ отчёта)"""
+    # Стоимость программы в базу не входит (Примечание 2 к Таблице 65)
+    cameral_base_sum = 0
+    has_report = False
+    for item in items:
+        work_info = calc.get_work_type(item.work_id)
+        group = work_info.get("group", "")
+        if work_info.get("category", "") == "office" and group not in ("report", "program"):
+            cameral_base_sum += float(calc.get_base_cost(item.work_id)) * item.quantity
+        if group == "report":
+            has_report = True
+    if not has_report:
+        return 0, "", None
+
+    cost, range_desc, upper_key = calc.calculate_report_cost(cameral_base_sum, complexity)
+    # Вид работ верхней границы интерполяции: его код и наименование идут в смету
+    cat_num = "1" if complexity == "I" else ("3" if complexity == "III" else "2")
+    report_wt = calc.get_work_type(f"report_cat{cat_num}_{upper_key}") or None
+    if not report_wt:
+        report_wt = next(
+            (wt for wt in calc.work_types.get("work_types", [])
+             if wt.get("group") == "report" and wt.get("base_cost") == int(cost)),
+            None,
+        )
+    return cost, range_desc, report_wt
+
+
+def evaluate_draft(calc, draft: EstimateDraft, complexity: str = "II") -> tuple:
+    """Пересчёт позиций черновика: (позиции с выставленными производными полями, строки таблицы)"""
+    report_cost, range_desc, report_wt = _report_pricing(calc, draft.items, complexity)
+    items, rows = [], []
+    for idx, item in enumerate(draft.items):
+        work_info = calc.get_work_type(item.work_id)
+        base_cost = calc.get_base_cost(item.work_id)
+        table_ref = work_info.get("table_ref", "")
+        quantity = item.quantity
+        work_id = item.work_id
+        override_base_cost = item.override_base_cost
+
+        if work_info.get("group") == "report" and report_cost > 0:
+            base_cost = report_cost
+            if report_wt:
+                work_id = report_wt["id"]
+                display_name = report_wt["name"]
+                table_ref = report_wt.get("table_ref", "") or table_ref
+            else:
+                display_name = (f"Составление технического отчета по результатам выполнения работ по ИГИ "
+                                f"(ИГУ {complexity} кат., {range_desc.replace(' (интерполяция)', '')})")
+            override_base_cost = float(report_cost)
+            quantity = 1  # Отчёт всегда 1
+            total_cost = report_cost
+            formula = f"{report_cost:,.0f} (Таблица 65, {complexity} кат., {range_desc})"
+        else:
+            if work_info.get("group") != "report":
+                override_base_cost = None
+            display_name = work_info.get("name", item.work_id)
+            # Рекогносцировка — двухкомпонентная формула (п.49, ф.16)
+            if calc.is_reconnaissance(item.work_id):
+                pz1p, pz2p = calc.get_reconnaissance_components(item.work_id)
+                total_cost = float(pz1p) + float(pz2p) * quantity
+                formula = f"ПЗ1п({float(pz1p):,.0f}) + ПЗ2п({float(pz2p):,.0f}) × {quantity:.1f}"
+            else:
+                total_cost = float(base_cost) * quantity
+                formula = f"{float(base_cost):,.0f} × {quantity:.1f}"
+
+        items.append(item.evolve(work_id=work_id, override_base_cost=override_base_cost, formula=formula))
+        rows.append({
+            "index": idx,
+            "uid": item.uid,
+            "work_id": work_id,
+            "name": display_name,
+            "unit": work_info.get("unit", "ед."),
+            "quantity": quantity,
+            "base_cost": float(base_cost),
+            "total_cost": total_cost,
+            "table_ref": table_ref,
+            "code": work_info.get("code", ""),
+            "category": work_info.get("category", "field"),
+            "formula_display": formula,
+        })
+    return items, rows
+
+
+def normalize_draft(calc, draft: EstimateDraft, complexity: str = "II", max_depth="10") -> EstimateDraft:
+    """Выставить производные поля (программа, отчёт, формулы).
+
+    Если черновик уже приведён к этим параметрам, возвращается он сам —
+    ревизия меняется только при фактическом изменении позиций.
+    """
+    if not draft.items:
+        return draft
+    program_draft = EstimateDraft(tuple(_with_program(calc, draft.items, max_depth)), draft.revision)
+    items, _ = evaluate_draft(calc, program_draft, complexity)
+    if tuple(items) == draft.items:
+        return draft
+    return draft.with_items(items)
@@ -0,0 +1,226 @@
+"""
+Экспорт сметы по запросу: форматы, отпечаток сметы, сборка документа
+"""
+
+import datetime
+import hashlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+
+from modules.export_cache import document_key, get_document_cache
+from modules.report import ReportModel, build_report
+
+
+DATA_PATH = Path(__file__).parent.parent / "data"
+MODULES_PATH = Path(__file__).parent
+
+# Модули, от которых зависит содержимое документа (их хэш — версия экспортёров)
+EXPORTER_SOURCES = (
+    "report.py", "justifications.py",
+    "export_excel.py", "export_excel_stream.py", "export_pdf.py", "export_word.py",
+)
+
+# С какого числа позиций Excel собирается потоковым экспортёром (XlsxWriter)
+STREAMING_EXCEL_ITEMS = 500
+
+# Функции экспорта: {имя функции: модуль}. Модуль (openpyxl, reportlab,
+# python-docx, XlsxWriter) импортируется при первой сборке формата, а не при
+# старте приложения — сессии без выгрузки эти библиотеки не загружают
+EXPORTERS = {
+    "export_to_excel": "modules.export_excel",
+    "export_to_excel_stream": "modules.export_excel_stream",
+    "export_to_pdf": "modules.export_pdf",
+    "export_to_word": "modules.export_word",
+}
+
+# Форматы экспорта: {ключ: (заголовок, имя функции экспорта из EXPORTERS, MIME-тип)}
+EXPORT_FORMATS = {
+    "xlsx": ("📗 Excel", "export_to_excel",
+             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "pdf": ("📕 PDF", "export_to_pdf", "application/pdf"),
+    "docx": ("📘 Word", "export_to_word",
+             "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+}
+
+
+@lru_cache(maxsize=None)
+def get_exporter(name: str):
+    """Функция экспорта по имени из EXPORTERS; модуль импортируется при первом обращении"""
+    return getattr(importlib.import_module(EXPORTERS[name]), name)
+
+
+@lru_cache(maxsize=1)
+def data_version() -> str:
+    """Версия справочников — хэш содержимого файлов data/*.json"""
+    digest = hashlib.sha1()
+    for path in sorted(DATA_PATH.glob("*.json")):
+        digest.update(path.name.encode("utf-8"))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+@lru_cache(maxsize=1)
+def exporter_version() -> str:
+    """Версия экспортёров — хэш исходного кода модулей из EXPORTER_SOURCES"""
+    digest = hashlib.sha1()
+    for name in EXPORTER_SOURCES:
+        digest.update(name.encode("utf-8"))
+        digest.update((MODULES_PATH / name).read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def estimate_fingerprint(items, project_info: dict, **params) -> str:
+    """Отпечаток сметы: позиции, параметры проекта, версия справочников и дата.
+
+    items: список позиций или ревизия черновика сметы (в пределах сессии
+    ревизия однозначно определяет позиции).
+    Дата входит в отпечаток, потому что печатается в документе и имени файла.
+    """
+    payload = json.dumps(
+        {
+            "items": items,
+            "project_info": project_info,
+            "params": params,
+            "data_version": data_version(),
+            "date": datetime.date.today().isoformat(),
+        },
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def export_filename(estimate, fmt: str) -> str:
+    """Имя файла для скачивания"""
+    return f"Смета_{estimate.project_name}_{estimate.date_created}.{fmt}"
+
+
+def build_export(estimate, fmt: str, report: ReportModel = None, use_cache: bool = True) -> bytes:
+    """Собрать документ сметы в заданном формате в памяти (без временных файлов)
+
+    report: готовая модель отчёта — при сборке нескольких форматов строится один раз
+    use_cache: брать готовый документ из дискового кэша и класть туда собранный
+    """
+    _, exporter_name, _ = EXPORT_FORMATS[fmt]
+    if fmt == "xlsx" and len(estimate.items) >= STREAMING_EXCEL_ITEMS:
+        exporter_name = "export_to_excel_stream"
+    if report is None:
+        report = build_report(estimate)
+
+    # Документ из кэша отдаётся без импорта библиотеки формата
+    cache = get_document_cache() if use_cache else None
+    if cache is not None:
+        key = document_key(estimate, report, fmt, exporter_name,
+                           {"exporter": exporter_version(), "data": data_version()})
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    buffer = io.BytesIO()
+    get_exporter(exporter_name)(estimate, buffer, report=report)
+    data = buffer.getvalue()
+    if cache is not None:
+        cache.put(key, data)
+    return data
+
+
+@dataclass
+class ExportBundle:
+    """Результат задания экспорта: документы по форматам и время их сборки"""
+    files: dict = field(default_factory=dict)    # {fmt: (имя файла, bytes)}
+    timings: dict = field(default_factory=dict)  # {fmt: секунды сборки}
+    errors: dict = field(default_factory=dict)   # {fmt: текст ошибки}
+    wall_time: float = 0.0                       # общее время задания, с
+
+    def to_zip(self) -> bytes:
+        """Упаковать собранные документы в ZIP-архив"""
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, data in self.files.values():
+                archive.writestr(name, data)
+        return buffer.getvalue()
+
+
+def _timed_export(estimate, fmt: str, report: ReportModel = None) -> tuple:
+    """Собрать один формат и замерить время (выполняется в процессе пула)"""
+    started = time.perf_counter()
+    data = build_export(estimate, fmt, report)
+    return data, time.perf_counter() - started
+
+
+def available_cpus() -> int:
+    """Число процессоров, доступных процессу приложения"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@lru_cache(maxsize=1)
+def _export_pool() -> ProcessPoolExecutor:
+    """Пул процессов для экспорта — один на процесс приложения.
+
+    Процессы запускаются через spawn (fork небезопасен в многопоточном
+    сервере Streamlit) и переиспользуются между заданиями, поэтому
+    шрифты и справочники в них загружаются один раз.
+    """
+    return ProcessPoolExecutor(
+        max_workers=len(EXPORT_FORMATS),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def run_export_job(estimate, formats: list = None, parallel: bool = True) -> ExportBundle:
+    """Собрать смету сразу в нескольких форматах.
+
+    Модель отчёта строится один раз, и форматы собираются по ней параллельно
+    в пуле процессов, поэтому время задания близко ко времени самого
+    медленного формата. На одном процессоре или если пул недоступен
+    форматы собираются по очереди в текущем процессе.
+    """
+    formats = list(formats or EXPORT_FORMATS)
+    bundle = ExportBundle()
+    started = time.perf_counter()
+    report = build_report(estimate)
+
+    results = {}
+    if parallel and len(formats) > 1 and available_cpus() > 1:
+        try:
+            pool = _export_pool()
+            futures = {fmt: pool.submit(_timed_export, estimate, fmt, report) for fmt in formats}
+            for fmt, future in futures.items():
+                try:
+                    results[fmt] = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    bundle.errors[fmt] = str(e)
+        except (BrokenProcessPool, OSError):
+            # Пул сломан или процессы не запускаются — пересоздадим при следующем задании
+            _export_pool.cache_clear()
+            bundle.errors.clear()
+            results.clear()
+
+    for fmt in formats:
+        if fmt in results or fmt in bundle.errors:
+            continue
+        try:
+            results[fmt] = _timed_export(estimate, fmt, report)
+        except Exception as e:
+            bundle.errors[fmt] = str(e)
+
+    for fmt in formats:
+        if fmt in results:
+            data, seconds = results[fmt]
+            bundle.files[fmt] = (export_filename(estimate, fmt), data)
+            bundle.timings[fmt] = seconds
+    bundle.wall_time = time.perf_counter() - started
+    return bundle
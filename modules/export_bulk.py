@@ -0,0 +1,177 @@
+"""
+Пакетный экспорт смет (тендерный комплект) в один ZIP-архив
+
+Сметы берутся из итератора по одной, собираются в пуле процессов с
+ограниченным числом задач в работе и дописываются в архив по мере
+готовности. В памяти одновременно находятся только документы задач,
+которые ещё не записаны, — архив целиком не собирается. Последним в архив
+кладётся сводная книга Excel: одна строка на смету.
+"""
+
+import io
+import multiprocessing
+import re
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import BinaryIO, Iterable, Union
+
+import xlsxwriter
+
+from modules.export import EXPORT_FORMATS, available_cpus, build_export, export_filename
+from modules.report import build_report
+
+
+SUMMARY_NAME = "Сводка.xlsx"
+
+# Колонки сводной книги: (заголовок, ключ строки сводки, ширина, денежная)
+SUMMARY_COLUMNS = [
+    ("№", "num", 5, False),
+    ("Проект", "project_name", 40, False),
+    ("Шифр", "project_code", 14, False),
+    ("Объект", "object_name", 40, False),
+    ("Позиций", "items", 9, False),
+    ("Базовые затраты, руб.", "base_total", 16, True),
+    ("ДЗ, руб.", "dz_sum", 14, True),
+    ("С индексом, руб.", "total_indexed", 16, True),
+    ("ВСЕГО, руб.", "final_total", 16, True),
+    ("Файлы", "files", 50, False),
+    ("Время, с", "seconds", 9, False),
+    ("Ошибка", "error", 40, False),
+]
+
+_UNSAFE_NAME = re.compile(r'[\\/:*?"<>|]+')
+
+
+def _render_estimate(num: int, estimate, formats: list) -> tuple:
+    """Собрать одну смету во всех форматах (выполняется в процессе пула).
+
+    Возвращает (строка сводки, [(имя файла, bytes)]); ошибка формата не
+    прерывает пакет, а попадает в сводку.
+    """
+    started = time.perf_counter()
+    summary = {
+        "num": num,
+        "project_name": estimate.project_name,
+        "project_code": estimate.project_code,
+        "object_name": estimate.object_name,
+        "items": len(estimate.items),
+    }
+    files, errors = [], []
+    try:
+        report = build_report(estimate)
+        summary.update(
+            base_total=report.base_total,
+            dz_sum=report.dz_sum,
+            total_indexed=report.total_indexed,
+            final_total=report.final_total,
+        )
+        folder = f"{num:03d}_{_UNSAFE_NAME.sub('_', estimate.project_name)}"
+        for fmt in formats:
+            try:
+                name = _UNSAFE_NAME.sub('_', export_filename(estimate, fmt))
+                files.append((f"{folder}/{name}", build_export(estimate, fmt, report)))
+            except Exception as e:
+                errors.append(f".{fmt}: {e}")
+    except Exception as e:
+        errors.append(str(e))
+    summary["files"] = ", ".join(Path(name).name for name, _ in files)
+    summary["error"] = "; ".join(errors)
+    summary["seconds"] = round(time.perf_counter() - started, 2)
+    return summary, files
+
+
+def _sequential(estimates: Iterable, formats: list):
+    for num, estimate in enumerate(estimates, 1):
+        yield _render_estimate(num, estimate, formats)
+
+
+def _parallel(estimates: Iterable, formats: list, max_workers: int, max_pending: int):
+    """Результаты в порядке готовности; в работе не больше max_pending смет"""
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = set()
+        for num, estimate in enumerate(estimates, 1):
+            pending.add(pool.submit(_render_estimate, num, estimate, formats))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def write_summary(rows: list) -> bytes:
+    """Сводная книга: одна строка на смету и итог по пакету"""
+    buffer = io.BytesIO()
+    wb = xlsxwriter.Workbook(buffer, {'in_memory': True})
+    ws = wb.add_worksheet("Сводка")
+    header = wb.add_format({'bold': True, 'border': 1, 'bg_color': '#D9D9D9', 'text_wrap': True,
+                            'align': 'center', 'valign': 'vcenter'})
+    cell = wb.add_format({'border': 1, 'valign': 'top', 'text_wrap': True})
+    money = wb.add_format({'border': 1, 'valign': 'top', 'num_format': '#,##0'})
+    total_label = wb.add_format({'bold': True, 'border': 1, 'bg_color': '#C8E6C9'})
+    total_money = wb.add_format({'bold': True, 'border': 1, 'bg_color': '#C8E6C9', 'num_format': '#,##0'})
+
+    for col, (title, _, width, _) in enumerate(SUMMARY_COLUMNS):
+        ws.set_column(col, col, width)
+        ws.write_string(0, col, title, header)
+    ws.freeze_panes(1, 0)
+
+    rows = sorted(rows, key=lambda summary: summary["num"])
+    for r, summary in enumerate(rows, 1):
+        for col, (_, key, _, is_money) in enumerate(SUMMARY_COLUMNS):
+            value = summary.get(key)
+            if value is None or value == "":
+                ws.write_blank(r, col, None, cell)
+            elif isinstance(value, (int, float)):
+                ws.write_number(r, col, value, money if is_money else cell)
+            else:
+                ws.write_string(r, col, str(value), cell)
+
+    total_row = len(rows) + 1
+    ws.write_blank(total_row, 0, None, total_label)
+    ws.write_string(total_row, 1, f"Итого по пакету ({len(rows)} смет):", total_label)
+    for col, (_, key, _, is_money) in enumerate(SUMMARY_COLUMNS):
+        if is_money:
+            ws.write_number(total_row, col, sum(summary.get(key) or 0 for summary in rows), total_money)
+
+    wb.close()
+    return buffer.getvalue()
+
+
+def export_bulk(estimates: Iterable, target: Union[str, Path, BinaryIO], formats: list = None,
+                max_workers: int = None, max_pending: int = None) -> list:
+    """Экспортировать пакет смет в один ZIP-архив.
+
+    estimates: итератор смет (читается лениво, по мере освобождения мест в пуле)
+    target: путь к архиву или записываемый двоичный поток (например, HTTP-ответ)
+    formats: список форматов из EXPORT_FORMATS; по умолчанию — все
+    max_workers: число процессов; по умолчанию — доступные процессоры (до 4)
+    max_pending: сколько смет одновременно в работе; по умолчанию — 2 × max_workers
+
+    Возвращает строки сводки в порядке смет.
+    """
+    formats = list(formats or EXPORT_FORMATS)
+    if max_workers is None:
+        max_workers = min(available_cpus(), 4)
+    if max_pending is None:
+        max_pending = 2 * max_workers
+
+    if max_workers > 1:
+        results = _parallel(estimates, formats, max_workers, max(max_pending, max_workers))
+    else:
+        results = _sequential(estimates, formats)
+
+    summary_rows = []
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as archive:
+        for summary, files in results:
+            for name, data in files:
+                archive.writestr(name, data)
+            summary_rows.append(summary)
+        archive.writestr(SUMMARY_NAME, write_summary(summary_rows))
+
+    return sorted(summary_rows, key=lambda summary: summary["num"])
@@ -0,0 +1,161 @@
+"""
+Дисковый кэш готовых документов экспорта
+
+Документ адресуется хэшем содержимого: канонической модели отчёта, шапки
+сметы, формата, версии экспортёров и версии справочников. Одинаковая смета,
+выгруженная разными пользователями или после перезагрузки страницы, читается
+из кэша одним чтением файла.
+
+Запись атомарная (временный файл в той же папке + os.replace), поэтому кэш
+безопасно делят несколько процессов сервера. При превышении предельного
+размера удаляются документы, которые дольше всех не читали (LRU по mtime).
+Кэш вспомогательный: любые ошибки диска означают промах, а не сбой экспорта.
+
+Папка создаётся с правами 0o700; чужая или доступная на запись другим
+пользователям папка не используется — подложенные туда документы
+отдавались бы как свои.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from dataclasses import fields, is_dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from config import EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_MB
+
+
+# Незавершённые временные файлы старше этого срока считаются брошенными
+STALE_TMP_SECONDS = 3600
+
+_TMP_PREFIX = ".tmp-"
+
+
+def document_key(estimate, report, fmt: str, exporter: str, versions: dict) -> str:
+    """Ключ документа: SHA-256 канонического описания сметы и версий"""
+    if is_dataclass(estimate):
+        header = {f.name: getattr(estimate, f.name) for f in fields(estimate)
+                  if f.name not in ("items", "additional_costs")}
+    else:
+        header = {k: v for k, v in vars(estimate).items() if k not in ("items", "additional_costs")}
+    payload = json.dumps(
+        {
+            "format": fmt,
+            "exporter": exporter,
+            "versions": versions,
+            "estimate": header,
+            "report": report.canonical(),
+        },
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DocumentCache:
+    """Кэш документов в папке: один файл на ключ"""
+
+    def __init__(self, root, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self._check_owner()
+
+    def _check_owner(self):
+        """PermissionError, если папка чужая или доступна на запись группе и другим"""
+        if not hasattr(os, "getuid"):
+            return  # Windows: права задаёт ACL профиля, st_mode их не отражает
+        stat = self.root.stat()
+        if stat.st_uid != os.getuid():
+            raise PermissionError(f"Папка кэша принадлежит другому пользователю: {self.root}")
+        if stat.st_mode & 0o022:
+            raise PermissionError(f"Папка кэша доступна на запись другим пользователям: {self.root}")
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Документ по ключу или None"""
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # отметка последнего чтения для LRU
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Сохранить документ атомарно и при необходимости освободить место"""
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=self.root, prefix=_TMP_PREFIX)
+            try:
+                with os.fdopen(fd, "wb") as tmp:
+                    tmp.write(data)
+                os.replace(tmp_name, self._path(key))
+            except BaseException:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
+                raise
+        except OSError:
+            return
+        self.evict()
+
+    def evict(self):
+        """Удалять давно не читанные документы, пока кэш больше max_bytes"""
+        entries = []
+        total = 0
+        now = time.time()
+        try:
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.name.startswith(_TMP_PREFIX):
+                        if now - stat.st_mtime > STALE_TMP_SECONDS:
+                            self._unlink(entry.path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except OSError:
+            return
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            self._unlink(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        """Удалить все документы"""
+        for path in self.root.iterdir():
+            self._unlink(path)
+
+    @staticmethod
+    def _unlink(path):
+        # Файл мог удалить соседний процесс — это не ошибка
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+@lru_cache(maxsize=1)
+def get_document_cache() -> Optional[DocumentCache]:
+    """Кэш документов процесса по настройкам config; None, если отключён или папка недоступна"""
+    if not EXPORT_CACHE_DIR or EXPORT_CACHE_MAX_MB <= 0:
+        return None
+    try:
+        return DocumentCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_MB * 1024 * 1024)
+    except OSError:
+        return None
@@ -0,0 +1,226 @@
+"""
+Табличная выгрузка смет для аналитики (CSV / JSON Lines / Parquet)
+
+Строки позиций и строки ДЗ одной или многих смет пишутся потоково: смета
+за сметой, без накопления в памяти. Денежные значения — целые копейки,
+количества и коэффициенты — точные десятичные строки, работы
+идентифицируются по work_id и коду. Parquet доступен при установленном
+pyarrow и пишется пакетами строк.
+"""
+
+import csv
+import json
+from decimal import Decimal, ROUND_HALF_UP
+from operator import itemgetter
+from pathlib import Path
+from typing import Iterable
+
+from modules.calculator import work_categories
+from modules.report import build_report
+
+
+# Колонки таблиц: (имя, тип) — тип "str" или "int" (для Parquet)
+ITEM_COLUMNS = [
+    ("estimate_id", "str"),
+    ("project_code", "str"),
+    ("project_name", "str"),
+    ("object_name", "str"),
+    ("date_created", "str"),
+    ("template_id", "str"),
+    ("line_no", "int"),            # № позиции в смете
+    ("section", "str"),            # раздел сметы (field / laboratory / office)
+    ("category", "str"),           # категория работы по справочнику
+    ("work_id", "str"),
+    ("code", "str"),
+    ("name", "str"),
+    ("unit", "str"),
+    ("quantity", "str"),
+    ("base_cost_kop", "int"),
+    ("pz1p_fixed_kop", "int"),
+    ("total_coefficient", "str"),
+    ("unit_cost_kop", "int"),
+    ("total_cost_kop", "int"),
+    ("table_ref", "str"),
+    ("price_index", "str"),
+    ("contract_coefficient", "str"),
+]
+
+DZ_COLUMNS = [
+    ("estimate_id", "str"),
+    ("project_code", "str"),
+    ("line_no", "int"),            # № ДЗ в смете
+    ("dz_type", "str"),
+    ("name", "str"),
+    ("basis", "str"),
+    ("percent", "str"),
+    ("value_kop", "int"),
+]
+
+DATASET_FORMATS = ("csv", "jsonl", "parquet")
+
+# Сколько строк Parquet держать в памяти до записи группы строк
+PARQUET_BATCH_ROWS = 50_000
+
+_KOPECK = Decimal("1")
+
+
+def kopecks(value) -> int:
+    """Сумма в рублях (Decimal, float, str) → целые копейки с округлением половины вверх"""
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int((value * 100).quantize(_KOPECK, rounding=ROUND_HALF_UP))
+
+
+def _decimal_text(value) -> str:
+    return str(value) if isinstance(value, Decimal) else str(Decimal(str(value)))
+
+
+def estimate_records(estimate, estimate_id: str) -> tuple:
+    """Строки позиций и строки ДЗ одной сметы: (list, list)"""
+    report = build_report(estimate)
+    categories = work_categories()
+    head = {
+        "estimate_id": estimate_id,
+        "project_code": estimate.project_code or "",
+    }
+    price_index = _decimal_text(estimate.price_index)
+    contract_coefficient = _decimal_text(estimate.contract_coefficient)
+
+    items = []
+    for section in report.sections:
+        for entry in section.items:
+            item = entry.item
+            items.append({
+                **head,
+                "project_name": estimate.project_name,
+                "object_name": estimate.object_name or "",
+                "date_created": estimate.date_created,
+                "template_id": getattr(estimate, "template_id", "") or "",
+                "line_no": entry.num,
+                "section": section.key,
+                "category": categories.get(item.work_id, ""),
+                "work_id": item.work_id,
+                "code": item.code,
+                "name": item.name,
+                "unit": item.unit,
+                "quantity": _decimal_text(item.quantity),
+                "base_cost_kop": kopecks(item.base_cost),
+                "pz1p_fixed_kop": kopecks(item.pz1p_fixed),
+                "total_coefficient": _decimal_text(item.total_coefficient),
+                "unit_cost_kop": kopecks(item.unit_cost),
+                "total_cost_kop": kopecks(item.total_cost),
+                "table_ref": item.table_ref or "",
+                "price_index": price_index,
+                "contract_coefficient": contract_coefficient,
+            })
+
+    dz = [
+        {
+            **head,
+            "line_no": row.num,
+            "dz_type": row.cost.get("type", ""),
+            "name": row.cost.get("name", ""),
+            "basis": row.cost.get("basis", ""),
+            "percent": _decimal_text(row.cost.get("percent", 0)),
+            "value_kop": kopecks(row.value),
+        }
+        for row in report.dz_rows
+    ]
+    return items, dz
+
+
+class _CsvSink:
+    def __init__(self, path: Path, columns: list):
+        names = [name for name, _ in columns]
+        self._file = open(path, "w", encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(names)
+        self._row = itemgetter(*names)
+
+    def write(self, records: list):
+        self._writer.writerows(map(self._row, records))
+
+    def close(self):
+        self._file.close()
+
+
+class _JsonlSink:
+    def __init__(self, path: Path, columns: list):
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, records: list):
+        self._file.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetSink:
+    def __init__(self, path: Path, columns: list):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Для выгрузки в Parquet установите pyarrow") from e
+        self._pa = pa
+        self._schema = pa.schema([(name, pa.int64() if kind == "int" else pa.string()) for name, kind in columns])
+        self._writer = pq.ParquetWriter(str(path), self._schema)
+        self._buffer = []
+
+    def write(self, records: list):
+        self._buffer.extend(records)
+        if len(self._buffer) >= PARQUET_BATCH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._writer.write_table(self._pa.Table.from_pylist(self._buffer, schema=self._schema))
+            self._buffer = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+_SINKS = {"csv": _CsvSink, "jsonl": _JsonlSink, "parquet": _ParquetSink}
+
+
+def export_dataset(estimates: Iterable, target_dir, formats: list = ("csv",)) -> dict:
+    """Выгрузить позиции и ДЗ смет в табличные файлы.
+
+    estimates: итератор смет или пар (estimate_id, смета); без идентификатора
+    сметы нумеруются по порядку
+    target_dir: папка для файлов items.<формат> и dz.<формат>
+    formats: любые из DATASET_FORMATS
+
+    Возвращает число записанных строк: {"estimates", "items", "dz"}.
+    """
+    unknown = set(formats) - set(DATASET_FORMATS)
+    if unknown:
+        raise ValueError(f"Неизвестные форматы: {', '.join(sorted(unknown))}")
+
+    target_dir = Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    sinks = []
+    try:
+        for fmt in formats:
+            sinks.append((_SINKS[fmt](target_dir / f"items.{fmt}", ITEM_COLUMNS),
+                          _SINKS[fmt](target_dir / f"dz.{fmt}", DZ_COLUMNS)))
+
+        counts = {"estimates": 0, "items": 0, "dz": 0}
+        for num, entry in enumerate(estimates, 1):
+            estimate_id, estimate = entry if isinstance(entry, tuple) else (str(num), entry)
+            items, dz = estimate_records(estimate, str(estimate_id))
+            for item_sink, dz_sink in sinks:
+                item_sink.write(items)
+                dz_sink.write(dz)
+            counts["estimates"] += 1
+            counts["items"] += len(items)
+            counts["dz"] += len(dz)
+    finally:
+        for pair in sinks:
+            for sink in pair:
+                sink.close()
+
+    return counts
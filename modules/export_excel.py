@@ -2,59 +2,200 @@
 Экспорт сметы в Excel
 """
 
-import json
+from copy import copy
+from functools import lru_cache
 from pathlib import Path
+from typing import BinaryIO, Union
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
 from openpyxl.utils import get_column_letter
 
-_JUSTIFICATIONS_PATH = Path(__file__).parent.parent / "data" / "normative_justifications.json"
+from modules.justifications import get_justification_index
+from modules.report import ReportModel, build_report
 
-def _load_justifications() -> dict:
-    """Загрузить обоснования объёмов из JSON."""
-    try:
-        with open(_JUSTIFICATIONS_PATH, encoding='utf-8') as f:
-            return json.load(f).get("template_justifications", {})
-    except Exception:
-        return {}
 
+MONEY_FORMAT = '#,##0'
 
-def export_to_excel(estimate, filename: str = None) -> Path:
-    """Экспортировать смету в Excel"""
+
+def coef_note(item) -> str:
+    """Пояснение к коэффициентам позиции"""
+    notes = []
+    k1 = float(item.k1) if hasattr(item, 'k1') else 1.0
+    k2 = float(item.k2) if hasattr(item, 'k2') else 1.0
+    k3 = float(item.k3) if hasattr(item, 'k3') else 1.0
+    kc = float(item.climate_coef) if hasattr(item, 'climate_coef') else 1.0
+    if k1 != 1.0: notes.append(f"К1={k1:.2f} (категория ИГУ)")
+    if k2 != 1.0: notes.append(f"К2={k2:.2f} (климат. зона)")
+    if k3 != 1.0: notes.append(f"К3={k3:.2f} (доп. коэф.)")
+    if kc != 1.0: notes.append(f"Кклим={kc:.2f}")
+    return "; ".join(notes) if notes else "—"
+
+
+@lru_cache(maxsize=1)
+def _style_specs() -> dict:
+    """Описания стилей книги: {имя: параметры NamedStyle} (объекты создаются один раз на процесс)"""
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+
+    def fill(color):
+        return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+    def spec(font=None, fill=None, alignment=None, number_format=None, bordered=True):
+        return {
+            "font": font, "fill": fill, "alignment": alignment,
+            "number_format": number_format, "border": border if bordered else None,
+        }
+
+    header_fill = fill("E0E0E0")
+    subtotal_fill = fill("FFF3E0")
+    total_fill = fill("C8E6C9")
+    total2_fill = fill("E2EFDA")
+    dz_fill = fill("FFF2CC")
+
+    bold = Font(bold=True)
+    right = Alignment(horizontal='right')
+    wrap_center = Alignment(wrap_text=True, vertical='center', horizontal='center')
+    wrap_left = Alignment(wrap_text=True, vertical='center', horizontal='left')
+    wrap_right = Alignment(wrap_text=True, vertical='center', horizontal='right')
+    right_center = Alignment(horizontal='right', vertical='center')
+
+    specs = {
+        # Лист «Смета ИГИ»
+        "title": spec(Font(bold=True, size=14), alignment=Alignment(horizontal='center'), bordered=False),
+        "center": spec(alignment=Alignment(horizontal='center'), bordered=False),
+        "label": spec(bold, bordered=False),
+        "header": spec(Font(bold=True, size=12), header_fill,
+                       Alignment(horizontal='center', vertical='center', wrap_text=True)),
+        "section": spec(bold, header_fill),
+        "cell": spec(),
+        "wrap": spec(alignment=Alignment(wrap_text=True)),
+        "cell_center": spec(alignment=Alignment(horizontal='center')),
+        "cell_right": spec(alignment=right),
+        "ref": spec(alignment=Alignment(wrap_text=True, vertical='center')),
+        "money": spec(number_format=MONEY_FORMAT),
+        "dz_title": spec(Font(bold=True, italic=True)),
+        "subtotal_label": spec(bold, subtotal_fill, right),
+        "subtotal_blank": spec(fill=subtotal_fill),
+        "subtotal_money": spec(bold, subtotal_fill, number_format=MONEY_FORMAT),
+        "total_label": spec(bold, total_fill, right),
+        "total_blank": spec(fill=total_fill),
+        "total_money": spec(bold, total_fill, number_format=MONEY_FORMAT),
+        "k_label": spec(bold, alignment=right),
+        "k_money": spec(bold, number_format=MONEY_FORMAT),
+        "final_label": spec(Font(bold=True, size=12), total_fill, right),
+        "final_money": spec(Font(bold=True, size=12), total_fill, number_format=MONEY_FORMAT),
+
+        # Лист «Обоснование»
+        "w2_title": spec(Font(bold=True, size=13), alignment=Alignment(horizontal='center', vertical='center'),
+                         bordered=False),
+        "w2_base": spec(Font(italic=True, size=9, color="444444"),
+                        alignment=Alignment(horizontal='left', vertical='center', wrap_text=True), bordered=False),
+        "w2_info": spec(Font(size=9, bold=True), alignment=Alignment(horizontal='left', vertical='center'),
+                        bordered=False),
+        "w2_header": spec(Font(bold=True, color="FFFFFF", size=10), fill("1F4E79"), wrap_center),
+        "w2_header_qty": spec(Font(bold=True, color="FFFFFF", size=10), fill("375623"), wrap_center),
+        "w2_section": spec(Font(bold=True, size=10), fill("D6E4F0"),
+                           Alignment(horizontal='center', vertical='center')),
+        "w2_subtotal_label": spec(Font(bold=True, size=10), subtotal_fill, right_center),
+        "w2_subtotal_money": spec(Font(bold=True, size=10), subtotal_fill, wrap_right, MONEY_FORMAT),
+        "w2_summary_label": spec(Font(bold=True, size=10), total2_fill, right_center),
+        "w2_summary_label_big": spec(Font(bold=True, size=12), total2_fill, right_center),
+        "w2_summary_blank": spec(fill=total2_fill),
+        "w2_summary_money_11": spec(Font(bold=True, size=11), total2_fill, wrap_right, MONEY_FORMAT),
+        "w2_summary_money_big": spec(Font(bold=True, size=12), total2_fill, wrap_right, MONEY_FORMAT),
+        "w2_dz_title": spec(Font(bold=True, size=11, color="FFFFFF"), fill("375623"),
+                            Alignment(horizontal='center', vertical='center')),
+        "w2_dz_header": spec(Font(bold=True, size=9, color="FFFFFF"), fill("548235"), wrap_center),
+        "w2_dz_cell": spec(Font(size=9), dz_fill, wrap_left),
+        "w2_dz_money": spec(Font(bold=True, size=10), dz_fill, wrap_right, MONEY_FORMAT),
+        "w2_footer": spec(Font(italic=True, size=9, color="666666"), bordered=False),
+    }
+
+    # Строки позиций листа «Обоснование»: чётные строки с заливкой F5F9FF
+    normal_font = Font(size=10)
+    small_font = Font(size=9)
+    item_columns = {
+        "num": (normal_font, wrap_center, None),
+        "name": (normal_font, wrap_left, None),
+        "unit": (normal_font, wrap_center, None),
+        "qty": (normal_font, wrap_right, None),
+        "ref": (Font(size=9, italic=True, color="1F4E79"), wrap_center, None),
+        "pz": (normal_font, wrap_right, None),
+        "coef": (small_font, wrap_left, None),
+        "formula": (small_font, wrap_right, None),
+        "cost": (Font(bold=True, size=10), wrap_right, MONEY_FORMAT),
+    }
+    for shade, shade_fill in (("", None), ("_shaded", fill("F5F9FF"))):
+        for column, (font, alignment, number_format) in item_columns.items():
+            specs[f"item_{column}{shade}"] = spec(font, shade_fill, alignment, number_format)
+
+    # Колонки обоснования объёма: есть обоснование / нет обоснования
+    for suffix, color, just_fill in (("ok", "1A5C2A", fill("EBF3E8")), ("missing", "AA0000", fill("FFF0F0"))):
+        specs[f"qty_ref_{suffix}"] = spec(Font(size=8, italic=True, color=color), just_fill, wrap_left)
+        specs[f"qty_note_{suffix}"] = spec(Font(size=9, color=color), just_fill, wrap_left)
+
+    return specs
+
+
+class StyleRegistry:
+    """Именованные стили книги: регистрируются один раз, ячейки ссылаются на них по имени.
+
+    Ячейке копируется готовый набор индексов стиля, поэтому при записи не
+    создаются объекты Font/Border/Fill, а при сохранении нечего дедуплицировать.
+    """
+
+    PREFIX = "smeta_"
+
+    def __init__(self, wb):
+        self._arrays = {}
+        for name, spec in _style_specs().items():
+            style = NamedStyle(name=self.PREFIX + name, **spec)
+            wb.add_named_style(style)
+            self._arrays[name] = style.as_tuple()
+
+    def apply(self, cell, name: str):
+        """Назначить ячейке стиль по имени"""
+        cell._style = copy(self._arrays[name])
+        return cell
+
+    def write(self, ws, row: int, column: int, value, name: str):
+        """Записать значение в ячейку и назначить ей стиль"""
+        return self.apply(ws.cell(row=row, column=column, value=value), name)
+
+    def style_row(self, ws, row: int, first: int, last: int, name: str):
+        """Назначить стиль ячейкам строки с first по last колонку (включительно)"""
+        for column in range(first, last + 1):
+            self.apply(ws.cell(row=row, column=column), name)
+
+
+def export_to_excel(estimate, filename: Union[str, Path, BinaryIO] = None,
+                    report: ReportModel = None) -> Union[Path, BinaryIO]:
+    """Экспортировать смету в Excel
+    
+    filename: путь к файлу или записываемый двоичный поток (например, BytesIO) —
+    в поток документ пишется без обращения к диску, и возвращается сам поток
+    report: готовая модель отчёта (build_report); если не передана, строится здесь
+    """
     
     if filename is None:
         filename = f"Смета_{estimate.project_name}_{estimate.date_created}.xlsx"
+    if report is None:
+        report = build_report(estimate)
     
     wb = Workbook()
     ws = wb.active
     ws.title = "Смета ИГИ"
     
-    # Стили
-    header_font = Font(bold=True, size=12)
-    title_font = Font(bold=True, size=14)
-    money_format = '#,##0'
-    
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    header_fill = PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
-    subtotal_fill = PatternFill(start_color="FFF3E0", end_color="FFF3E0", fill_type="solid")
-    total_fill = PatternFill(start_color="C8E6C9", end_color="C8E6C9", fill_type="solid")
+    # Стили (именованные, общие для обоих листов)
+    styles = StyleRegistry(wb)
     
     # Заголовок сметы
     ws.merge_cells('A1:G1')
     template_label = f" ({estimate.template_name})" if getattr(estimate, "template_name", "") else ""
-    ws['A1'] = f"ЛОКАЛЬНАЯ СМЕТА{template_label}"
-    ws['A1'].font = title_font
-    ws['A1'].alignment = Alignment(horizontal='center')
+    styles.write(ws, 1, 1, f"ЛОКАЛЬНАЯ СМЕТА{template_label}", "title")
     
     ws.merge_cells('A2:G2')
-    ws['A2'] = f"на инженерно-геологические изыскания"
-    ws['A2'].alignment = Alignment(horizontal='center')
+    styles.write(ws, 2, 1, "на инженерно-геологические изыскания", "center")
     
     # Информация о проекте
     row = 4
@@ -72,8 +213,7 @@ def export_to_excel(estimate, filename: str = None) -> Path:
     ]
     
     for label, value in project_info:
-        ws[f'A{row}'] = label
-        ws[f'A{row}'].font = Font(bold=True)
+        styles.write(ws, row, 1, label, "label")
         ws[f'B{row}'] = value
         row += 1
     
@@ -84,241 +224,93 @@ def export_to_excel(estimate, filename: str = None) -> Path:
     col_widths = [8, 50, 10, 10, 20, 25, 18]
     
     for col, (header, width) in enumerate(zip(headers, col_widths), 1):
-        cell = ws.cell(row=row, column=col, value=header)
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        cell.border = thin_border
-        cell.fill = header_fill
+        styles.write(ws, row, col, header, "header")
         ws.column_dimensions[get_column_letter(col)].width = width
     
     row += 1
-    start_data_row = row
     
-    # Группировка по категориям
-    categories = {
-        "field": {"name": "ПОЛЕВЫЕ РАБОТЫ", "items": []},
-        "laboratory": {"name": "ЛАБОРАТОРНЫЕ РАБОТЫ", "items": []},
-        "office": {"name": "КАМЕРАЛЬНЫЕ РАБОТЫ", "items": []}
-    }
-    
-    for item in estimate.items:
-        # Определяем категорию по коду
-        if item.code.startswith(("01", "02", "03", "04")):
-            categories["field"]["items"].append(item)
-        elif item.code.startswith(("05", "06", "07")):
-            categories["laboratory"]["items"].append(item)
-        else:
-            categories["office"]["items"].append(item)
-    
-    item_num = 1
-    
-    for cat_key, cat_data in categories.items():
-        if not cat_data["items"]:
-            continue
-        
+    for section in report.sections:
         # Заголовок раздела
         ws.merge_cells(f'A{row}:G{row}')
-        ws[f'A{row}'] = cat_data["name"]
-        ws[f'A{row}'].font = Font(bold=True)
-        ws[f'A{row}'].fill = header_fill
-        for col in range(1, 8):
-            ws.cell(row=row, column=col).border = thin_border
+        styles.write(ws, row, 1, section.name, "section")
+        styles.style_row(ws, row, 2, 7, "cell")
         row += 1
         
         # Позиции
-        for item in cat_data["items"]:
-            ws.cell(row=row, column=1, value=item_num).border = thin_border
-            # Наименование
-            ws.cell(row=row, column=2, value=item.name).border = thin_border
-            ws.cell(row=row, column=2).alignment = Alignment(wrap_text=True)
-            
-            # Ед. изм.
-            ws.cell(row=row, column=3, value=item.unit).border = thin_border
-            ws.cell(row=row, column=3).alignment = Alignment(horizontal='center')
-            
-            # Кол-во
-            qty_cell = ws.cell(row=row, column=4, value=float(item.quantity))
-            qty_cell.border = thin_border
-            qty_cell.alignment = Alignment(horizontal='right')
-            
-            # Обоснование (НЗ, таблица)
+        for entry in section.items:
+            item = entry.item
             ref_text = f"НЗ №281/пр, {item.table_ref}" if item.table_ref else "НЗ №281/пр"
-            ref_cell = ws.cell(row=row, column=5, value=ref_text)
-            ref_cell.border = thin_border
-            ref_cell.alignment = Alignment(wrap_text=True, vertical='center')
-
+            formula_text = item.formula if item.formula else f"{entry.base_cost:,.0f} x {entry.quantity:,.1f}"
             
-            # Расчёт (Формула)
-            formula_text = item.formula if item.formula else f"{float(item.base_cost):,.0f} x {float(item.quantity):,.1f}"
-            calc_cell = ws.cell(row=row, column=6, value=formula_text)
-            calc_cell.border = thin_border
-            calc_cell.alignment = Alignment(horizontal='right')
+            styles.write(ws, row, 1, entry.num, "cell")
+            styles.write(ws, row, 2, item.name, "wrap")                     # Наименование
+            styles.write(ws, row, 3, item.unit, "cell_center")              # Ед. изм.
+            styles.write(ws, row, 4, entry.quantity, "cell_right")          # Кол-во
+            styles.write(ws, row, 5, ref_text, "ref")                       # Обоснование (НЗ, таблица)
+            styles.write(ws, row, 6, formula_text, "cell_right")            # Расчёт (Формула)
+            styles.write(ws, row, 7, entry.total_cost, "money")             # Стоимость
             
-            # Стоимость
-            total_cell = ws.cell(row=row, column=7, value=float(item.total_cost))
-            total_cell.border = thin_border
-            total_cell.number_format = money_format
-            
-            item_num += 1
             row += 1
         
         # Подитог раздела
-        subtotal = sum(float(item.total_cost) for item in cat_data["items"])
         ws.merge_cells(f'A{row}:F{row}')
-        ws[f'A{row}'] = f"Итого по разделу «{cat_data['name'].lower()}»:"
-        ws[f'A{row}'].font = Font(bold=True)
-        ws[f'A{row}'].alignment = Alignment(horizontal='right')
-        for col in range(1, 7):
-            ws.cell(row=row, column=col).border = thin_border
-            ws.cell(row=row, column=col).fill = subtotal_fill
-        
-        subtotal_cell = ws.cell(row=row, column=7, value=subtotal)
-        subtotal_cell.font = Font(bold=True)
-        subtotal_cell.number_format = money_format
-        subtotal_cell.border = thin_border
-        subtotal_cell.fill = subtotal_fill
+        styles.write(ws, row, 1, f"Итого по разделу «{section.name.lower()}»:", "subtotal_label")
+        styles.style_row(ws, row, 2, 6, "subtotal_blank")
+        styles.write(ws, row, 7, section.subtotal, "subtotal_money")
         row += 1
     
     # -------------------------------------------------------------
     # ИТОГИ
     # -------------------------------------------------------------
     
-    # 1. Базовые затраты (Сумма всех работ)
-    base_total = sum(float(item.total_cost) for item in estimate.items)
+    def total_row(label, value, label_style, blank_style, money_style):
+        ws.merge_cells(f'A{row}:F{row}')
+        styles.write(ws, row, 1, label, label_style)
+        styles.style_row(ws, row, 2, 6, blank_style)
+        styles.write(ws, row, 7, value, money_style)
     
+    # 1. Базовые затраты (Сумма всех работ)
     row += 1
-    ws.merge_cells(f'A{row}:F{row}')
-    ws[f'A{row}'] = "ИТОГО базовые затраты (СП + СЛ + СК):"
-    ws[f'A{row}'].font = Font(bold=True)
-    ws[f'A{row}'].alignment = Alignment(horizontal='right')
-    for col in range(1, 7):
-        ws.cell(row=row, column=col).border = thin_border
-        ws.cell(row=row, column=col).fill = subtotal_fill
-        
-    total_cell = ws.cell(row=row, column=7, value=base_total)
-    total_cell.font = Font(bold=True)
-    total_cell.number_format = money_format
-    total_cell.border = thin_border
-    total_cell.fill = subtotal_fill
+    total_row("ИТОГО базовые затраты (СП + СЛ + СК):", report.base_total,
+              "subtotal_label", "subtotal_blank", "subtotal_money")
     
     # 2. Дополнительные затраты (построчно)
-    dz_sum = 0
-    if estimate.additional_costs:
+    if report.dz_rows:
         row += 1
         ws.merge_cells(f'A{row}:G{row}')
-        ws[f'A{row}'] = "Дополнительные затраты:"
-        ws[f'A{row}'].font = Font(bold=True, italic=True)
-        ws[f'A{row}'].border = thin_border
+        styles.write(ws, row, 1, "Дополнительные затраты:", "dz_title")
         row += 1
         
-        dz_item_num = 1
-        for cost in estimate.additional_costs:
-            # 1. № п/п (можно продолжить или свой)
-            ws.cell(row=row, column=1, value=f"ДЗ-{dz_item_num}").border = thin_border
-            
-            # 2. Наименование
-            ws.cell(row=row, column=2, value=cost.get('name', 'ДЗ')).border = thin_border
-            ws.cell(row=row, column=2).alignment = Alignment(wrap_text=True)
-            
-            # 3. Ед. изм.
-            ws.cell(row=row, column=3, value="-").border = thin_border
-            ws.cell(row=row, column=3).alignment = Alignment(horizontal='center')
-            
-            # 4. Кол-во
-            ws.cell(row=row, column=4, value="-").border = thin_border
-            ws.cell(row=row, column=4).alignment = Alignment(horizontal='center')
-            
-            # 5. Обоснование
-            ws.cell(row=row, column=5, value=cost.get('basis', '-')).border = thin_border
-            ws.cell(row=row, column=5).alignment = Alignment(wrap_text=True)
-            
-            # 6. Расчёт
-            ws.cell(row=row, column=6, value=cost.get('formula', '-')).border = thin_border
-            ws.cell(row=row, column=6).alignment = Alignment(horizontal='right')
-            
-            # 7. Стоимость
-            val = round(float(cost.get('value', 0)), 2)
-            dz_sum += val
-            val_cell = ws.cell(row=row, column=7, value=val)
-            val_cell.number_format = money_format
-            val_cell.border = thin_border
+        for dz in report.dz_rows:
+            styles.write(ws, row, 1, dz.label, "cell")
+            styles.write(ws, row, 2, dz.cost.get('name', 'ДЗ'), "wrap")
+            styles.write(ws, row, 3, "-", "cell_center")
+            styles.write(ws, row, 4, "-", "cell_center")
+            styles.write(ws, row, 5, dz.cost.get('basis', '-'), "wrap")
+            styles.write(ws, row, 6, dz.cost.get('formula', '-'), "cell_right")
+            styles.write(ws, row, 7, dz.value, "money")
             
             row += 1
-            dz_item_num += 1
             
     # 3. Итого с учетом ДЗ
-    total_with_dz = round(base_total + dz_sum, 2)
     row += 1
-    ws.merge_cells(f'A{row}:F{row}')
-    ws[f'A{row}'] = "ИТОГО с учетом дополнительных затрат:"
-    ws[f'A{row}'].font = Font(bold=True)
-    ws[f'A{row}'].alignment = Alignment(horizontal='right')
-    for col in range(1, 7):
-        ws.cell(row=row, column=col).border = thin_border
-        ws.cell(row=row, column=col).fill = subtotal_fill
-
-    total_dz_cell = ws.cell(row=row, column=7, value=total_with_dz)
-    total_dz_cell.font = Font(bold=True)
-    total_dz_cell.number_format = money_format
-    total_dz_cell.border = thin_border
-    total_dz_cell.fill = subtotal_fill
+    total_row("ИТОГО с учетом дополнительных затрат:", report.total_with_dz,
+              "subtotal_label", "subtotal_blank", "subtotal_money")
     
     # 4. С индексом пересчета
-    idx = float(estimate.price_index)
-    total_indexed = round(total_with_dz * idx, 2)
-    
     row += 1
-    ws.merge_cells(f'A{row}:F{row}')
-    ws[f'A{row}'] = f"ИТОГО с индексом пересчёта ({idx:.2f}):"
-    ws[f'A{row}'].font = Font(bold=True)
-    ws[f'A{row}'].alignment = Alignment(horizontal='right')
-    for col in range(1, 7):
-        ws.cell(row=row, column=col).border = thin_border
-        ws.cell(row=row, column=col).fill = total_fill
-    
-    total_indexed_cell = ws.cell(row=row, column=7, value=total_indexed)
-    total_indexed_cell.font = Font(bold=True)
-    total_indexed_cell.number_format = money_format
-    total_indexed_cell.border = thin_border
-    total_indexed_cell.fill = total_fill
-
-    # 5. Коэффициент договорной цены
-    k_contract = float(estimate.contract_coefficient)
-    if k_contract != 1.0:
+    total_row(f"ИТОГО с индексом пересчёта ({report.price_index:.2f}):", report.total_indexed,
+              "total_label", "total_blank", "total_money")
+
+    # 5. Коэффициент договорной цены (применяется к итогу с индексом)
+    if report.has_contract_coefficient:
         row += 1
-        ws.merge_cells(f'A{row}:F{row}')
-        ws[f'A{row}'] = f"Коэффициент договорной цены ({k_contract:.3f}):"
-        ws[f'A{row}'].font = Font(bold=True)
-        ws[f'A{row}'].alignment = Alignment(horizontal='right')
-        for col in range(1, 7):
-            ws.cell(row=row, column=col).border = thin_border
-        
-        # Здесь выводим просто сумму
-        # Но если по образцу, то это применяется к итогу
-        final_total = round(total_indexed * k_contract, 2)
-        
-        k_cell = ws.cell(row=row, column=7, value=final_total)
-        k_cell.font = Font(bold=True)
-        k_cell.number_format = money_format
-        k_cell.border = thin_border
-    else:
-        final_total = total_indexed
+        total_row(f"Коэффициент договорной цены ({report.contract_coefficient:.3f}):", report.final_total,
+                  "k_label", "cell", "k_money")
 
     # ВСЕГО ПО СМЕТЕ
     row += 1
-    ws.merge_cells(f'A{row}:F{row}')
-    ws[f'A{row}'] = "ВСЕГО по смете:"
-    ws[f'A{row}'].font = Font(bold=True, size=12)
-    ws[f'A{row}'].alignment = Alignment(horizontal='right')
-    for col in range(1, 7):
-        ws.cell(row=row, column=col).border = thin_border
-        ws.cell(row=row, column=col).fill = total_fill
-    
-    final_cell = ws.cell(row=row, column=7, value=final_total)
-    final_cell.font = Font(bold=True, size=12)
-    final_cell.number_format = money_format
-    final_cell.border = thin_border
-    final_cell.fill = total_fill
+    total_row("ВСЕГО по смете:", report.final_total, "final_label", "total_blank", "final_money")
     
     # Подпись
     row += 3
@@ -331,31 +323,9 @@ def export_to_excel(estimate, filename: str = None) -> Path:
     # =========================================================
     ws2 = wb.create_sheet("Обоснование")
 
-    # Цвета
-    hdr2_fill  = PatternFill(start_color="1F4E79", end_color="1F4E79", fill_type="solid")
-    sec_fill   = PatternFill(start_color="D6E4F0", end_color="D6E4F0", fill_type="solid")
-    dz_fill    = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
-    even_fill  = PatternFill(start_color="F5F9FF", end_color="F5F9FF", fill_type="solid")
-    total2_fill= PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
-
-    hdr2_font  = Font(bold=True, color="FFFFFF", size=10)
-    sec_font   = Font(bold=True, size=10)
-    normal_font= Font(size=10)
-    ref_font   = Font(size=9, italic=True, color="1F4E79")
-
-    wrap_center = Alignment(wrap_text=True, vertical='center', horizontal='center')
-    wrap_left   = Alignment(wrap_text=True, vertical='center', horizontal='left')
-    wrap_right  = Alignment(wrap_text=True, vertical='center', horizontal='right')
-
-    thin2 = Border(
-        left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin')
-    )
-
-    # Загружаем обоснования объёмов
-    all_justifications = _load_justifications()
+    # Обоснования объёмов (индекс шаблон → работа строится один раз на процесс)
+    justification_index = get_justification_index()
     template_id = getattr(estimate, 'template_id', None)
-    qty_justifications = all_justifications.get(template_id, {})
 
     # Ширина колонок вкладки 2 (11 колонок)
     col2_widths = {
@@ -374,33 +344,23 @@ def export_to_excel(estimate, filename: str = None) -> Path:
     for col_letter, width in col2_widths.items():
         ws2.column_dimensions[col_letter].width = width
 
-    # Заливка для колонок обоснования
-    qty_fill   = PatternFill(start_color="EBF3E8", end_color="EBF3E8", fill_type="solid")
-    qty_miss   = PatternFill(start_color="FFF0F0", end_color="FFF0F0", fill_type="solid")
-
     # ----- Заголовок листа -----
     ws2.merge_cells('A1:K1')
-    ws2['A1'] = "ПОЯСНИТЕЛЬНАЯ ЗАПИСКА К СМЕТЕ (Обоснование стоимости и объёмов работ)"
-    ws2['A1'].font = Font(bold=True, size=13)
-    ws2['A1'].alignment = Alignment(horizontal='center', vertical='center')
+    styles.write(ws2, 1, 1, "ПОЯСНИТЕЛЬНАЯ ЗАПИСКА К СМЕТЕ (Обоснование стоимости и объёмов работ)", "w2_title")
     ws2.row_dimensions[1].height = 22
 
     ws2.merge_cells('A2:K2')
-    ws2['A2'] = "Нормативная база: НЗ №281/пр (Приказ Минстроя РФ от 12.05.2025 № 281/пр) | СП 446.1325800.2019 | СП 341.1325800.2017 | СП 47.13330.2016 | ГОСТ 20522-2012"
-    ws2['A2'].font = Font(italic=True, size=9, color="444444")
-    ws2['A2'].alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
+    styles.write(ws2, 2, 1, "Нормативная база: НЗ №281/пр (Приказ Минстроя РФ от 12.05.2025 № 281/пр) | СП 446.1325800.2019 | СП 341.1325800.2017 | СП 47.13330.2016 | ГОСТ 20522-2012", "w2_base")
     ws2.row_dimensions[2].height = 24
 
     ws2.merge_cells('A3:K3')
-    ws2['A3'] = (
+    styles.write(ws2, 3, 1, (
         f"Проект: {estimate.project_name}   |   "
         f"Объект: {estimate.object_name or '—'}   |   "
         f"Регион: {getattr(estimate, 'work_region', '—') or '—'}   |   "
         f"Шаблон: {template_id or '—'}   |   "
         f"Дата: {estimate.date_created}"
-    )
-    ws2['A3'].font = Font(size=9, bold=True)
-    ws2['A3'].alignment = Alignment(horizontal='left', vertical='center')
+    ), "w2_info")
     ws2.row_dimensions[3].height = 16
 
     r2 = 5  # начальная строка данных
@@ -414,150 +374,72 @@ def export_to_excel(estimate, filename: str = None) -> Path:
         "Обоснование объёма работ"
     ]
     for ci, h in enumerate(headers2, 1):
-        c = ws2.cell(row=r2, column=ci, value=h)
-        c.font = hdr2_font
-        c.fill = hdr2_fill if ci <= 9 else PatternFill(start_color="375623", end_color="375623", fill_type="solid")
-        c.alignment = wrap_center
-        c.border = thin2
+        styles.write(ws2, r2, ci, h, "w2_header" if ci <= 9 else "w2_header_qty")
     ws2.row_dimensions[r2].height = 32
     r2 += 1
 
-    def w2_border_row(row_idx, ncols=11):
-        for ci in range(1, ncols + 1):
-            ws2.cell(row=row_idx, column=ci).border = thin2
-
     def w2_section(row_idx, title):
         ws2.merge_cells(f'A{row_idx}:K{row_idx}')
-        c = ws2.cell(row=row_idx, column=1, value=title)
-        c.font = sec_font
-        c.fill = sec_fill
-        c.alignment = Alignment(horizontal='center', vertical='center')
-        w2_border_row(row_idx)
+        styles.write(ws2, row_idx, 1, title, "w2_section")
+        styles.style_row(ws2, row_idx, 2, 11, "cell")
         ws2.row_dimensions[row_idx].height = 18
 
-    # ----- Пояснение для каждого коэффициента -----
-    def coef_note(item):
-        notes = []
-        k1 = float(item.k1) if hasattr(item, 'k1') else 1.0
-        k2 = float(item.k2) if hasattr(item, 'k2') else 1.0
-        k3 = float(item.k3) if hasattr(item, 'k3') else 1.0
-        kc = float(item.climate_coef) if hasattr(item, 'climate_coef') else 1.0
-        if k1 != 1.0: notes.append(f"К1={k1:.2f} (категория ИГУ)")
-        if k2 != 1.0: notes.append(f"К2={k2:.2f} (климат. зона)")
-        if k3 != 1.0: notes.append(f"К3={k3:.2f} (доп. коэф.)")
-        if kc != 1.0: notes.append(f"Кклим={kc:.2f}")
-        return "; ".join(notes) if notes else "—"
-
-    # ----- Группировка -----
-    cats2 = {
-        "field":      {"name": "ПОЛЕВЫЕ РАБОТЫ",      "items": []},
-        "laboratory": {"name": "ЛАБОРАТОРНЫЕ РАБОТЫ", "items": []},
-        "office":     {"name": "КАМЕРАЛЬНЫЕ РАБОТЫ",  "items": []},
-    }
-    for item in estimate.items:
-        if item.code.startswith(("01","02","03","04")):
-            cats2["field"]["items"].append(item)
-        elif item.code.startswith(("05","06","07")):
-            cats2["laboratory"]["items"].append(item)
-        else:
-            cats2["office"]["items"].append(item)
-
-    item_num2 = 1
     row_shade = False
 
-    for cat_key, cat_data in cats2.items():
-        if not cat_data["items"]:
-            continue
-
-        w2_section(r2, f"Раздел: {cat_data['name']}")
+    for section in report.sections:
+        w2_section(r2, f"Раздел: {section.name}")
         r2 += 1
 
-        for item in cat_data["items"]:
+        for entry in section.items:
+            item = entry.item
             ws2.row_dimensions[r2].height = 52
-            fill_r = even_fill if row_shade else PatternFill()
+            shade = "_shaded" if row_shade else ""
             row_shade = not row_shade
 
-            # № (A)
-            c = ws2.cell(row=r2, column=1, value=item_num2)
-            c.font = normal_font; c.alignment = wrap_center; c.border = thin2; c.fill = fill_r
-
-            # Наименование (B)
-            c = ws2.cell(row=r2, column=2, value=item.name)
-            c.font = normal_font; c.alignment = wrap_left; c.border = thin2; c.fill = fill_r
-
-            # Ед. (C)
-            c = ws2.cell(row=r2, column=3, value=item.unit)
-            c.font = normal_font; c.alignment = wrap_center; c.border = thin2; c.fill = fill_r
-
-            # Кол-во (D)
-            c = ws2.cell(row=r2, column=4, value=float(item.quantity))
-            c.font = normal_font; c.alignment = wrap_right; c.border = thin2; c.fill = fill_r
-
             # Нормативная база (E)
             ref_text = f"НЗ №281/пр\n{item.table_ref}" if item.table_ref else "НЗ №281/пр"
-            c = ws2.cell(row=r2, column=5, value=ref_text)
-            c.font = ref_font; c.alignment = wrap_center; c.border = thin2; c.fill = fill_r
 
             # ПЗ базовая цена (F) — для рекогносцировки разбиваем
-            pz_fixed = float(item.pz1p_fixed) if hasattr(item, 'pz1p_fixed') else 0
+            pz_fixed = entry.pz1p_fixed
             if pz_fixed > 0:
-                pz_text = f"ПЗ1п: {pz_fixed:,.0f}\nПЗ2п: {float(item.base_cost):,.0f}"
+                pz_text = f"ПЗ1п: {pz_fixed:,.0f}\nПЗ2п: {entry.base_cost:,.0f}"
             else:
-                pz_text = f"{float(item.base_cost):,.0f}"
-            c = ws2.cell(row=r2, column=6, value=pz_text)
-            c.font = normal_font; c.alignment = wrap_right; c.border = thin2; c.fill = fill_r
-
-            # Коэффициенты / пояснение (G)
-            cn = coef_note(item)
-            c = ws2.cell(row=r2, column=7, value=cn)
-            c.font = Font(size=9); c.alignment = wrap_left; c.border = thin2; c.fill = fill_r
+                pz_text = f"{entry.base_cost:,.0f}"
 
             # Формула (H)
             formula_txt = item.formula if item.formula else (
-                f"ПЗ1п({pz_fixed:,.0f}) + ПЗ2п({float(item.base_cost):,.0f}) × {float(item.quantity):.0f}"
+                f"ПЗ1п({pz_fixed:,.0f}) + ПЗ2п({entry.base_cost:,.0f}) × {entry.quantity:.0f}"
                 if pz_fixed > 0
-                else f"{float(item.base_cost):,.0f} × {float(item.quantity):.1f}"
+                else f"{entry.base_cost:,.0f} × {entry.quantity:.1f}"
             )
-            c = ws2.cell(row=r2, column=8, value=formula_txt)
-            c.font = Font(size=9); c.alignment = wrap_right; c.border = thin2; c.fill = fill_r
 
-            # Стоимость (I)
-            c = ws2.cell(row=r2, column=9, value=float(item.total_cost))
-            c.font = Font(bold=True, size=10)
-            c.number_format = money_format
-            c.alignment = wrap_right; c.border = thin2; c.fill = fill_r
+            styles.write(ws2, r2, 1, entry.num, "item_num" + shade)
+            styles.write(ws2, r2, 2, item.name, "item_name" + shade)
+            styles.write(ws2, r2, 3, item.unit, "item_unit" + shade)
+            styles.write(ws2, r2, 4, entry.quantity, "item_qty" + shade)
+            styles.write(ws2, r2, 5, ref_text, "item_ref" + shade)
+            styles.write(ws2, r2, 6, pz_text, "item_pz" + shade)
+            styles.write(ws2, r2, 7, coef_note(item), "item_coef" + shade)
+            styles.write(ws2, r2, 8, formula_txt, "item_formula" + shade)
+            styles.write(ws2, r2, 9, entry.total_cost, "item_cost" + shade)
 
             # Нормативное основание объёма (J) и Обоснование (K)
-            work_id = getattr(item, 'work_id', item.code)
-            jdata = qty_justifications.get(work_id, {})
+            jdata = justification_index.for_item(item, template_id)
             qty_ref  = jdata.get('qty_basis', '')
             qty_note = jdata.get('qty_note', '')
-            has_just = bool(qty_ref or qty_note)
-            j_fill = qty_fill if has_just else qty_miss
-
-            cj = ws2.cell(row=r2, column=10, value=qty_ref or '—')
-            cj.font = Font(size=8, italic=True, color="1A5C2A" if has_just else "AA0000")
-            cj.alignment = wrap_left; cj.border = thin2; cj.fill = j_fill
+            just = "ok" if (qty_ref or qty_note) else "missing"
 
-            ck = ws2.cell(row=r2, column=11, value=qty_note or ('Нет данных' if not template_id else 'Нет обоснования для данного шаблона'))
-            ck.font = Font(size=9, color="1A5C2A" if has_just else "AA0000")
-            ck.alignment = wrap_left; ck.border = thin2; ck.fill = j_fill
+            styles.write(ws2, r2, 10, qty_ref or '—', "qty_ref_" + just)
+            styles.write(ws2, r2, 11, qty_note or ('Нет данных' if not template_id else 'Нет обоснования для данного шаблона'),
+                         "qty_note_" + just)
 
-            item_num2 += 1
             r2 += 1
 
         # Подитог раздела
-        subtotal2 = sum(float(i.total_cost) for i in cat_data["items"])
         ws2.merge_cells(f'A{r2}:H{r2}')
-        c = ws2.cell(row=r2, column=1, value=f"Итого по разделу «{cat_data['name'].lower()}»:")
-        c.font = Font(bold=True, size=10); c.fill = subtotal_fill
-        c.alignment = Alignment(horizontal='right', vertical='center')
-        w2_border_row(r2)
-        for ci2 in range(1, 12):
-            ws2.cell(row=r2, column=ci2).fill = subtotal_fill
-        c9 = ws2.cell(row=r2, column=9, value=subtotal2)
-        c9.font = Font(bold=True, size=10); c9.number_format = money_format
-        c9.alignment = wrap_right; c9.fill = subtotal_fill; c9.border = thin2
+        styles.write(ws2, r2, 1, f"Итого по разделу «{section.name.lower()}»:", "w2_subtotal_label")
+        styles.style_row(ws2, r2, 2, 11, "subtotal_blank")
+        styles.write(ws2, r2, 9, section.subtotal, "w2_subtotal_money")
         ws2.row_dimensions[r2].height = 18
         r2 += 1
 
@@ -566,14 +448,10 @@ def export_to_excel(estimate, filename: str = None) -> Path:
     # =========================================================
     # ДЗ (Дополнительные затраты) — расширенное обоснование
     # =========================================================
-    if estimate.additional_costs:
+    if report.dz_rows:
         ws2.merge_cells(f'A{r2}:K{r2}')
-        c = ws2.cell(row=r2, column=1,
-                     value="ДОПОЛНИТЕЛЬНЫЕ ЗАТРАТЫ (ДЗ) — обоснование")
-        c.font = Font(bold=True, size=11, color="FFFFFF")
-        c.fill = PatternFill(start_color="375623", end_color="375623", fill_type="solid")
-        c.alignment = Alignment(horizontal='center', vertical='center')
-        w2_border_row(r2)
+        styles.write(ws2, r2, 1, "ДОПОЛНИТЕЛЬНЫЕ ЗАТРАТЫ (ДЗ) — обоснование", "w2_dz_title")
+        styles.style_row(ws2, r2, 2, 11, "cell")
         ws2.row_dimensions[r2].height = 22
         r2 += 1
 
@@ -581,113 +459,71 @@ def export_to_excel(estimate, filename: str = None) -> Path:
         dz_headers = ["ДЗ", "Наименование", "Норм. база", "Ссылка на пункт", "База для %",
                       "% (ПДЗ)", "Формула расчёта", "Сумма, руб.", "Комментарий"]
         for ci, h in enumerate(dz_headers, 1):
-            c = ws2.cell(row=r2, column=ci, value=h)
-            c.font = Font(bold=True, size=9, color="FFFFFF")
-            c.fill = PatternFill(start_color="548235", end_color="548235", fill_type="solid")
-            c.alignment = wrap_center; c.border = thin2
+            styles.write(ws2, r2, ci, h, "w2_dz_header")
         ws2.row_dimensions[r2].height = 28
         r2 += 1
 
-        # Описания ДЗ из НЗ
-        dz_comments = {
-            "перерывы":  "п.26-27 НЗ: при работе на объектах с режимным доступом (жел. дороги, автодороги, аэродромы, электростанции и пр.) — 25% от СПпз",
-            "проезд":    "п.28-36 НЗ: расходы на проезд работников до объекта и обратно. Процент зависит от расстояния (км) и стоимости полевых работ. Таблицы 4-7 НЗ.",
-            "организаци": "п.37-39 НЗ, ф.(9): расходы на организацию и ликвидацию полевых работ (мобилизация, аренда, логистика оборудования). Таблица 8 НЗ.",
-            "районные":  "п.40 НЗ, ф.(10): доплаты работникам за работу в районах с особыми климатическими условиями (районный коэффициент > 1.0). Приложение к НЗ.",
-            "неблагопр": "п.21 НЗ, ф.(4): надбавка за производство работ в неблагоприятный климатический период (зима, дожди). Таблица 3 НЗ.",
-        }
-
-        for dz_num, cost in enumerate(estimate.additional_costs, 1):
+        for dz in report.dz_rows:
+            cost = dz.cost
             ws2.row_dimensions[r2].height = 52
-            name_lc = cost.get('name', '').lower()
-            comment = next((v for k, v in dz_comments.items() if k in name_lc), "—")
+            comment = justification_index.dz_comment(cost)
 
             vals = [
-                f"ДЗ-{dz_num}",
+                dz.label,
                 cost.get('name', '—'),
                 cost.get('basis', '—'),
                 cost.get('basis', '—').split(',')[0] if ',' in cost.get('basis', '') else '—',
                 "СПпз (стоимость полевых работ)",
                 f"{cost.get('percent', 0):.1f}%",
                 cost.get('formula', '—'),
-                round(float(cost.get('value', 0)), 2),
+                dz.value,
                 comment,
             ]
             for ci, v in enumerate(vals, 1):
-                c = ws2.cell(row=r2, column=ci, value=v)
-                c.fill = dz_fill
-                c.border = thin2
-                c.alignment = wrap_left
-                c.font = Font(size=9)
-                if ci == 8:  # сумма
-                    c.number_format = money_format
-                    c.font = Font(bold=True, size=10)
-                    c.alignment = wrap_right
+                styles.write(ws2, r2, ci, v, "w2_dz_money" if ci == 8 else "w2_dz_cell")
             r2 += 1
 
         # Итого ДЗ
-        dz_total = sum(round(float(c.get('value', 0)), 2) for c in estimate.additional_costs)
         ws2.merge_cells(f'A{r2}:G{r2}')
-        c = ws2.cell(row=r2, column=1, value="Итого дополнительных затрат:")
-        c.font = Font(bold=True, size=10); c.fill = total2_fill
-        c.alignment = Alignment(horizontal='right', vertical='center')
-        w2_border_row(r2)
-        for ci2 in range(1, 12):
-            ws2.cell(row=r2, column=ci2).fill = total2_fill
-        c8 = ws2.cell(row=r2, column=8, value=dz_total)
-        c8.font = Font(bold=True, size=11); c8.number_format = money_format
-        c8.alignment = wrap_right; c8.border = thin2; c8.fill = total2_fill
+        styles.write(ws2, r2, 1, "Итого дополнительных затрат:", "w2_summary_label")
+        styles.style_row(ws2, r2, 2, 11, "w2_summary_blank")
+        styles.write(ws2, r2, 8, report.dz_sum, "w2_summary_money_11")
         ws2.row_dimensions[r2].height = 18
         r2 += 2
 
     # =========================================================
     # Итоговый блок
     # =========================================================
-    base_total2  = sum(float(i.total_cost) for i in estimate.items)
-    dz_sum2      = sum(round(float(c.get('value', 0)), 2) for c in (estimate.additional_costs or []))
-    total_dz2    = round(base_total2 + dz_sum2, 2)
-    idx2         = float(estimate.price_index)
-    total_idx2   = round(total_dz2 * idx2, 2)
-    k_c2         = float(estimate.contract_coefficient)
-    final2       = round(total_idx2 * k_c2, 2)
-
     summary_rows = [
-        ("ИТОГО базовые затраты (СП + СЛ + СК, в ценах на 01.01.2024):", base_total2),
-        (f"Сумма дополнительных затрат:", dz_sum2),
-        (f"ИТОГО с ДЗ (в ценах на 01.01.2024):", total_dz2),
-        (f"× Индекс пересчёта ({idx2:.2f}) → приведение к текущим ценам:", total_idx2),
+        ("ИТОГО базовые затраты (СП + СЛ + СК, в ценах на 01.01.2024):", report.base_total),
+        (f"Сумма дополнительных затрат:", report.dz_sum),
+        (f"ИТОГО с ДЗ (в ценах на 01.01.2024):", report.total_with_dz),
+        (f"× Индекс пересчёта ({report.price_index:.2f}) → приведение к текущим ценам:", report.total_indexed),
     ]
-    if k_c2 != 1.0:
-        summary_rows.append((f"× Коэффициент договорной цены ({k_c2:.3f}):", final2))
-    summary_rows.append(("ВСЕГО ПО СМЕТЕ (итоговая договорная стоимость):", final2))
+    if report.has_contract_coefficient:
+        summary_rows.append((f"× Коэффициент договорной цены ({report.contract_coefficient:.3f}):", report.final_total))
+    summary_rows.append(("ВСЕГО ПО СМЕТЕ (итоговая договорная стоимость):", report.final_total))
 
     for label, val in summary_rows:
         ws2.merge_cells(f'A{r2}:H{r2}')
-        c = ws2.cell(row=r2, column=1, value=label)
         is_total = "ВСЕГО" in label or "ИТОГО с ДЗ" in label
-        c.font = Font(bold=True, size=10 if not is_total else 12)
-        c.fill = total2_fill if is_total else subtotal_fill
-        c.alignment = Alignment(horizontal='right', vertical='center')
-        w2_border_row(r2)
-        for ci2 in range(1, 12):
-            ws2.cell(row=r2, column=ci2).fill = (total2_fill if is_total else subtotal_fill)
-        cv = ws2.cell(row=r2, column=9, value=val)
-        cv.font = Font(bold=True, size=10 if not is_total else 12)
-        cv.number_format = money_format
-        cv.alignment = wrap_right
-        cv.border = thin2
-        cv.fill = total2_fill if is_total else subtotal_fill
+        if is_total:
+            styles.write(ws2, r2, 1, label, "w2_summary_label_big")
+            styles.style_row(ws2, r2, 2, 11, "w2_summary_blank")
+            styles.write(ws2, r2, 9, val, "w2_summary_money_big")
+        else:
+            styles.write(ws2, r2, 1, label, "w2_subtotal_label")
+            styles.style_row(ws2, r2, 2, 11, "subtotal_blank")
+            styles.write(ws2, r2, 9, val, "w2_subtotal_money")
         ws2.row_dimensions[r2].height = 20
         r2 += 1
 
     r2 += 2
     ws2.merge_cells(f'A{r2}:K{r2}')
-    ws2.cell(row=r2, column=1,
-             value="Смета составлена в соответствии с Приказом Минстроя России от 12.05.2025 № 281/пр. Объёмы работ обоснованы СП 446.1325800.2019, СП 341.1325800.2017, ГОСТ 20522-2012.")
-    ws2.cell(row=r2, column=1).font = Font(italic=True, size=9, color="666666")
+    styles.write(ws2, r2, 1, "Смета составлена в соответствии с Приказом Минстроя России от 12.05.2025 № 281/пр. Объёмы работ обоснованы СП 446.1325800.2019, СП 341.1325800.2017, ГОСТ 20522-2012.", "w2_footer")
 
     # Сохранение
-    output_path = Path(filename)
+    output_path = filename if hasattr(filename, "write") else Path(filename)
     wb.save(output_path)
 
     return output_path
@@ -0,0 +1,415 @@
+"""
+Потоковый экспорт сметы в Excel (XlsxWriter)
+
+Те же два листа, что и в export_excel, но строки пишутся последовательно,
+а форматы регистрируются один раз на книгу. В режиме constant_memory
+XlsxWriter сбрасывает каждую строку после записи, поэтому память не растёт
+с числом позиций (ценой временных файлов листов в tmpdir).
+"""
+
+from pathlib import Path
+from typing import BinaryIO, Union
+
+import xlsxwriter
+
+from modules.export_excel import coef_note
+from modules.justifications import get_justification_index
+from modules.report import ReportModel, build_report
+
+
+# С какого числа позиций включать constant_memory (для небольших смет
+# выгоднее держать книгу в памяти и не трогать диск)
+CONSTANT_MEMORY_ITEMS = 2000
+
+MONEY_FORMAT = '#,##0'
+
+_BORDER = {'border': 1}
+_WRAP_CENTER = {'text_wrap': True, 'valign': 'vcenter', 'align': 'center'}
+_WRAP_LEFT = {'text_wrap': True, 'valign': 'vcenter', 'align': 'left'}
+_WRAP_RIGHT = {'text_wrap': True, 'valign': 'vcenter', 'align': 'right'}
+
+
+def _fill(color: str) -> dict:
+    return {'pattern': 1, 'bg_color': color}
+
+
+def _register_formats(wb) -> dict:
+    """Все форматы книги — создаются один раз и разделяются ячейками"""
+    subtotal_fill = _fill("#FFF3E0")
+    total_fill = _fill("#C8E6C9")
+    total2_fill = _fill("#E2EFDA")
+    add = wb.add_format
+
+    formats = {
+        # Лист «Смета ИГИ»
+        'title': add({'bold': True, 'font_size': 14, 'align': 'center'}),
+        'center': add({'align': 'center'}),
+        'bold': add({'bold': True}),
+        'header': add({'bold': True, 'font_size': 12, **_WRAP_CENTER, **_BORDER, **_fill("#E0E0E0")}),
+        'section': add({'bold': True, **_BORDER, **_fill("#E0E0E0")}),
+        'cell': add(_BORDER),
+        'wrap': add({'text_wrap': True, **_BORDER}),
+        'cell_center': add({'align': 'center', **_BORDER}),
+        'cell_right': add({'align': 'right', **_BORDER}),
+        'ref': add({'text_wrap': True, 'valign': 'vcenter', **_BORDER}),
+        'money': add({'num_format': MONEY_FORMAT, **_BORDER}),
+        'dz_title': add({'bold': True, 'italic': True, **_BORDER}),
+        'subtotal_label': add({'bold': True, 'align': 'right', **_BORDER, **subtotal_fill}),
+        'subtotal_money': add({'bold': True, 'num_format': MONEY_FORMAT, **_BORDER, **subtotal_fill}),
+        'total_label': add({'bold': True, 'align': 'right', **_BORDER, **total_fill}),
+        'total_money': add({'bold': True, 'num_format': MONEY_FORMAT, **_BORDER, **total_fill}),
+        'k_label': add({'bold': True, 'align': 'right', **_BORDER}),
+        'k_money': add({'bold': True, 'num_format': MONEY_FORMAT, **_BORDER}),
+        'final_label': add({'bold': True, 'font_size': 12, 'align': 'right', **_BORDER, **total_fill}),
+        'final_money': add({'bold': True, 'font_size': 12, 'num_format': MONEY_FORMAT, **_BORDER, **total_fill}),
+
+        # Лист «Обоснование»
+        'w2_title': add({'bold': True, 'font_size': 13, 'align': 'center', 'valign': 'vcenter'}),
+        'w2_base': add({'italic': True, 'font_size': 9, 'font_color': '#444444', **_WRAP_LEFT}),
+        'w2_info': add({'bold': True, 'font_size': 9, 'align': 'left', 'valign': 'vcenter'}),
+        'w2_header': add({'bold': True, 'font_size': 10, 'font_color': '#FFFFFF', **_WRAP_CENTER, **_BORDER,
+                          **_fill("#1F4E79")}),
+        'w2_header_qty': add({'bold': True, 'font_size': 10, 'font_color': '#FFFFFF', **_WRAP_CENTER, **_BORDER,
+                              **_fill("#375623")}),
+        'w2_section': add({'bold': True, 'font_size': 10, 'align': 'center', 'valign': 'vcenter', **_BORDER,
+                           **_fill("#D6E4F0")}),
+        'w2_subtotal_label': add({'bold': True, 'font_size': 10, 'align': 'right', 'valign': 'vcenter', **_BORDER,
+                                  **subtotal_fill}),
+        'w2_subtotal_blank': add({**_BORDER, **subtotal_fill}),
+        'w2_subtotal_money': add({'bold': True, 'font_size': 10, 'num_format': MONEY_FORMAT, **_WRAP_RIGHT,
+                                  **_BORDER, **subtotal_fill}),
+        'w2_dz_title': add({'bold': True, 'font_size': 11, 'font_color': '#FFFFFF', 'align': 'center',
+                            'valign': 'vcenter', **_BORDER, **_fill("#375623")}),
+        'w2_dz_header': add({'bold': True, 'font_size': 9, 'font_color': '#FFFFFF', **_WRAP_CENTER, **_BORDER,
+                             **_fill("#548235")}),
+        'w2_dz_cell': add({'font_size': 9, **_WRAP_LEFT, **_BORDER, **_fill("#FFF2CC")}),
+        'w2_dz_money': add({'bold': True, 'font_size': 10, 'num_format': MONEY_FORMAT, **_WRAP_RIGHT, **_BORDER,
+                            **_fill("#FFF2CC")}),
+        'w2_total_label': add({'bold': True, 'font_size': 10, 'align': 'right', 'valign': 'vcenter', **_BORDER,
+                               **total2_fill}),
+        'w2_total_label_big': add({'bold': True, 'font_size': 12, 'align': 'right', 'valign': 'vcenter', **_BORDER,
+                                   **total2_fill}),
+        'w2_total_blank': add({**_BORDER, **total2_fill}),
+        'w2_total_money_11': add({'bold': True, 'font_size': 11, 'num_format': MONEY_FORMAT, **_WRAP_RIGHT,
+                                  **_BORDER, **total2_fill}),
+        'w2_total_money_big': add({'bold': True, 'font_size': 12, 'num_format': MONEY_FORMAT, **_WRAP_RIGHT,
+                                   **_BORDER, **total2_fill}),
+        'w2_footer': add({'italic': True, 'font_size': 9, 'font_color': '#666666'}),
+    }
+
+    # Строки позиций: чередование заливки (чётные — F5F9FF, нечётные — без заливки)
+    item_columns = {
+        'num': {'font_size': 10, **_WRAP_CENTER},
+        'name': {'font_size': 10, **_WRAP_LEFT},
+        'unit': {'font_size': 10, **_WRAP_CENTER},
+        'qty': {'font_size': 10, **_WRAP_RIGHT},
+        'ref': {'font_size': 9, 'italic': True, 'font_color': '#1F4E79', **_WRAP_CENTER},
+        'pz': {'font_size': 10, **_WRAP_RIGHT},
+        'coef': {'font_size': 9, **_WRAP_LEFT},
+        'formula': {'font_size': 9, **_WRAP_RIGHT},
+        'cost': {'bold': True, 'font_size': 10, 'num_format': MONEY_FORMAT, **_WRAP_RIGHT},
+    }
+    for shade in (False, True):
+        shade_fill = _fill("#F5F9FF") if shade else {}
+        formats[('item', shade)] = {
+            name: add({**props, **_BORDER, **shade_fill}) for name, props in item_columns.items()
+        }
+
+    # Колонки обоснования объёма: есть обоснование / нет обоснования
+    for has_just in (True, False):
+        color = '#1A5C2A' if has_just else '#AA0000'
+        just_fill = _fill("#EBF3E8" if has_just else "#FFF0F0")
+        formats[('qty_ref', has_just)] = add({'font_size': 8, 'italic': True, 'font_color': color, **_WRAP_LEFT,
+                                              **_BORDER, **just_fill})
+        formats[('qty_note', has_just)] = add({'font_size': 9, 'font_color': color, **_WRAP_LEFT, **_BORDER,
+                                               **just_fill})
+
+    return formats
+
+
+def export_to_excel_stream(estimate, filename: Union[str, Path, BinaryIO] = None,
+                           constant_memory: bool = None,
+                           report: ReportModel = None) -> Union[Path, BinaryIO]:
+    """Экспортировать смету в Excel потоково (XlsxWriter)
+
+    filename: путь к файлу или записываемый двоичный поток (например, BytesIO)
+    constant_memory: сбрасывать строки по мере записи; по умолчанию — для смет
+    от CONSTANT_MEMORY_ITEMS позиций
+    report: готовая модель отчёта (build_report); если не передана, строится здесь
+    """
+
+    if filename is None:
+        filename = f"Смета_{estimate.project_name}_{estimate.date_created}.xlsx"
+    output_path = filename if hasattr(filename, "write") else Path(filename)
+    if report is None:
+        report = build_report(estimate)
+
+    if constant_memory is None:
+        constant_memory = len(estimate.items) >= CONSTANT_MEMORY_ITEMS
+    options = {'constant_memory': True} if constant_memory else {'in_memory': True}
+
+    wb = xlsxwriter.Workbook(output_path if hasattr(output_path, "write") else str(output_path), options)
+    f = _register_formats(wb)
+    _write_estimate_sheet(wb.add_worksheet("Смета ИГИ"), f, estimate, report)
+    _write_justification_sheet(wb.add_worksheet("Обоснование"), f, estimate, report)
+
+    wb.close()
+    return output_path
+
+
+def _write_estimate_sheet(ws, f, estimate, report):
+    """Лист «Смета ИГИ» (строки пишутся строго сверху вниз)"""
+    col_widths = [8, 50, 10, 10, 20, 25, 18]
+    for col, width in enumerate(col_widths):
+        ws.set_column(col, col, width)
+
+    # Заголовок сметы
+    template_label = f" ({estimate.template_name})" if getattr(estimate, "template_name", "") else ""
+    ws.merge_range(0, 0, 0, 6, f"ЛОКАЛЬНАЯ СМЕТА{template_label}", f['title'])
+    ws.merge_range(1, 0, 1, 6, "на инженерно-геологические изыскания", f['center'])
+
+    # Информация о проекте
+    row = 3
+    project_info = [
+        ("Проект:", estimate.project_name),
+        ("Шифр:", estimate.project_code or "-"),
+        ("Объект:", estimate.object_name or "-"),
+        ("Заказчик:", estimate.customer or "-"),
+        ("Подрядчик:", estimate.contractor or "-"),
+        ("Дата:", estimate.date_created),
+        ("Базовый город:", getattr(estimate, 'base_city', 'г. Санкт-Петербург')),
+        ("Регион производства работ:", getattr(estimate, 'work_region', '-')),
+        ("Расстояние до объекта:", f"{getattr(estimate, 'distance_km', '-')} км"),
+        ("Индекс пересчёта:", f"{float(estimate.price_index):.2f}"),
+    ]
+    for label, value in project_info:
+        ws.write_string(row, 0, label, f['bold'])
+        if value:
+            ws.write_string(row, 1, str(value))
+        row += 1
+    row += 1
+
+    # Заголовок таблицы
+    headers = ["№ п/п", "Наименование работ", "Ед. изм.", "Кол-во", "Обоснование", "Расчёт", "Стоимость, руб."]
+    for col, header in enumerate(headers):
+        ws.write_string(row, col, header, f['header'])
+    row += 1
+
+    for section in report.sections:
+        ws.merge_range(row, 0, row, 6, section.name, f['section'])
+        row += 1
+
+        for entry in section.items:
+            item = entry.item
+            ref_text = f"НЗ №281/пр, {item.table_ref}" if item.table_ref else "НЗ №281/пр"
+            formula_text = item.formula if item.formula else f"{entry.base_cost:,.0f} x {entry.quantity:,.1f}"
+            ws.write_number(row, 0, entry.num, f['cell'])
+            ws.write_string(row, 1, item.name, f['wrap'])
+            ws.write_string(row, 2, item.unit, f['cell_center'])
+            ws.write_number(row, 3, entry.quantity, f['cell_right'])
+            ws.write_string(row, 4, ref_text, f['ref'])
+            ws.write_string(row, 5, formula_text, f['cell_right'])
+            ws.write_number(row, 6, entry.total_cost, f['money'])
+            row += 1
+
+        ws.merge_range(row, 0, row, 5, f"Итого по разделу «{section.name.lower()}»:", f['subtotal_label'])
+        ws.write_number(row, 6, section.subtotal, f['subtotal_money'])
+        row += 1
+
+    # Итоги
+    row += 1
+    ws.merge_range(row, 0, row, 5, "ИТОГО базовые затраты (СП + СЛ + СК):", f['subtotal_label'])
+    ws.write_number(row, 6, report.base_total, f['subtotal_money'])
+
+    if report.dz_rows:
+        row += 1
+        ws.merge_range(row, 0, row, 6, "Дополнительные затраты:", f['dz_title'])
+        row += 1
+        for dz in report.dz_rows:
+            ws.write_string(row, 0, dz.label, f['cell'])
+            ws.write_string(row, 1, dz.cost.get('name', 'ДЗ'), f['wrap'])
+            ws.write_string(row, 2, "-", f['cell_center'])
+            ws.write_string(row, 3, "-", f['cell_center'])
+            ws.write_string(row, 4, dz.cost.get('basis', '-'), f['wrap'])
+            ws.write_string(row, 5, dz.cost.get('formula', '-'), f['cell_right'])
+            ws.write_number(row, 6, dz.value, f['money'])
+            row += 1
+
+    row += 1
+    ws.merge_range(row, 0, row, 5, "ИТОГО с учетом дополнительных затрат:", f['subtotal_label'])
+    ws.write_number(row, 6, report.total_with_dz, f['subtotal_money'])
+
+    row += 1
+    ws.merge_range(row, 0, row, 5, f"ИТОГО с индексом пересчёта ({report.price_index:.2f}):", f['total_label'])
+    ws.write_number(row, 6, report.total_indexed, f['total_money'])
+
+    if report.has_contract_coefficient:
+        row += 1
+        ws.merge_range(row, 0, row, 5, f"Коэффициент договорной цены ({report.contract_coefficient:.3f}):", f['k_label'])
+        ws.write_number(row, 6, report.final_total, f['k_money'])
+
+    row += 1
+    ws.merge_range(row, 0, row, 5, "ВСЕГО по смете:", f['final_label'])
+    ws.write_number(row, 6, report.final_total, f['final_money'])
+
+    # Подпись
+    row += 3
+    ws.write_string(row, 0, "Составил: __________________ / __________________ /")
+    row += 2
+    ws.write_string(row, 0, "Проверил: __________________ / __________________ /")
+
+
+def _write_justification_sheet(ws, f, estimate, report):
+    """Лист «Обоснование» (строки пишутся строго сверху вниз)"""
+    justification_index = get_justification_index()
+    template_id = getattr(estimate, 'template_id', None)
+
+    col2_widths = [5, 44, 7, 6, 13, 11, 18, 22, 10, 22, 42]
+    for col, width in enumerate(col2_widths):
+        ws.set_column(col, col, width)
+
+    # Заголовок листа
+    ws.set_row(0, 22)
+    ws.merge_range(0, 0, 0, 10, "ПОЯСНИТЕЛЬНАЯ ЗАПИСКА К СМЕТЕ (Обоснование стоимости и объёмов работ)", f['w2_title'])
+    ws.set_row(1, 24)
+    ws.merge_range(1, 0, 1, 10, "Нормативная база: НЗ №281/пр (Приказ Минстроя РФ от 12.05.2025 № 281/пр) | СП 446.1325800.2019 | СП 341.1325800.2017 | СП 47.13330.2016 | ГОСТ 20522-2012", f['w2_base'])
+    ws.set_row(2, 16)
+    ws.merge_range(2, 0, 2, 10, (
+        f"Проект: {estimate.project_name}   |   "
+        f"Объект: {estimate.object_name or '—'}   |   "
+        f"Регион: {getattr(estimate, 'work_region', '—') or '—'}   |   "
+        f"Шаблон: {template_id or '—'}   |   "
+        f"Дата: {estimate.date_created}"
+    ), f['w2_info'])
+
+    row = 4
+    headers2 = [
+        "№", "Наименование работ", "Ед.", "Кол-во",
+        "Норм. база\n(НЗ №281/пр)", "ПЗ, руб.", "Коэф-ты",
+        "Формула расчёта", "Стоимость,\nруб.",
+        "Норм. основание\nобъёма (СП/ГОСТ)",
+        "Обоснование объёма работ"
+    ]
+    ws.set_row(row, 32)
+    for col, header in enumerate(headers2):
+        ws.write_string(row, col, header, f['w2_header'] if col < 9 else f['w2_header_qty'])
+    row += 1
+
+    def blank_cells(row_idx, first_col, fmt):
+        for col in range(first_col, 11):
+            ws.write_blank(row_idx, col, None, fmt)
+
+    row_shade = False
+    for section in report.sections:
+        ws.set_row(row, 18)
+        ws.merge_range(row, 0, row, 10, f"Раздел: {section.name}", f['w2_section'])
+        row += 1
+
+        for entry in section.items:
+            item = entry.item
+            fi = f[('item', row_shade)]
+            row_shade = not row_shade
+
+            ref_text = f"НЗ №281/пр\n{item.table_ref}" if item.table_ref else "НЗ №281/пр"
+            pz_fixed = entry.pz1p_fixed
+            if pz_fixed > 0:
+                pz_text = f"ПЗ1п: {pz_fixed:,.0f}\nПЗ2п: {entry.base_cost:,.0f}"
+            else:
+                pz_text = f"{entry.base_cost:,.0f}"
+            formula_txt = item.formula if item.formula else (
+                f"ПЗ1п({pz_fixed:,.0f}) + ПЗ2п({entry.base_cost:,.0f}) × {entry.quantity:.0f}"
+                if pz_fixed > 0
+                else f"{entry.base_cost:,.0f} × {entry.quantity:.1f}"
+            )
+            jdata = justification_index.for_item(item, template_id)
+            qty_ref = jdata.get('qty_basis', '')
+            qty_note = jdata.get('qty_note', '')
+            has_just = bool(qty_ref or qty_note)
+
+            ws.set_row(row, 52)
+            ws.write_number(row, 0, entry.num, fi['num'])
+            ws.write_string(row, 1, item.name, fi['name'])
+            ws.write_string(row, 2, item.unit, fi['unit'])
+            ws.write_number(row, 3, entry.quantity, fi['qty'])
+            ws.write_string(row, 4, ref_text, fi['ref'])
+            ws.write_string(row, 5, pz_text, fi['pz'])
+            ws.write_string(row, 6, coef_note(item), fi['coef'])
+            ws.write_string(row, 7, formula_txt, fi['formula'])
+            ws.write_number(row, 8, entry.total_cost, fi['cost'])
+            ws.write_string(row, 9, qty_ref or '—', f[('qty_ref', has_just)])
+            ws.write_string(row, 10, qty_note or ('Нет данных' if not template_id else 'Нет обоснования для данного шаблона'),
+                            f[('qty_note', has_just)])
+            row += 1
+
+        ws.set_row(row, 18)
+        ws.merge_range(row, 0, row, 7, f"Итого по разделу «{section.name.lower()}»:", f['w2_subtotal_label'])
+        ws.write_number(row, 8, section.subtotal, f['w2_subtotal_money'])
+        blank_cells(row, 9, f['w2_subtotal_blank'])
+        row += 1
+
+    row += 1  # отступ
+
+    # ДЗ — расширенное обоснование
+    if report.dz_rows:
+        ws.set_row(row, 22)
+        ws.merge_range(row, 0, row, 10, "ДОПОЛНИТЕЛЬНЫЕ ЗАТРАТЫ (ДЗ) — обоснование", f['w2_dz_title'])
+        row += 1
+
+        dz_headers = ["ДЗ", "Наименование", "Норм. база", "Ссылка на пункт", "База для %",
+                      "% (ПДЗ)", "Формула расчёта", "Сумма, руб.", "Комментарий"]
+        ws.set_row(row, 28)
+        for col, header in enumerate(dz_headers):
+            ws.write_string(row, col, header, f['w2_dz_header'])
+        row += 1
+
+        for dz in report.dz_rows:
+            cost = dz.cost
+            basis = cost.get('basis', '—')
+            vals = [
+                dz.label,
+                cost.get('name', '—'),
+                basis,
+                basis.split(',')[0] if ',' in cost.get('basis', '') else '—',
+                "СПпз (стоимость полевых работ)",
+                f"{cost.get('percent', 0):.1f}%",
+                cost.get('formula', '—'),
+            ]
+            ws.set_row(row, 52)
+            for col, value in enumerate(vals):
+                ws.write_string(row, col, str(value), f['w2_dz_cell'])
+            ws.write_number(row, 7, dz.value, f['w2_dz_money'])
+            ws.write_string(row, 8, justification_index.dz_comment(cost), f['w2_dz_cell'])
+            row += 1
+
+        ws.set_row(row, 18)
+        ws.merge_range(row, 0, row, 6, "Итого дополнительных затрат:", f['w2_total_label'])
+        ws.write_number(row, 7, report.dz_sum, f['w2_total_money_11'])
+        blank_cells(row, 8, f['w2_total_blank'])
+        row += 2
+
+    # Итоговый блок
+    summary_rows = [
+        ("ИТОГО базовые затраты (СП + СЛ + СК, в ценах на 01.01.2024):", report.base_total),
+        ("Сумма дополнительных затрат:", report.dz_sum),
+        ("ИТОГО с ДЗ (в ценах на 01.01.2024):", report.total_with_dz),
+        (f"× Индекс пересчёта ({report.price_index:.2f}) → приведение к текущим ценам:", report.total_indexed),
+    ]
+    if report.has_contract_coefficient:
+        summary_rows.append((f"× Коэффициент договорной цены ({report.contract_coefficient:.3f}):", report.final_total))
+    summary_rows.append(("ВСЕГО ПО СМЕТЕ (итоговая договорная стоимость):", report.final_total))
+
+    for label, val in summary_rows:
+        is_total = "ВСЕГО" in label or "ИТОГО с ДЗ" in label
+        ws.set_row(row, 20)
+        if is_total:
+            ws.merge_range(row, 0, row, 7, label, f['w2_total_label_big'])
+            ws.write_number(row, 8, val, f['w2_total_money_big'])
+            blank_cells(row, 9, f['w2_total_blank'])
+        else:
+            ws.merge_range(row, 0, row, 7, label, f['w2_subtotal_label'])
+            ws.write_number(row, 8, val, f['w2_subtotal_money'])
+            blank_cells(row, 9, f['w2_subtotal_blank'])
+        row += 1
+
+    row += 2
+    ws.merge_range(row, 0, row, 10, "Смета составлена в соответствии с Приказом Минстроя России от 12.05.2025 № 281/пр. Объёмы работ обоснованы СП 446.1325800.2019, СП 341.1325800.2017, ГОСТ 20522-2012.", f['w2_footer'])
@@ -3,76 +3,145 @@
 """
 
 from pathlib import Path
+from typing import BinaryIO, Union
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+from reportlab.platypus.frames import Frame
+from reportlab.platypus.doctemplate import PageTemplate
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from functools import lru_cache
+from itertools import islice
 import os
 
+from config import PDF_FONT_PATH, PDF_FONT_BOLD_PATH
+from modules.report import ReportModel, build_report, money
 
-def register_fonts():
-    """Регистрация кириллических шрифтов (Windows + Linux)"""
-    font_paths = [
-        # Windows
-        os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts', 'arial.ttf'),
-        os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts', 'times.ttf'),
-        # Linux / Streamlit Cloud (Debian-based)
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-        "/usr/share/fonts/truetype/freefont/FreeSans.ttf"
-    ]
-    
-    for path in font_paths:
+
+# С какого числа позиций PDF собирается постранично (режим длинной сметы)
+LONG_PDF_ITEMS = 300
+
+# Фиксированная высота строки таблицы сметы: названия обрезаются до одной
+# строки, поэтому число строк на листе известно заранее
+ROW_HEIGHT = 5*mm
+
+
+# Кандидаты шрифтов с кириллицей: (обычный, жирный)
+_WINDOWS_FONTS = (("arial.ttf", "arialbd.ttf"), ("times.ttf", "timesbd.ttf"))
+_LINUX_FONTS = (
+    # Linux / Streamlit Cloud (Debian-based)
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+     "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"),
+    ("/usr/share/fonts/truetype/freefont/FreeSans.ttf", "/usr/share/fonts/truetype/freefont/FreeSansBold.ttf"),
+)
+
+
+def _font_candidates() -> list:
+    """Пути шрифтов в порядке проверки: из настроек, затем системные для текущей ОС"""
+    candidates = []
+    if PDF_FONT_PATH:
+        candidates.append((PDF_FONT_PATH, PDF_FONT_BOLD_PATH or None))
+    if os.name == "nt":
+        fonts_dir = os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts')
+        candidates += [(os.path.join(fonts_dir, regular), os.path.join(fonts_dir, bold))
+                       for regular, bold in _WINDOWS_FONTS]
+    else:
+        candidates += list(_LINUX_FONTS)
+    return candidates
+
+
+@lru_cache(maxsize=1)
+def register_fonts() -> str:
+    """Регистрация кириллических шрифтов — один раз на процесс.
+
+    Шрифт берётся из config.PDF_FONT_PATH (переменная окружения SMETA_PDF_FONT),
+    иначе ищется в системных папках. Зарегистрированные в pdfmetrics шрифты
+    живут до конца процесса, поэтому повторные экспорты шрифты не загружают.
+    """
+    for path, bold_path in _font_candidates():
         if os.path.exists(path):
             try:
                 # Регистрируем основной шрифт
                 pdfmetrics.registerFont(TTFont('CustomCyrillic', path))
-                
-                # Пытаемся найти жирную версию (эвристика)
-                bold_path = None
-                if "arial.ttf" in path.lower(): 
-                    bold_path = path.replace("arial.ttf", "arialbd.ttf")
-                elif "times.ttf" in path.lower(): 
-                    bold_path = path.replace("times.ttf", "timesbd.ttf")
-                elif "DejaVuSans.ttf" in path: 
-                    bold_path = path.replace("DejaVuSans.ttf", "DejaVuSans-Bold.ttf")
-                elif "LiberationSans-Regular.ttf" in path: 
-                    bold_path = path.replace("LiberationSans-Regular.ttf", "LiberationSans-Bold.ttf")
-                elif "FreeSans.ttf" in path:
-                     bold_path = path.replace("FreeSans.ttf", "FreeSansBold.ttf")
 
                 if bold_path and os.path.exists(bold_path):
                     pdfmetrics.registerFont(TTFont('CustomCyrillic-Bold', bold_path))
                 else:
                     # Фоллбэк: используем обычный шрифт как жирный
                     pdfmetrics.registerFont(TTFont('CustomCyrillic-Bold', path))
-                    
+
                 return 'CustomCyrillic'
             except Exception as e:
                 print(f"Font loading error ({path}): {e}")
                 continue
-    
+
     # Если шрифты не найдены, используем встроенный (без кириллицы)
     return 'Helvetica'
 
 
-def export_to_pdf(estimate, filename: str = None) -> Path:
-    """Экспортировать смету в PDF"""
+class StreamingDocTemplate(SimpleDocTemplate):
+    """SimpleDocTemplate с пошаговой сборкой: open() → add(flowable)... → close().
+
+    Каждый flowable размещается сразу и больше не хранится, поэтому в памяти
+    нет списка всех элементов документа, а вызывающий код может узнать,
+    сколько места осталось на текущем листе.
+    """
+
+    def open(self):
+        self._calc()
+        frame = Frame(self.leftMargin, self.bottomMargin, self.width, self.height, id='normal')
+        self.addPageTemplates([
+            PageTemplate(id='First', frames=frame, pagesize=self.pagesize),
+            PageTemplate(id='Later', frames=frame, pagesize=self.pagesize),
+        ])
+        self._startBuild()
+        self.canv._doctemplate = self
+
+    def add(self, flowable):
+        """Разместить flowable (с переносом частей на следующие листы)"""
+        pending = [flowable]
+        while pending:
+            self.clean_hanging()
+            self.handle_flowable(pending)
+
+    def available_height(self) -> float:
+        """Свободная высота в текущей рамке"""
+        self.clean_hanging()
+        return self.frame._y - self.frame._y1p
+
+    def close(self):
+        del self.canv._doctemplate
+        self._endBuild()
+
+
+def export_to_pdf(estimate, filename: Union[str, Path, BinaryIO] = None,
+                  long_mode: bool = None, report: ReportModel = None) -> Union[Path, BinaryIO]:
+    """Экспортировать смету в PDF
+    
+    filename: путь к файлу или записываемый двоичный поток (например, BytesIO) —
+    в поток документ пишется без обращения к диску, и возвращается сам поток
+    long_mode: постраничная сборка (таблица по листам, шапка и итог на каждом листе);
+    по умолчанию — для смет от LONG_PDF_ITEMS позиций
+    report: готовая модель отчёта (build_report); если не передана, строится здесь
+    """
     
     if filename is None:
         filename = f"Смета_{estimate.project_name}_{estimate.date_created}.pdf"
+    if report is None:
+        report = build_report(estimate)
     
-    output_path = Path(filename)
+    output_path = filename if hasattr(filename, "write") else Path(filename)
     
     # Регистрируем шрифты
     font_name = register_fonts()
     
     # Создаём документ
-    doc = SimpleDocTemplate(
-        str(output_path),
+    doc = StreamingDocTemplate(
+        output_path if hasattr(output_path, "write") else str(output_path),
         pagesize=A4,
         rightMargin=15*mm,
         leftMargin=15*mm,
@@ -143,37 +212,24 @@ def export_to_pdf(estimate, filename: str = None) -> Path:
     elements.append(project_table)
     elements.append(Spacer(1, 10*mm))
     
+    if long_mode is None:
+        long_mode = len(estimate.items) >= LONG_PDF_ITEMS
+    if long_mode:
+        _build_long_pdf(doc, elements, report, font_name, normal_style)
+        return output_path
+    
     # Таблица сметы
     header = ["№", "Код", "Наименование", "Ед.", "Кол-во", "Цена", "Сумма"]
     col_widths = [8*mm, 12*mm, 70*mm, 12*mm, 15*mm, 22*mm, 25*mm]
     
     table_data = [header]
     
-    # Группировка
-    categories = {
-        "field": {"name": "ПОЛЕВЫЕ РАБОТЫ", "items": []},
-        "laboratory": {"name": "ЛАБОРАТОРНЫЕ РАБОТЫ", "items": []},
-        "office": {"name": "КАМЕРАЛЬНЫЕ РАБОТЫ", "items": []}
-    }
-    
-    for item in estimate.items:
-        if item.code.startswith(("01", "02", "03", "04")):
-            categories["field"]["items"].append(item)
-        elif item.code.startswith(("05", "06", "07")):
-            categories["laboratory"]["items"].append(item)
-        else:
-            categories["office"]["items"].append(item)
-    
     row_styles = []
     current_row = 1
-    item_num = 1
     
-    for cat_key, cat_data in categories.items():
-        if not cat_data["items"]:
-            continue
-        
+    for section in report.sections:
         # Заголовок раздела
-        table_data.append([cat_data["name"], "", "", "", "", "", ""])
+        table_data.append([section.name, "", "", "", "", "", ""])
         row_styles.append(('SPAN', (0, current_row), (6, current_row)))
         row_styles.append(('BACKGROUND', (0, current_row), (6, current_row), colors.lightgrey))
         row_styles.append(('FONTNAME', (0, current_row), (6, current_row), 
@@ -181,25 +237,12 @@ def export_to_pdf(estimate, filename: str = None) -> Path:
         current_row += 1
         
         # Позиции
-        for item in cat_data["items"]:
-            # Обрезаем длинные названия
-            name = item.name[:50] + "..." if len(item.name) > 50 else item.name
-            
-            table_data.append([
-                str(item_num),
-                item.code,
-                name,
-                item.unit,
-                f"{float(item.quantity):.1f}",
-                f"{float(item.unit_cost):,.0f}",
-                f"{float(item.total_cost):,.0f}"
-            ])
-            item_num += 1
+        for entry in section.items:
+            table_data.append(_item_cells(entry))
             current_row += 1
         
         # Подитог
-        subtotal = sum(float(item.total_cost) for item in cat_data["items"])
-        table_data.append(["", "", f"Итого {cat_data['name'].lower()}:", "", "", "", f"{subtotal:,.0f}"])
+        table_data.append(["", "", f"Итого {section.name.lower()}:", "", "", "", section.subtotal_text])
         row_styles.append(('SPAN', (0, current_row), (1, current_row)))
         row_styles.append(('BACKGROUND', (0, current_row), (6, current_row), colors.Color(1, 0.95, 0.9)))
         row_styles.append(('FONTNAME', (2, current_row), (6, current_row),
@@ -207,16 +250,15 @@ def export_to_pdf(estimate, filename: str = None) -> Path:
         current_row += 1
     
     # Итого
-    base_total = sum(float(item.total_cost) for item in estimate.items)
-    table_data.append(["", "", "ИТОГО (в ценах 01.01.2024):", "", "", "", f"{base_total:,.0f}"])
+    table_data.append(["", "", "ИТОГО (в ценах 01.01.2024):", "", "", "", money(report.base_total)])
     row_styles.append(('SPAN', (0, current_row), (1, current_row)))
     row_styles.append(('BACKGROUND', (0, current_row), (6, current_row), colors.Color(0.9, 0.95, 0.9)))
     row_styles.append(('FONTNAME', (2, current_row), (6, current_row),
                       font_name if font_name == 'Helvetica' else f'{font_name}-Bold'))
     current_row += 1
     
-    # С индексом
-    table_data.append(["", "", f"ВСЕГО с индексом ({float(estimate.price_index):.2f}):", "", "", "", f"{float(estimate.total):,.0f}"])
+    # С индексом (с учётом ДЗ и коэффициента договорной цены — как «ВСЕГО по смете» в Excel и Word)
+    table_data.append(["", "", f"ВСЕГО с индексом ({report.price_index:.2f}):", "", "", "", money(report.final_total)])
     row_styles.append(('SPAN', (0, current_row), (1, current_row)))
     row_styles.append(('BACKGROUND', (0, current_row), (6, current_row), colors.Color(0.8, 0.9, 0.8)))
     row_styles.append(('FONTNAME', (0, current_row), (6, current_row),
@@ -255,3 +297,125 @@ def export_to_pdf(estimate, filename: str = None) -> Path:
     doc.build(elements)
     
     return output_path
+
+
+def _item_cells(entry) -> list:
+    """Ячейки строки позиции (длинные названия обрезаются)"""
+    item = entry.item
+    name = item.name[:50] + "..." if len(item.name) > 50 else item.name
+    return [
+        str(entry.num),
+        item.code,
+        name,
+        item.unit,
+        entry.quantity_text,
+        entry.unit_cost_text,
+        entry.total_text,
+    ]
+
+
+def _estimate_rows(report):
+    """Строки таблицы сметы по одной: (ячейки, вид строки, сумма позиции)"""
+    for section in report.sections:
+        yield [section.name, "", "", "", "", "", ""], "section", 0.0
+        for entry in section.items:
+            yield _item_cells(entry), "item", entry.total_cost
+        yield ["", "", f"Итого {section.name.lower()}:", "", "", "", section.subtotal_text], "subtotal", 0.0
+
+
+def _build_long_pdf(doc, elements, report, font_name, normal_style):
+    """Длинная смета: таблица режется по листам, flowables размещаются по мере создания.
+
+    На каждом листе — своя таблица с шапкой и строкой «Итого по листу».
+    Число строк на листе считается по свободной высоте рамки и фиксированной
+    высоте строки, поэтому разбиение таблиц при вёрстке не требуется, а время
+    сборки растёт линейно с числом позиций.
+    """
+    bold_font = font_name if font_name == 'Helvetica' else f'{font_name}-Bold'
+    header = ["№", "Код", "Наименование", "Ед.", "Кол-во", "Цена", "Сумма"]
+    col_widths = [8*mm, 12*mm, 70*mm, 12*mm, 15*mm, 22*mm, 25*mm]
+    
+    base_style = [
+        ('FONTNAME', (0, 0), (-1, -1), font_name),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('FONTNAME', (0, 0), (-1, 0), bold_font),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ('ALIGN', (0, 1), (0, -1), 'CENTER'),
+        ('ALIGN', (3, 1), (3, -1), 'CENTER'),
+        ('ALIGN', (4, 1), (6, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('TOPPADDING', (0, 0), (-1, -1), 2),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+    ]
+    
+    def row_style(kind, r):
+        if kind == "section":
+            return [('SPAN', (0, r), (6, r)),
+                    ('BACKGROUND', (0, r), (6, r), colors.lightgrey),
+                    ('FONTNAME', (0, r), (6, r), bold_font)]
+        if kind == "subtotal":
+            return [('SPAN', (0, r), (1, r)),
+                    ('BACKGROUND', (0, r), (6, r), colors.Color(1, 0.95, 0.9)),
+                    ('FONTNAME', (2, r), (6, r), bold_font)]
+        if kind == "page_total":
+            return [('SPAN', (0, r), (1, r)),
+                    ('BACKGROUND', (0, r), (6, r), colors.Color(0.95, 0.95, 0.95)),
+                    ('FONTNAME', (2, r), (6, r), bold_font)]
+        if kind == "total":
+            return [('SPAN', (0, r), (1, r)),
+                    ('BACKGROUND', (0, r), (6, r), colors.Color(0.9, 0.95, 0.9)),
+                    ('FONTNAME', (2, r), (6, r), bold_font)]
+        if kind == "grand":
+            return [('SPAN', (0, r), (1, r)),
+                    ('BACKGROUND', (0, r), (6, r), colors.Color(0.8, 0.9, 0.8)),
+                    ('FONTNAME', (0, r), (6, r), bold_font)]
+        return []
+    
+    def make_table(rows):
+        data = [header] + [cells for cells, _, _ in rows]
+        style = list(base_style)
+        for r, (_, kind, _) in enumerate(rows, 1):
+            style += row_style(kind, r)
+        table = Table(data, colWidths=col_widths, rowHeights=[ROW_HEIGHT] * len(data))
+        table.setStyle(TableStyle(style))
+        return table
+    
+    doc.open()
+    for flowable in elements:
+        doc.add(flowable)
+    
+    # Таблица по листам: шапка + строки + «Итого по листу»
+    rows = _estimate_rows(report)
+    page_num = 1
+    while True:
+        capacity = int(doc.available_height() // ROW_HEIGHT) - 2
+        if capacity < 1:
+            doc.add(PageBreak())
+            continue
+        chunk = list(islice(rows, capacity))
+        if not chunk:
+            break
+        page_total = sum(amount for _, _, amount in chunk)
+        chunk.append((["", "", f"Итого по листу {page_num}:", "", "", "", money(page_total)], "page_total", 0.0))
+        doc.add(make_table(chunk))
+        page_num += 1
+    
+    # Итого
+    totals = [
+        (["", "", "ИТОГО (в ценах 01.01.2024):", "", "", "", money(report.base_total)], "total", 0.0),
+        (["", "", f"ВСЕГО с индексом ({report.price_index:.2f}):", "", "", "", money(report.final_total)], "grand", 0.0),
+    ]
+    if doc.available_height() < ROW_HEIGHT * (len(totals) + 1):
+        doc.add(PageBreak())
+    doc.add(make_table(totals))
+    
+    # Подписи
+    doc.add(Spacer(1, 15*mm))
+    doc.add(Paragraph("Составил: __________________ / __________________ /", normal_style))
+    doc.add(Spacer(1, 8*mm))
+    doc.add(Paragraph("Проверил: __________________ / __________________ /", normal_style))
+    
+    doc.close()
@@ -2,13 +2,39 @@
 Экспорт сметы в Word (DOCX)
 """
 
+import re
+from copy import deepcopy
 from pathlib import Path
+from typing import BinaryIO, Union
 from docx import Document
 from docx.shared import Inches, Pt, Cm
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.table import WD_TABLE_ALIGNMENT
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
+from lxml import etree
+
+from modules.report import ReportModel, build_report, money
+
+
+# Ширины колонок основной таблицы: №, Код, Наименование, Ед., Кол-во, Цена, Сумма
+COLUMN_WIDTHS = [Cm(1), Cm(1.5), Cm(7), Cm(1.5), Cm(1.5), Cm(2), Cm(2.5)]
+
+# Форматы ячеек основной таблицы: {имя: (заливка, выравнивание, жирный, курсив)}
+CELL_FORMATS = {
+    "header": ("D9D9D9", "center", True, False),
+    "section": ("E0E0E0", None, True, False),
+    "text": (None, None, False, False),
+    "center": (None, "center", False, False),
+    "right": (None, "right", False, False),
+    "dz_title": (None, None, True, True),
+    "total": (None, "right", True, False),
+    "total_subtotal": ("FFF3E0", "right", True, False),
+    "total_base": ("E8F5E9", "right", True, False),
+    "total_grand": ("C8E6C9", "right", True, False),
+}
+
+_RUN_BREAKS = re.compile(r"([\t\r\n])")
 
 
 def set_cell_shading(cell, color: str):
@@ -18,13 +44,105 @@ def set_cell_shading(cell, color: str):
     cell._tc.get_or_add_tcPr().append(shading_elm)
 
 
-def export_to_word(estimate, filename: str = None) -> Path:
-    """Экспортировать смету в Word"""
+class TableRowBuilder:
+    """Сборка строк таблицы (w:tr) напрямую в lxml, минуя объекты python-docx.
+    
+    Свойства ячейки, абзаца и прогона (tcPr, pPr, rPr) строятся один раз
+    на сочетание колонки, объединения и формата и затем копируются в каждую
+    ячейку. Разметка совпадает с той, что дают cell.text, merge() и
+    set_cell_shading().
+    """
+    
+    def __init__(self, tbl, widths: list = COLUMN_WIDTHS):
+        self._tbl = tbl
+        self._widths = [width.twips for width in widths]
+        self._props = {}
+    
+    def add(self, cells: list):
+        """Добавить строку: cells — [(текст, число объединённых колонок, формат)]"""
+        tr = etree.SubElement(self._tbl, qn('w:tr'))
+        col = 0
+        for text, span, fmt in cells:
+            tc_pr, p_pr, r_pr = self._cell_props(col, span, fmt)
+            tc = etree.SubElement(tr, qn('w:tc'))
+            tc.append(deepcopy(tc_pr))
+            p = etree.SubElement(tc, qn('w:p'))
+            if p_pr is not None:
+                p.append(deepcopy(p_pr))
+            r = etree.SubElement(p, qn('w:r'))
+            if r_pr is not None:
+                r.append(deepcopy(r_pr))
+            _append_run_text(r, text)
+            col += span
+        return tr
+    
+    def add_total(self, label: str, value: float, fmt: str):
+        """Итоговая строка: подпись на шесть колонок и сумма"""
+        return self.add([(label, len(self._widths) - 1, fmt), (money(value), 1, fmt)])
+    
+    def _cell_props(self, col: int, span: int, fmt: str) -> tuple:
+        key = (col, span, fmt)
+        props = self._props.get(key)
+        if props is None:
+            fill, align, bold, italic = CELL_FORMATS[fmt]
+            
+            tc_pr = etree.Element(qn('w:tcPr'))
+            etree.SubElement(tc_pr, qn('w:tcW'), {
+                qn('w:type'): 'dxa', qn('w:w'): str(sum(self._widths[col:col + span])),
+            })
+            if span > 1:
+                etree.SubElement(tc_pr, qn('w:gridSpan'), {qn('w:val'): str(span)})
+            if fill:
+                etree.SubElement(tc_pr, qn('w:shd'), {qn('w:fill'): fill})
+            
+            p_pr = None
+            if align:
+                p_pr = etree.Element(qn('w:pPr'))
+                etree.SubElement(p_pr, qn('w:jc'), {qn('w:val'): align})
+            
+            r_pr = None
+            if bold or italic:
+                r_pr = etree.Element(qn('w:rPr'))
+                if bold:
+                    etree.SubElement(r_pr, qn('w:b'))
+                if italic:
+                    etree.SubElement(r_pr, qn('w:i'))
+            
+            props = self._props[key] = (tc_pr, p_pr, r_pr)
+        return props
+
+
+def _append_run_text(r, text: str):
+    """Текст прогона по правилам python-docx: табуляция — w:tab, перевод строки — w:br"""
+    for chunk in _RUN_BREAKS.split(text):
+        if not chunk:
+            continue
+        if chunk == "\t":
+            etree.SubElement(r, qn('w:tab'))
+        elif chunk in "\r\n":
+            etree.SubElement(r, qn('w:br'))
+        else:
+            t = etree.SubElement(r, qn('w:t'))
+            t.text = chunk
+            if len(chunk.strip()) < len(chunk):
+                t.set(qn('xml:space'), 'preserve')
+
+
+def export_to_word(estimate, filename: Union[str, Path, BinaryIO] = None,
+                   report: ReportModel = None) -> Union[Path, BinaryIO]:
+    """Экспортировать смету в Word
+    
+    filename: путь к файлу или записываемый двоичный поток (например, BytesIO) —
+    в поток документ пишется без обращения к диску, и возвращается сам поток
+    report: готовая модель отчёта (build_report); если не передана, строится здесь
+    """
     
     if filename is None:
         filename = f"Смета_{estimate.project_name}_{estimate.date_created}.docx"
+    if report is None:
+        report = build_report(estimate)
     
-    output_path = Path(filename)
+    output_path = filename if hasattr(filename, "write") else Path(filename)
     
     doc = Document()
     
@@ -68,237 +186,64 @@ def export_to_word(estimate, filename: str = None) -> Path:
     
     doc.add_paragraph()
     
-    # Основная таблица сметы — группируем по категориям
-    categories = {
-        "field": {"name": "ПОЛЕВЫЕ РАБОТЫ", "items": []},
-        "laboratory": {"name": "ЛАБОРАТОРНЫЕ РАБОТЫ", "items": []},
-        "office": {"name": "КАМЕРАЛЬНЫЕ РАБОТЫ", "items": []}
-    }
-    
-    for item in estimate.items:
-        if item.code.startswith(("01", "02", "03", "04")):
-            categories["field"]["items"].append(item)
-        elif item.code.startswith(("05", "06", "07")):
-            categories["laboratory"]["items"].append(item)
-        else:
-            categories["office"]["items"].append(item)
-    
-    # Подсчитываем количество строк
-    total_rows = 1  # Заголовок таблицы
-    for cat_data in categories.values():
-        if cat_data["items"]:
-            total_rows += 1  # Заголовок раздела
-            total_rows += len(cat_data["items"])
-            total_rows += 1  # Подитог
-    
-    # ДЗ строки
-    dz_costs = estimate.additional_costs or []
-    total_rows += 1  # Итого базовые
-    if dz_costs:
-        total_rows += 1  # Заголовок "Дополнительные затраты"
-        total_rows += len(dz_costs)
-        total_rows += 1  # Итого с ДЗ
-    
-    total_rows += 1  # Итого с индексом
-    if float(estimate.contract_coefficient) != 1.0:
-        total_rows += 1  # Кдог
-    total_rows += 1  # ВСЕГО
-    
-    table = doc.add_table(rows=total_rows, cols=7)
+    # Основная таблица сметы
+    table = doc.add_table(rows=0, cols=len(COLUMN_WIDTHS))
     table.style = 'Table Grid'
     table.alignment = WD_TABLE_ALIGNMENT.CENTER
-    
-    # Ширина колонок
-    widths = [Cm(1), Cm(1.5), Cm(7), Cm(1.5), Cm(1.5), Cm(2), Cm(2.5)]
-    for i, width in enumerate(widths):
-        for cell in table.columns[i].cells:
-            cell.width = width
+    rows = TableRowBuilder(table._tbl)
     
     # Заголовок таблицы
     headers = ["№", "Код", "Наименование работ", "Ед.", "Кол-во", "Цена", "Сумма"]
-    header_row = table.rows[0]
-    for i, header in enumerate(headers):
-        cell = header_row.cells[i]
-        cell.text = header
-        cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-        cell.paragraphs[0].runs[0].bold = True
-        set_cell_shading(cell, 'D9D9D9')
-    
-    current_row = 1
-    item_num = 1
+    rows.add([(header, 1, "header") for header in headers])
     
-    for cat_key, cat_data in categories.items():
-        if not cat_data["items"]:
-            continue
-        
+    for section in report.sections:
         # Заголовок раздела
-        row = table.rows[current_row]
-        row.cells[0].merge(row.cells[6])
-        row.cells[0].text = cat_data["name"]
-        row.cells[0].paragraphs[0].runs[0].bold = True
-        set_cell_shading(row.cells[0], 'E0E0E0')
-        current_row += 1
+        rows.add([(section.name, 7, "section")])
         
-        # Позиции
-        for item in cat_data["items"]:
-            row = table.rows[current_row]
-            row.cells[0].text = str(item_num)
-            row.cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
-            row.cells[1].text = item.code
-            row.cells[2].text = item.name
-            row.cells[3].text = item.unit
-            row.cells[3].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
-            row.cells[4].text = f"{float(item.quantity):.1f}"
-            row.cells[4].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-            
-            # Для рекогносцировки — показываем формулу
-            if float(item.pz1p_fixed) > 0:
-                pz1p = float(item.pz1p_fixed)
-                pz2p = float(item.base_cost)
-                row.cells[5].text = f"ПЗ1п({pz1p:,.0f})+ПЗ2п({pz2p:,.0f})"
-            else:
-                row.cells[5].text = f"{float(item.unit_cost):,.0f}"
-            row.cells[5].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-            
-            row.cells[6].text = f"{float(item.total_cost):,.0f}"
-            row.cells[6].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-            
-            item_num += 1
-            current_row += 1
+        # Позиции (для рекогносцировки в цене — формула ПЗ1п + ПЗ2п)
+        for entry in section.items:
+            rows.add([
+                (str(entry.num), 1, "center"),
+                (entry.item.code, 1, "text"),
+                (entry.item.name, 1, "text"),
+                (entry.item.unit, 1, "center"),
+                (entry.quantity_text, 1, "right"),
+                (entry.price_text, 1, "right"),
+                (entry.total_text, 1, "right"),
+            ])
         
         # Подитог раздела
-        subtotal = sum(float(item.total_cost) for item in cat_data["items"])
-        row = table.rows[current_row]
-        row.cells[0].merge(row.cells[5])
-        row.cells[0].text = f"Итого {cat_data['name'].lower()}:"
-        row.cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        row.cells[0].paragraphs[0].runs[0].bold = True
-        
-        row.cells[6].text = f"{subtotal:,.0f}"
-        row.cells[6].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        row.cells[6].paragraphs[0].runs[0].bold = True
-        
-        set_cell_shading(row.cells[0], 'FFF3E0')
-        set_cell_shading(row.cells[6], 'FFF3E0')
-        current_row += 1
+        rows.add_total(f"Итого {section.name.lower()}:", section.subtotal, "total_subtotal")
     
     # Итого базовые
-    base_total = sum(float(item.total_cost) for item in estimate.items)
-    row = table.rows[current_row]
-    row.cells[0].merge(row.cells[5])
-    row.cells[0].text = "ИТОГО базовые затраты (СП + СЛ + СК):"
-    row.cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    row.cells[0].paragraphs[0].runs[0].bold = True
-    
-    row.cells[6].text = f"{base_total:,.0f}"
-    row.cells[6].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    row.cells[6].paragraphs[0].runs[0].bold = True
-    
-    set_cell_shading(row.cells[0], 'E8F5E9')
-    set_cell_shading(row.cells[6], 'E8F5E9')
-    current_row += 1
+    rows.add_total("ИТОГО базовые затраты (СП + СЛ + СК):", report.base_total, "total_base")
     
     # Дополнительные затраты
-    dz_sum = 0
-    if dz_costs:
-        row = table.rows[current_row]
-        row.cells[0].merge(row.cells[6])
-        row.cells[0].text = "Дополнительные затраты:"
-        row.cells[0].paragraphs[0].runs[0].bold = True
-        row.cells[0].paragraphs[0].runs[0].italic = True
-        current_row += 1
+    if report.dz_rows:
+        rows.add([("Дополнительные затраты:", 7, "dz_title")])
         
-        for dz_num, cost in enumerate(dz_costs, 1):
-            row = table.rows[current_row]
-            
-            row.cells[0].text = f"ДЗ-{dz_num}"
-            row.cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
-            row.cells[1].merge(row.cells[2])
-            row.cells[1].text = cost.get('name', 'ДЗ')
-            
-            row.cells[3].merge(row.cells[4])
-            row.cells[3].text = cost.get('basis', '-')
-            
-            row.cells[5].text = cost.get('formula', '-')
-            row.cells[5].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-            
-            val = round(float(cost.get('value', 0)), 2)
-            dz_sum += val
-            row.cells[6].text = f"{val:,.0f}"
-            row.cells[6].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-            
-            current_row += 1
+        for dz in report.dz_rows:
+            rows.add([
+                (dz.label, 1, "center"),
+                (dz.cost.get('name', 'ДЗ'), 2, "text"),
+                (dz.cost.get('basis', '-'), 2, "text"),
+                (dz.cost.get('formula', '-'), 1, "right"),
+                (dz.value_text, 1, "right"),
+            ])
         
         # Итого с ДЗ
-        total_with_dz = round(base_total + dz_sum, 2)
-        row = table.rows[current_row]
-        row.cells[0].merge(row.cells[5])
-        row.cells[0].text = "ИТОГО с учётом дополнительных затрат:"
-        row.cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        row.cells[0].paragraphs[0].runs[0].bold = True
-        
-        row.cells[6].text = f"{total_with_dz:,.0f}"
-        row.cells[6].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        row.cells[6].paragraphs[0].runs[0].bold = True
-        
-        set_cell_shading(row.cells[0], 'FFF3E0')
-        set_cell_shading(row.cells[6], 'FFF3E0')
-        current_row += 1
-    else:
-        total_with_dz = base_total
+        rows.add_total("ИТОГО с учётом дополнительных затрат:", report.total_with_dz, "total_subtotal")
     
     # С индексом пересчёта
-    idx = float(estimate.price_index)
-    total_indexed = round(total_with_dz * idx, 2)
-    
-    row = table.rows[current_row]
-    row.cells[0].merge(row.cells[5])
-    row.cells[0].text = f"ИТОГО с индексом пересчёта ({idx:.2f}):"
-    row.cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    row.cells[0].paragraphs[0].runs[0].bold = True
-    
-    row.cells[6].text = f"{total_indexed:,.0f}"
-    row.cells[6].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    row.cells[6].paragraphs[0].runs[0].bold = True
-    
-    set_cell_shading(row.cells[0], 'E8F5E9')
-    set_cell_shading(row.cells[6], 'E8F5E9')
-    current_row += 1
+    rows.add_total(f"ИТОГО с индексом пересчёта ({report.price_index:.2f}):", report.total_indexed, "total_base")
     
     # Коэффициент договорной цены
-    k_contract = float(estimate.contract_coefficient)
-    if k_contract != 1.0:
-        final_total = round(total_indexed * k_contract, 2)
-        
-        row = table.rows[current_row]
-        row.cells[0].merge(row.cells[5])
-        row.cells[0].text = f"Коэффициент договорной цены ({k_contract:.3f}):"
-        row.cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        row.cells[0].paragraphs[0].runs[0].bold = True
-        
-        row.cells[6].text = f"{final_total:,.0f}"
-        row.cells[6].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        row.cells[6].paragraphs[0].runs[0].bold = True
-        current_row += 1
-    else:
-        final_total = total_indexed
+    if report.has_contract_coefficient:
+        rows.add_total(f"Коэффициент договорной цены ({report.contract_coefficient:.3f}):",
+                       report.final_total, "total")
     
     # ВСЕГО ПО СМЕТЕ
-    row = table.rows[current_row]
-    row.cells[0].merge(row.cells[5])
-    row.cells[0].text = "ВСЕГО по смете:"
-    row.cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    row.cells[0].paragraphs[0].runs[0].bold = True
-    
-    row.cells[6].text = f"{final_total:,.0f}"
-    row.cells[6].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    row.cells[6].paragraphs[0].runs[0].bold = True
-    
-    set_cell_shading(row.cells[0], 'C8E6C9')
-    set_cell_shading(row.cells[6], 'C8E6C9')
+    rows.add_total("ВСЕГО по смете:", report.final_total, "total_grand")
     
     # Подписи
     doc.add_paragraph()
@@ -0,0 +1,121 @@
+"""
+Обоснования объёмов работ: предварительно связанный индекс шаблон → работа → обоснование
+"""
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from modules.calculator import load_json
+
+
+# Пояснения к ДЗ из НЗ по типу ДЗ (ключ "type" в записи ДЗ)
+DZ_COMMENTS = {
+    "regime": "п.26-27 НЗ: при работе на объектах с режимным доступом (жел. дороги, автодороги, аэродромы, электростанции и пр.) — 25% от СПпз",
+    "travel": "п.28-36 НЗ: расходы на проезд работников до объекта и обратно. Процент зависит от расстояния (км) и стоимости полевых работ. Таблицы 4-7 НЗ.",
+    "organization": "п.37-39 НЗ, ф.(9): расходы на организацию и ликвидацию полевых работ (мобилизация, аренда, логистика оборудования). Таблица 8 НЗ.",
+    "regional_field": "п.40 НЗ, ф.(10): доплаты работникам за работу в районах с особыми климатическими условиями (районный коэффициент > 1.0). Приложение к НЗ.",
+    "regional_lab": "п.40 НЗ, ф.(10): доплаты работникам за работу в районах с особыми климатическими условиями (районный коэффициент > 1.0). Приложение к НЗ.",
+    "unfavorable": "п.21 НЗ, ф.(4): надбавка за производство работ в неблагоприятный климатический период (зима, дожди). Таблица 3 НЗ.",
+}
+
+# Для записей ДЗ без "type" (сохранённые ранее сметы) — поиск по фрагменту названия
+_DZ_NAME_KEYWORDS = (
+    ("перерывы", "regime"),
+    ("проезд", "travel"),
+    ("организаци", "organization"),
+    ("районные", "regional_field"),
+    ("неблагопр", "unfavorable"),
+)
+
+# Отчёт и программа в смете подменяются по Таблицам 65/66, поэтому
+# их обоснование ищется по группе работы, а не по точному ID
+_GROUP_ALIASES = ("report", "program")
+
+
+@dataclass
+class JustificationIndex:
+    """Обоснования объёмов, связанные с позициями шаблонов при загрузке"""
+    by_template: dict = field(default_factory=dict)  # {template_id: {work_id | "@group": запись}}
+    missing: dict = field(default_factory=dict)      # {template_id: [work_id]} без обоснования
+    work_groups: dict = field(default_factory=dict)  # {work_id: group}
+
+    def get(self, template_id: str, work_id: str) -> dict:
+        """Запись обоснования {"qty_basis", "qty_note"} или {}"""
+        records = self.by_template.get(template_id)
+        if not records:
+            return {}
+        record = records.get(work_id)
+        if record is None:
+            group = self.work_groups.get(work_id, "")
+            record = records.get(f"@{group}", {}) if group in _GROUP_ALIASES else {}
+        return record
+
+    def for_item(self, item, template_id: str = None) -> dict:
+        """Обоснование позиции сметы с учётом шаблонов-источников.
+
+        Позиция, собранная из нескольких шаблонов, получает обоснование
+        каждого источника с пометкой шаблона; позиция без источников —
+        обоснование шаблона сметы.
+        """
+        work_id = getattr(item, "work_id", None) or item.code
+        template_ids = [s["template_id"] for s in getattr(item, "sources", []) if s.get("template_id")]
+        records = [
+            (tid, self.get(tid, work_id))
+            for tid in dict.fromkeys(template_ids or [template_id])
+        ]
+        records = [(tid, record) for tid, record in records if record]
+        if len(records) <= 1:
+            return records[0][1] if records else {}
+        return {
+            "qty_basis": "; ".join(dict.fromkeys(r.get("qty_basis", "") for _, r in records if r.get("qty_basis"))),
+            "qty_note": "\n".join(f"[{tid}] {r.get('qty_note', '')}" for tid, r in records),
+        }
+
+    def dz_comment(self, cost: dict) -> str:
+        """Пояснение к строке ДЗ по её типу"""
+        dz_type = cost.get("type")
+        if dz_type is None:
+            name_lc = cost.get("name", "").lower()
+            dz_type = next((t for keyword, t in _DZ_NAME_KEYWORDS if keyword in name_lc), None)
+        return DZ_COMMENTS.get(dz_type, "—")
+
+
+def build_justification_index(templates: list, justifications: dict, work_types: list) -> JustificationIndex:
+    """Связать позиции шаблонов с обоснованиями и собрать список пропусков"""
+    index = JustificationIndex(work_groups={w["id"]: w.get("group", "") for w in work_types})
+
+    for template in templates:
+        template_id = template["id"]
+        source = justifications.get(template_id, {})
+        records = {}
+        for work_id, record in source.items():
+            if work_id.startswith("_") or not isinstance(record, dict):
+                continue
+            records[work_id] = record
+            group = index.work_groups.get(work_id, "")
+            if group in _GROUP_ALIASES:
+                records.setdefault(f"@{group}", record)
+        index.by_template[template_id] = records
+
+        missing = [
+            item["work_id"] for item in template.get("items", [])
+            if not index.get(template_id, item["work_id"])
+        ]
+        if missing:
+            index.missing[template_id] = missing
+
+    return index
+
+
+@lru_cache(maxsize=1)
+def get_justification_index() -> JustificationIndex:
+    """Индекс обоснований (строится один раз на процесс вместе со справочниками)"""
+    try:
+        justifications = load_json("normative_justifications.json").get("template_justifications", {})
+    except Exception:
+        justifications = {}
+    return build_justification_index(
+        load_json("templates.json").get("templates", []),
+        justifications,
+        load_json("work_types.json").get("work_types", []),
+    )
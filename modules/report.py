@@ -0,0 +1,173 @@
+"""
+Модель отчёта по смете: разделы, нумерация, итоги и ДЗ
+
+Группировка позиций и вся арифметика итогов выполняются один раз на смету
+в build_report(); экспорт в Excel, PDF и Word только выводит готовую модель,
+поэтому итоги во всех форматах совпадают.
+"""
+
+from dataclasses import dataclass, field
+
+
+# Разделы сметы в порядке вывода
+CATEGORY_NAMES = {
+    "field": "ПОЛЕВЫЕ РАБОТЫ",
+    "laboratory": "ЛАБОРАТОРНЫЕ РАБОТЫ",
+    "office": "КАМЕРАЛЬНЫЕ РАБОТЫ",
+}
+
+
+def group_items(items) -> dict:
+    """Разложить позиции по разделам (по коду работы)"""
+    categories = {cat_key: {"name": name, "items": []} for cat_key, name in CATEGORY_NAMES.items()}
+    for item in items:
+        if item.code.startswith(("01", "02", "03", "04")):
+            categories["field"]["items"].append(item)
+        elif item.code.startswith(("05", "06", "07")):
+            categories["laboratory"]["items"].append(item)
+        else:
+            categories["office"]["items"].append(item)
+    return categories
+
+
+def money(value: float) -> str:
+    """Сумма в рублях для текстовых форматов: 1,234,567"""
+    return f"{value:,.0f}"
+
+
+@dataclass
+class ReportItem:
+    """Строка позиции: номер по порядку, исходная позиция и готовые значения"""
+    num: int
+    item: object                # WorkItem
+    quantity: float
+    base_cost: float
+    unit_cost: float
+    total_cost: float
+    pz1p_fixed: float
+    quantity_text: str          # "12.0"
+    unit_cost_text: str         # цена за единицу
+    price_text: str             # цена за единицу или «ПЗ1п(..)+ПЗ2п(..)» для рекогносцировки
+    total_text: str
+
+
+@dataclass
+class ReportSection:
+    """Раздел сметы (полевые, лабораторные, камеральные работы)"""
+    key: str
+    name: str
+    items: list = field(default_factory=list)   # [ReportItem]
+    subtotal: float = 0.0
+
+    @property
+    def subtotal_text(self) -> str:
+        return money(self.subtotal)
+
+
+@dataclass
+class ReportDZ:
+    """Строка дополнительных затрат"""
+    num: int
+    cost: dict                  # исходная запись ДЗ
+    value: float                # сумма, округлённая до копеек
+
+    @property
+    def label(self) -> str:
+        return f"ДЗ-{self.num}"
+
+    @property
+    def value_text(self) -> str:
+        return money(self.value)
+
+
+@dataclass
+class ReportModel:
+    """Смета, подготовленная к выводу в любой формат"""
+    sections: list = field(default_factory=list)    # [ReportSection], только непустые
+    dz_rows: list = field(default_factory=list)     # [ReportDZ]
+    base_total: float = 0.0         # СП + СЛ + СК
+    dz_sum: float = 0.0             # сумма ДЗ
+    total_with_dz: float = 0.0      # базовые + ДЗ
+    price_index: float = 1.0
+    total_indexed: float = 0.0      # с индексом пересчёта
+    contract_coefficient: float = 1.0
+    final_total: float = 0.0        # ВСЕГО по смете
+
+    @property
+    def has_contract_coefficient(self) -> bool:
+        return self.contract_coefficient != 1.0
+
+    @property
+    def item_count(self) -> int:
+        return sum(len(section.items) for section in self.sections)
+
+    def canonical(self) -> dict:
+        """Модель в виде словаря для json.dumps(default=str) — основа ключа кэша документов.
+
+        Производные значения позиций (суммы, тексты) выводятся из полей
+        позиции, поэтому в словарь входят только сами позиции.
+        """
+        return {
+            "sections": [
+                {
+                    "key": section.key,
+                    "name": section.name,
+                    "subtotal": section.subtotal,
+                    "items": [(entry.num, vars(entry.item)) for entry in section.items],
+                }
+                for section in self.sections
+            ],
+            "dz_rows": [(dz.num, dz.cost, dz.value) for dz in self.dz_rows],
+            "totals": (self.base_total, self.dz_sum, self.total_with_dz, self.price_index,
+                       self.total_indexed, self.contract_coefficient, self.final_total),
+        }
+
+
+def build_report(estimate) -> ReportModel:
+    """Собрать модель отчёта по смете (группировка и итоги — один раз)"""
+    report = ReportModel(
+        price_index=float(estimate.price_index),
+        contract_coefficient=float(estimate.contract_coefficient),
+    )
+
+    item_num = 1
+    for cat_key, cat_data in group_items(estimate.items).items():
+        if not cat_data["items"]:
+            continue
+        section = ReportSection(key=cat_key, name=cat_data["name"])
+        for item in cat_data["items"]:
+            quantity = float(item.quantity)
+            base_cost = float(item.base_cost)
+            unit_cost = float(item.unit_cost)
+            total_cost = float(item.total_cost)
+            pz1p_fixed = float(item.pz1p_fixed) if hasattr(item, 'pz1p_fixed') else 0.0
+            unit_cost_text = money(unit_cost)
+            section.items.append(ReportItem(
+                num=item_num,
+                item=item,
+                quantity=quantity,
+                base_cost=base_cost,
+                unit_cost=unit_cost,
+                total_cost=total_cost,
+                pz1p_fixed=pz1p_fixed,
+                quantity_text=f"{quantity:.1f}",
+                unit_cost_text=unit_cost_text,
+                price_text=(f"ПЗ1п({pz1p_fixed:,.0f})+ПЗ2п({base_cost:,.0f})"
+                            if pz1p_fixed > 0 else unit_cost_text),
+                total_text=money(total_cost),
+            ))
+            item_num += 1
+        section.subtotal = sum(row.total_cost for row in section.items)
+        report.sections.append(section)
+
+    # Итоги — в порядке позиций сметы, как их считает калькулятор
+    report.base_total = sum(float(item.total_cost) for item in estimate.items)
+
+    for dz_num, cost in enumerate(estimate.additional_costs or [], 1):
+        report.dz_rows.append(ReportDZ(num=dz_num, cost=cost, value=round(float(cost.get('value', 0)), 2)))
+    report.dz_sum = sum(row.value for row in report.dz_rows)
+
+    report.total_with_dz = round(report.base_total + report.dz_sum, 2)
+    report.total_indexed = round(report.total_with_dz * report.price_index, 2)
+    report.final_total = round(report.total_indexed * report.contract_coefficient, 2)
+    return report
@@ -0,0 +1,145 @@
+"""
+Обратный расчёт: подбор значения параметра под целевую итоговую стоимость
+"""
+
+from dataclasses import dataclass
+
+from modules.additional_costs import calculate_additional_costs
+
+
+# Границы кусков, на которых итог линеен (или постоянен) по расстоянию:
+# границы диапазонов Таблиц 4-8 НЗ и опорные точки интерполяции (п.160, прим. 3)
+DISTANCE_BREAKPOINTS = (100, 200, 350, 500, 750, 1000, 1500, 2000, 3000, 4000, 5000)
+
+# Параметры, доступные для подбора:
+# (ключ в project_info, мин., макс., точки излома, точность по параметру)
+SOLVER_PARAMETERS = {
+    "k_contract": ("k_contract", 0.001, 10.0, (), 1e-6),
+    "price_index": ("price_index", 0.01, 100.0, (), 1e-6),
+    "distance_km": ("distance_km", 0.0, 5000.0, DISTANCE_BREAKPOINTS, 0.01),
+}
+
+# Точность совпадения итога с целевым значением, руб.
+TOTAL_TOLERANCE = 0.01
+
+
+@dataclass
+class SolveResult:
+    """Результат подбора параметра"""
+    parameter: str
+    value: float
+    total: float
+    target: float
+    evaluations: int
+    exact: bool
+    reachable: bool = True  # False — даже при минимальном значении итог выше цели
+
+
+class InverseSolver:
+    """Подбор параметра сметы (Кдог, индекс, расстояние) под целевой итог.
+
+    Итог = (СП + СЛ + СК + ДЗ) × Индекс × Кдог. Базовые затраты от подбираемых
+    параметров не зависят и считаются один раз, ДЗ пересчитываются только для
+    новых значений параметра (результаты кэшируются).
+
+    Между соседними точками излома итог линеен (или постоянен), поэтому поиск
+    идёт в два этапа: выбор отрезка по значениям в точках излома (их не больше
+    дюжины, таблицы НЗ не везде монотонны), затем секущая внутри отрезка
+    с бисекцией в качестве запасного варианта.
+    """
+
+    def __init__(self, calc, estimate, project_info: dict):
+        self.calc = calc
+        self.project_info = dict(project_info)
+        self.base_total = float(estimate.base_total)
+        self.field_cost = float(estimate.subtotal_field)
+        self.lab_cost = float(estimate.subtotal_laboratory)
+        self._cache = {}
+        self.evaluations = 0
+
+    def total(self, parameter: str, value: float) -> float:
+        """Итоговая стоимость при заданном значении параметра (с кэшированием)"""
+        key = (parameter, float(value))
+        if key in self._cache:
+            return self._cache[key]
+
+        info_key = SOLVER_PARAMETERS[parameter][0]
+        info = dict(self.project_info)
+        info[info_key] = value
+
+        dz_list = calculate_additional_costs(self.calc, self.field_cost, info, lab_cost=self.lab_cost)
+        dz_sum = sum(item["value"] for item in dz_list)
+        pi = float(info.get("price_index", 1.0))
+        kc = float(info.get("k_contract", 1.0))
+        result = (self.base_total + dz_sum) * pi * kc
+
+        self._cache[key] = result
+        self.evaluations += 1
+        return result
+
+    def solve(self, parameter: str, target: float, lo: float = None, hi: float = None,
+              tol: float = None, max_iter: int = 100) -> SolveResult:
+        """Найти наибольшее значение параметра, при котором итог не превышает target.
+
+        Если итог выше target даже на нижней границе, возвращается нижняя
+        граница с reachable=False.
+
+        Args:
+            parameter: "k_contract", "price_index" или "distance_km"
+            target: целевая итоговая стоимость, руб.
+            lo, hi: границы поиска (по умолчанию — из SOLVER_PARAMETERS)
+            tol: точность по значению параметра (по умолчанию — из SOLVER_PARAMETERS)
+        """
+        if parameter not in SOLVER_PARAMETERS:
+            raise ValueError(f"Неизвестный параметр: {parameter}")
+
+        _, default_lo, default_hi, breakpoints, default_tol = SOLVER_PARAMETERS[parameter]
+        lo = default_lo if lo is None else float(lo)
+        hi = default_hi if hi is None else float(hi)
+        tol = default_tol if tol is None else tol
+        start_evaluations = self.evaluations
+
+        def f(x):
+            return self.total(parameter, x)
+
+        def result(x, exact, reachable=True):
+            return SolveResult(
+                parameter=parameter,
+                value=x,
+                total=f(x),
+                target=target,
+                evaluations=self.evaluations - start_evaluations,
+                exact=exact,
+                reachable=reachable,
+            )
+
+        # 1. Выбор отрезка: самая правая точка излома с f(a) <= target < f(b)
+        points = [lo] + [p for p in breakpoints if lo < p < hi] + [hi]
+        k = next((k for k in range(len(points) - 1, -1, -1) if f(points[k]) <= target), None)
+        if k is None:
+            # Цель недостижима — даже минимальное значение даёт больший итог
+            return result(lo, False, reachable=False)
+        if k == len(points) - 1:
+            return result(hi, abs(f(hi) - target) <= TOTAL_TOLERANCE)
+        a, b = points[k], points[k + 1]
+
+        # 2. Секущая внутри отрезка (итог на [a, b) линеен)
+        mid = (a + b) / 2
+        if f(mid) != f(a):
+            x = a + (target - f(a)) * (mid - a) / (f(mid) - f(a))
+            if a <= x < b and abs(f(x) - target) <= TOTAL_TOLERANCE:
+                return result(x, True)
+
+        # 3. Запасной вариант — бисекция (ступеньки, округления)
+        for _ in range(max_iter):
+            if b - a <= tol:
+                break
+            m = (a + b) / 2
+            if f(m) <= target:
+                a = m
+            else:
+                b = m
+            if abs(f(a) - target) <= TOTAL_TOLERANCE:
+                break
+
+        return result(a, abs(f(a) - target) <= TOTAL_TOLERANCE)
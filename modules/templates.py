@@ -0,0 +1,218 @@
+"""
+Шаблоны смет: предрасчёт стоимости в замкнутой форме
+"""
+
+import hashlib
+import json
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+
+from modules.calculator import load_json
+
+
+SECTIONS = ("field", "laboratory", "office")
+
+# Группы, которые входят в смету один раз (Таблицы 65/66): при объединении
+# шаблонов их объёмы не складываются, берётся наибольший
+SINGLETON_GROUPS = ("report", "program")
+
+
+def load_templates() -> dict:
+    """Загрузка шаблонов смет"""
+    return load_json("templates.json")
+
+
+def is_scalable(item: dict) -> bool:
+    """Объём позиции умножается на количество опор / км трассы"""
+    return bool(item.get("per_support") or item.get("per_km"))
+
+
+def template_version(template: dict) -> str:
+    """Версия шаблона — хэш его содержимого (ключ для кэшей подробностей)"""
+    payload = json.dumps(template, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def template_detail_rows(calc, template: dict) -> list:
+    """Строки «Состава работ» шаблона: наименование, ссылка на НЗ, ед., объём"""
+    rows = []
+    for item in template.get("items", []):
+        work_info = calc.get_work_type(item["work_id"])
+        rows.append({
+            "work_name": work_info.get("name", item["work_id"]),
+            "description": item.get("description", ""),
+            "table_ref": work_info.get("table_ref", item.get("nz_ref", "")),
+            "unit": work_info.get("unit", "ед."),
+            "quantity": item["quantity"],
+            "scalable": is_scalable(item),
+            "group": work_info.get("group", ""),
+        })
+    return rows
+
+
+@dataclass
+class TemplateCostModel:
+    """Стоимость шаблона как линейная функция множителя m (опоры, км).
+
+    Каждый раздел: fixed + per_unit × m. Отчёт (Таблица 65) и программа
+    (Таблица 66) выводятся из разделов и площади рекогносцировки при данном
+    множителе, а не берутся из позиций шаблона.
+    """
+    template_id: str
+    complexity: str = "II"
+    multiplier_kind: str = ""                       # "per_support", "per_km" или ""
+    sections: dict = field(default_factory=dict)    # {раздел: (fixed, per_unit)}
+    item_costs: list = field(default_factory=list)  # [(fixed, per_unit)] по позициям шаблона
+    has_report: bool = False
+    recon_area: tuple = (0.0, 0.0)                  # площадь рекогносцировки, га: (fixed, per_unit)
+    regime_percent: float = 0.0
+
+    def section_cost(self, section: str, multiplier: float = 1) -> float:
+        fixed, per_unit = self.sections.get(section, (0.0, 0.0))
+        return fixed + per_unit * multiplier
+
+    def item_cost(self, index: int, multiplier: float = 1) -> float:
+        fixed, per_unit = self.item_costs[index]
+        return fixed + per_unit * multiplier
+
+    def program_work(self, calc, multiplier: float = 1, max_depth: str = "10") -> Optional[dict]:
+        """Программа по Таблице 66 — так же, как при расчёте сметы (площадь × глубина)"""
+        fixed, per_unit = self.recon_area
+        return calc.get_program_work(fixed + per_unit * multiplier, max_depth) or None
+
+    def preview(self, calc, multiplier: float = 1, max_depth: str = "10") -> dict:
+        """Предварительный расчёт шаблона при заданном множителе и глубине (без ДЗ, кроме ДЗрежим)"""
+        costs = {section: self.section_cost(section, multiplier) for section in SECTIONS}
+        report = 0.0
+        if self.has_report:
+            report, _, _ = calc.calculate_report_cost(costs["office"], self.complexity)
+        program_work = self.program_work(calc, multiplier, max_depth)
+        program = float(calc.get_base_cost(program_work["id"])) if program_work else 0.0
+        base_total = sum(costs.values()) + report + program
+        regime_surcharge = costs["field"] * self.regime_percent / 100
+        return {
+            **costs,
+            "report": report,
+            "program": program,
+            "program_work_id": program_work["id"] if program_work else None,
+            "base_total": base_total,
+            "regime_surcharge": regime_surcharge,
+            "total_with_regime": base_total + regime_surcharge,
+        }
+
+
+def compile_template(calc, template: dict) -> TemplateCostModel:
+    """Свернуть позиции шаблона в TemplateCostModel (один проход по позициям)"""
+    model = TemplateCostModel(
+        template_id=template["id"],
+        complexity=template.get("default_params", {}).get("complexity", "II"),
+    )
+    sections = {section: [0.0, 0.0] for section in SECTIONS}
+
+    for item in template.get("items", []):
+        work_id = item["work_id"]
+        work_info = calc.get_work_type(work_id)
+        group = work_info.get("group", "")
+        qty = item["quantity"]
+        scalable = is_scalable(item)
+        if scalable and not model.multiplier_kind:
+            model.multiplier_kind = "per_support" if item.get("per_support") else "per_km"
+
+        # Рекогносцировка — двухкомпонентная (п.49, ф.16): ПЗ1п не масштабируется
+        if calc.is_reconnaissance(work_id):
+            pz1p, pz2p = calc.get_reconnaissance_components(work_id)
+            fixed, variable = float(pz1p), float(pz2p) * qty
+            if model.recon_area == (0.0, 0.0):
+                model.recon_area = (0.0, float(qty)) if scalable else (float(qty), 0.0)
+        else:
+            fixed, variable = 0.0, float(calc.get_base_cost(work_id)) * qty
+
+        if scalable:
+            cost = (fixed, variable)
+        else:
+            cost = (fixed + variable, 0.0)
+        model.item_costs.append(cost)
+
+        if group == "report":
+            model.has_report = True
+            continue
+        if group == "program":
+            continue
+        section = sections[work_info.get("category", "field")]
+        section[0] += cost[0]
+        section[1] += cost[1]
+
+    model.sections = {section: tuple(parts) for section, parts in sections.items()}
+
+    for add_cost in template.get("additional_costs", []):
+        if add_cost.get("type") == "regime_surcharge":
+            model.regime_percent = float(add_cost.get("percent", 0))
+
+    return model
+
+
+def compile_templates(calc, templates: list) -> dict:
+    """Скомпилировать все шаблоны: {template_id: TemplateCostModel}"""
+    return {template["id"]: compile_template(calc, template) for template in templates}
+
+
+def merge_key(calc, item_data: dict) -> tuple:
+    """Ключ объединения позиций: вид работ, набор доп. коэффициентов и ручная расценка.
+
+    Отчёт и программа пересчитываются по Таблицам 65/66 (с подменой work_id),
+    поэтому объединяются по группе.
+    """
+    group = calc.get_work_type(item_data["work_id"]).get("group", "")
+    if group in SINGLETON_GROUPS:
+        return (f"@{group}",)
+    coefficients = item_data.get("additional_coefficients") or {}
+    return (item_data["work_id"], frozenset(coefficients.items()), item_data.get("override_base_cost"))
+
+
+def compose_templates(calc, parts: list, base_items: list = None) -> list:
+    """Объединить несколько шаблонов (и, при необходимости, текущую смету) в одну.
+
+    Позиции агрегируются по merge_key через словарь, поэтому объединение
+    линейно по общему числу позиций. Для каждой позиции сохраняется список
+    источников {"template_id", "quantity"} — по нему подбираются обоснования
+    объёмов при экспорте.
+
+    Args:
+        parts: [(шаблон, множитель)] — множитель применяется к per_support / per_km позициям
+        base_items: позиции текущей сметы (идут первыми, их uid и формулы сохраняются)
+
+    Returns:
+        список словарей позиций в формате st.session_state.estimate_items
+    """
+    merged = {}
+
+    def add(item_data: dict, sources: list):
+        key = merge_key(calc, item_data)
+        entry = merged.get(key)
+        if entry is None:
+            entry = merged[key] = {
+                **item_data,
+                "additional_coefficients": dict(item_data.get("additional_coefficients") or {}),
+                "uid": item_data.get("uid") or str(uuid.uuid4())[:8],
+                "sources": list(sources),
+            }
+            return
+        if key[0].startswith("@"):
+            entry["quantity"] = max(entry["quantity"], item_data["quantity"])
+        else:
+            entry["quantity"] += item_data["quantity"]
+        entry["sources"].extend(sources)
+
+    for item_data in base_items or []:
+        add(item_data, item_data.get("sources", []))
+
+    for template, multiplier in parts:
+        for item in template.get("items", []):
+            qty = item["quantity"] * multiplier if is_scalable(item) else item["quantity"]
+            add(
+                {"work_id": item["work_id"], "quantity": qty},
+                [{"template_id": template["id"], "quantity": qty}],
+            )
+
+    return list(merged.values())
@@ -30,11 +30,11 @@ def run_tests():
         print(f"Получено: {float(item.total_cost)}\n")
     
     print("=== ТЕСТ 2: Технический отчёт (Таблица 65) ===")
-    cost, desc = calc.calculate_report_cost(45000, "II")
+    cost, desc, _ = calc.calculate_report_cost(45000, "II")
     print(f"Камералка 45 тыс., Категория II -> {cost} руб. ({desc})")
-    cost, desc = calc.calculate_report_cost(800000, "I")
+    cost, desc, _ = calc.calculate_report_cost(800000, "I")
     print(f"Камералка 800 тыс., Категория I -> {cost} руб. ({desc})")
-    cost, desc = calc.calculate_report_cost(4000000, "III")
+    cost, desc, _ = calc.calculate_report_cost(4000000, "III")
     print(f"Камералка 4 млн., Категория III -> {cost} руб. ({desc})\n")
 
     print("=== ТЕСТ 3: Корректирующие коэффициенты (К1 и К2) ===")